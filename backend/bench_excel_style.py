@@ -0,0 +1,107 @@
+"""
+Benchmark: legacy per-cell apply_excel_style vs excel_style.style_sheet.
+
+Builds a synthetic program/estado sheet (with a NIVEL column) and times the
+styling step and the full to_excel + style + save round trip for each.
+
+    python bench_excel_style.py            # 100k rows
+    python bench_excel_style.py 20000
+"""
+import io
+import sys
+import time
+import numpy as np
+import pandas as pd
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from excel_style import style_sheet
+
+
+def legacy_apply_excel_style(worksheet, sheet_name="Sheet1"):
+    """Verbatim copy of the former routes.dashboard.apply_excel_style, for comparison."""
+    # Styling constants
+    header_fill = PatternFill(start_color='1E3A8A', end_color='1E3A8A', fill_type='solid') # Blue-900
+    header_font = Font(color='FFFFFF', bold=True, size=11)
+    center_alignment = Alignment(horizontal='center', vertical='center')
+    border = Border(
+        left=Side(style='thin', color='E2E8F0'),
+        right=Side(style='thin', color='E2E8F0'),
+        top=Side(style='thin', color='E2E8F0'),
+        bottom=Side(style='thin', color='E2E8F0')
+    )
+
+    # Format Headers (First Row)
+    for cell in worksheet[1]:
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = center_alignment
+        cell.border = border
+
+    # Auto-adjust column width and alternate row shading
+    for col in worksheet.columns:
+        max_length = 0
+        column = col[0].column_letter # Get the column name
+        for cell in col:
+            try:
+                if len(str(cell.value)) > max_length:
+                    max_length = len(str(cell.value))
+
+                # Apply borders and padding-like styling
+                if cell.row > 1:
+                    cell.border = border
+
+                    # Colores condicionales para el NIVEL
+                    val_str = str(cell.value).upper() if cell.value else ""
+                    if val_str == "GRADO":
+                        cell.fill = PatternFill(start_color='DBEAFE', end_color='DBEAFE', fill_type='solid') # Azul claro
+                        cell.font = Font(color='1E40AF', bold=True) # Azul oscuro
+                    elif val_str == "POSGRADO":
+                        cell.fill = PatternFill(start_color='F3E8FF', end_color='F3E8FF', fill_type='solid') # Violeta claro
+                        cell.font = Font(color='6B21A8', bold=True) # Violeta oscuro
+                    elif cell.row % 2 == 0:
+                        cell.fill = PatternFill(start_color='F8FAFC', end_color='F8FAFC', fill_type='solid')
+            except:
+                pass
+        adjusted_width = (max_length + 4)
+        worksheet.column_dimensions[column].width = min(adjusted_width, 50) # Cap width
+
+
+def make_frame(n_rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    programs = np.array([f"PROGRAMA DE PRUEBA {i:03d}" for i in range(120)], dtype=object)
+    return pd.DataFrame({
+        "PROGRAMA": programs[rng.integers(0, len(programs), n_rows)],
+        "NIVEL": np.where(rng.random(n_rows) < 0.6, "GRADO", "POSGRADO"),
+        "AREA": np.array(["SALUD", "INGENIERIA", "NEGOCIOS", "DERECHO"], dtype=object)[rng.integers(0, 4, n_rows)],
+        "LEADS": rng.integers(0, 5000, n_rows),
+        "EN GESTION": rng.integers(0, 2000, n_rows),
+        "PAGADOS": rng.integers(0, 300, n_rows),
+        "CONVERSION %": rng.random(n_rows).round(4) * 100,
+    })
+
+
+def run(label: str, frame: pd.DataFrame, style) -> dict:
+    output = io.BytesIO()
+    started = time.perf_counter()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        frame.to_excel(writer, index=False, sheet_name="Bench")
+        styling = time.perf_counter()
+        style(writer.sheets["Bench"], frame)
+        styled = time.perf_counter()
+    total = time.perf_counter() - started
+    result = {"style_s": styled - styling, "total_s": total, "size_kb": len(output.getvalue()) // 1024}
+    print(f"{label:<8} style {result['style_s']:7.2f}s   total {total:7.2f}s   {result['size_kb']:>7} KiB")
+    return result
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    frame = make_frame(n_rows)
+    print(f"{n_rows} rows x {len(frame.columns)} columns")
+    legacy = run("legacy", frame, lambda ws, df: legacy_apply_excel_style(ws))
+    new = run("new", frame, style_sheet)
+    print(f"styling speedup x{legacy['style_s'] / max(new['style_s'], 1e-9):.0f}, "
+          f"end to end x{legacy['total_s'] / new['total_s']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
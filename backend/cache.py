@@ -1,22 +1,75 @@
 """
 In-memory cache with 1-hour TTL and change tracking for AI awareness.
 Stores pre-computed dashboard data to avoid hitting PostgreSQL on every request.
+
+Refreshes are single-flight: concurrent callers join the refresh already in
+progress. With stale-while-revalidate enabled, stale data keeps being served
+while a background task rebuilds it. Scheduled revalidations first probe cheap
+table watermarks and skip the heavy queries when nothing changed upstream.
+
+Every built snapshot is also written in full to disk, so a restart can serve
+the last-good data immediately (marked stale) while the first refresh runs.
 """
 import asyncio
 import json
-import copy
 import os
+import time
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from database import fetch_all, fetch_one
+from types import MappingProxyType
+from typing import Mapping
+import numpy as np
+from database import REFRESH, fetch_all, fetch_one
 from mapping import mapping
+from history import SnapshotHistory, history
+from indexes import PROGRAM_KEY_EXPR
+from programs_table import METRIC_FIELDS, ProgramTable
+from program_dimension import sync_program_dimension
+from shared_snapshot import SharedSnapshotStore, load_snapshot, write_snapshot
+from suggest_index import lead_suggest
+
+
+_EMPTY: Mapping = MappingProxyType({})
+
+# Tables whose write counters decide whether a scheduled refresh has anything new
+WATERMARK_TABLES = ["agg_dim_contactos_leads", "dim_contactos"]
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """One published cache state. Never mutated after it is built."""
+    data: Mapping
+    previous: Mapping | None
+    version: int
+    built_at: datetime
 
 
 class DashboardCache:
-    def __init__(self, ttl_seconds: int = 3600):
+    def __init__(
+        self,
+        ttl_seconds: int = 3600,
+        stale_while_revalidate: bool = True,
+        change_detection: bool = True,
+        max_skip_seconds: int = 6 * 3600,
+        history: SnapshotHistory | None = None,
+        warm_start_file: str | None = None,
+        retry_seconds: float = 30,
+    ):
         self.ttl = ttl_seconds
-        self.data = {}
-        self.last_refresh: datetime | None = None
-        self.previous_snapshot: dict | None = None
+        self.stale_while_revalidate = stale_while_revalidate
+        self.change_detection = change_detection
+        # Rebuild at least this often even when watermarks match: the no-util
+        # 7d/14d windows are relative to NOW() and drift without new rows
+        self.max_skip_seconds = max_skip_seconds
+        # After a failed refresh, stale reads don't start another one for this long
+        self.retry_seconds = retry_seconds
+        self.history = history
+        # Full last-good snapshot, reloaded on boot so startup doesn't wait on PostgreSQL
+        self.warm_start_file = warm_start_file
+        # Set for multi-worker deployments: only the elected leader queries PostgreSQL
+        self.shared: SharedSnapshotStore | None = None
+        self._snapshot: Snapshot | None = None
+        self._boot_previous: dict | None = None
         # Try to load persistent snapshot on boot
         backend_dir = os.path.dirname(os.path.abspath(__file__))
         self.snapshot_file = os.path.join(backend_dir, "last_snapshot.json")
@@ -24,272 +77,491 @@ class DashboardCache:
         if os.path.exists(self.snapshot_file):
             try:
                 with open(self.snapshot_file, "r") as f:
-                    self.previous_snapshot = json.load(f)
+                    self._boot_previous = json.load(f)
             except Exception as e:
                 print(f"[Cache] Failed to load snapshot: {e}")
                 
-        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+        # time.monotonic() when the current/last refresh task was started
+        self._refresh_started_at: float = 0.0
+        self.last_error: str | None = None
+        self.last_refresh_duration: float | None = None
+        self.last_validated: datetime | None = None
+        # time.monotonic() of the last failed refresh, cleared by a successful one
+        self._failed_at: float | None = None
+        # Follower: time.monotonic() of the last refresh request sent to the leader
+        self._refresh_requested_at: float | None = None
+        self._watermark: dict | None = None
+        self.probe_stats = {
+            "probes": 0,
+            "skipped": 0,
+            "refreshed": 0,
+            "last_probe_at": None,
+            "last_probe_ms": None,
+            "last_probe_error": None,
+            "watermark": None,
+        }
+
+    @property
+    def data(self) -> Mapping:
+        return self._snapshot.data if self._snapshot else _EMPTY
+
+    @property
+    def previous_snapshot(self) -> Mapping | None:
+        """Data the current snapshot replaced (or the persisted baseline before the first refresh)."""
+        return self._snapshot.previous if self._snapshot else self._boot_previous
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version if self._snapshot else 0
+
+    @property
+    def last_refresh(self) -> datetime | None:
+        return self._snapshot.built_at if self._snapshot else None
 
     @property
     def is_stale(self) -> bool:
-        if self.last_refresh is None:
+        if self.last_validated is None:
             return True
-        elapsed = (datetime.now(timezone.utc) - self.last_refresh).total_seconds()
+        elapsed = (datetime.now(timezone.utc) - self.last_validated).total_seconds()
         return elapsed >= self.ttl
 
-    async def refresh(self):
-        """Pull fresh data from PostgreSQL and store in memory."""
-        async with self._lock:
-            # Save previous snapshot for change detection and persistent trends
-            if self.data:
-                self.previous_snapshot = copy.deepcopy(self.data)
-                try:
-                    # Filter out non-serializable elements (sometimes dates aren't enough)
-                    # We save the baseline data to last_snapshot.json
-                    snap_to_save = {
-                        "total_leads": self.data.get("total_leads"),
-                        "en_gestion": self.data.get("en_gestion"),
-                        "op_venta": self.data.get("op_venta"),
-                        "proceso_pago": self.data.get("proceso_pago"),
-                        "no_util_total": self.data.get("no_util_total"),
-                        "totals": self.data.get("totals"),
-                    }
-                    with open(self.snapshot_file, "w") as f:
-                        json.dump(snap_to_save, f)
-                except Exception as e:
-                    print(f"[Cache] Could not save snapshot to file: {e}")
-
-            data = {}
-
-            # ── Get All Data in Parallel ──
-            try:
-                agg_task = fetch_all("SELECT * FROM agg_dim_contactos_leads")
-                no_util_query = """
-                    SELECT 
-                        descrip_subcat AS descripcion_sub,
-                        COUNT(*) AS leads,
-                        SUM(CASE WHEN fecha_a_utilizar::timestamp >= NOW() - INTERVAL '7 days' THEN 1 ELSE 0 END) AS leads_7d,
-                        SUM(CASE WHEN fecha_a_utilizar::timestamp >= NOW() - INTERVAL '14 days' THEN 1 ELSE 0 END) AS leads_14d
-                    FROM dim_contactos
-                    WHERE descrip_cat ILIKE '%no util%' OR descrip_cat ILIKE '%descarte%'
-                    GROUP BY descrip_subcat
-                    ORDER BY leads DESC
+    @property
+    def in_backoff(self) -> bool:
+        return self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_seconds
+
+    @property
+    def age_seconds(self) -> float | None:
+        if self.last_refresh is None:
+            return None
+        return (datetime.now(timezone.utc) - self.last_refresh).total_seconds()
+
+    @property
+    def role(self) -> str:
+        if self.shared is None:
+            return "standalone"
+        return "leader" if self.shared.is_leader else "follower"
+
+    @property
+    def is_refreshing(self) -> bool:
+        return self._refresh_task is not None and not self._refresh_task.done()
+
+    def _start_refresh(self, check_changes: bool = False) -> asyncio.Task:
+        """Return the in-flight refresh task, starting one if none is running."""
+        if not self.is_refreshing:
+            if self.role == "follower":
+                job = self._sync_shared()
+            else:
+                job = self._revalidate() if check_changes else self._refresh()
+            self._refresh_task = asyncio.create_task(job)
+            self._refresh_task.add_done_callback(_log_task_error)
+            self._refresh_started_at = time.monotonic()
+        return self._refresh_task
+
+    async def refresh(self, since: float | None = None):
+        """
+        Pull fresh data from PostgreSQL, joining any refresh already in flight.
+        `since` (time.monotonic()) is when the caller learned the data changed:
+        a joined refresh that started before that may have missed the change,
+        so one more runs after it.
+        """
+        if self.role == "follower":
+            await self._request_leader_refresh()
+            return
+        task = self._start_refresh()
+        started_at = self._refresh_started_at
+        # Shield so a cancelled caller doesn't abort the refresh other callers await
+        if await asyncio.shield(task) is False or (since is not None and started_at < since):
+            # We joined a change probe that skipped, or a refresh older than the change
+            await asyncio.shield(self._start_refresh())
+
+    async def _request_leader_refresh(self) -> bool:
+        """
+        Follower side: ask the leader for a refresh, at most once per poll
+        interval, and wait for the snapshot it publishes. True if one arrived.
+        """
+        now = time.monotonic()
+        if self._refresh_requested_at is None or now - self._refresh_requested_at >= self.shared.poll_interval:
+            self._refresh_requested_at = now
+            self.shared.request_refresh()
+        return await self._wait_for_shared(self.shared.wait_timeout)
+
+    async def _wait_for_shared(self, timeout: float) -> bool:
+        """Follower side: adopt a newer shared snapshot as soon as the leader publishes one."""
+        version = self.version
+        deadline = time.monotonic() + timeout
+        while True:
+            await asyncio.shield(self._start_refresh())
+            if self.version != version:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(0.5, remaining))
+
+    async def revalidate(self) -> bool:
+        """Refresh only if the source tables changed. Returns True if data was rebuilt."""
+        return await asyncio.shield(self._start_refresh(check_changes=self.change_detection)) is not False
+
+    async def probe_watermarks(self) -> dict:
+        """
+        Cheap change probe: write counters from pg_stat_user_tables plus the
+        max load dates of agg_dim_contactos_leads. Equal watermarks mean the
+        ETL hasn't loaded anything since the last probe.
+        """
+        stats_rows, agg_row = await asyncio.gather(
+            fetch_all(
                 """
-                no_util_task = fetch_all(no_util_query)
-                
-                results = await asyncio.gather(agg_task, no_util_task)
-                agg_rows = results[0]
-                no_util_rows = results[1]
-                data["no_util"] = [dict(r) for r in no_util_rows]
-            except Exception as e:
-                print(f"[Cache] Error during parallel fetch: {e}")
-                # Try fallback or empty defaults if needed, but gather should fail together
-                return 
+                SELECT relname, relid, n_tup_ins, n_tup_upd, n_tup_del
+                FROM pg_stat_user_tables
+                WHERE relname = ANY($1::text[])
+                """,
+                WATERMARK_TABLES,
+                workload=REFRESH,
+            ),
+            fetch_one(
+                "SELECT MAX(fecha) AS fecha, MAX(fecha_pos) AS fecha_pos, COUNT(*) AS filas FROM agg_dim_contactos_leads",
+                workload=REFRESH,
+            ),
+        )
+        watermark = {
+            r["relname"]: [int(r["relid"]), r["n_tup_ins"], r["n_tup_upd"], r["n_tup_del"]]
+            for r in stats_rows
+        }
+        watermark["agg_dim_contactos_leads_max"] = {
+            k: str(v) if v is not None else None for k, v in (agg_row or {}).items()
+        }
+        return watermark
 
-            merged_programs = []
-            
-            total_leads = 0
-            total_en_gestion = 0
-            total_op_venta = 0
-            total_proceso_pago = 0
-            total_no_util = 0
-
-            total_sol = 0
-            total_adm = 0
-            total_pag = 0
-            total_meta = 0
-            total_sol_25 = 0
-            total_adm_25 = 0
-            total_pag_25 = 0
-            total_sol_var = 0
-            total_adm_var = 0
-            total_pag_var = 0
-            
-            latest_fecha = None
-            latest_fecha_pos = None
+    async def _revalidate(self) -> bool:
+        started = time.perf_counter()
+        stats = self.probe_stats
+        watermark = await self._probe()
+        stats["last_probe_ms"] = round((time.perf_counter() - started) * 1000)
 
-            for r in agg_rows:
-                # Use standard normalization: UPPER + TRIM
-                prog = str(r.get("programa", "")).strip().upper()
-                
-                db_nivel = r.get("nivel")
-                nivel = str(db_nivel).strip().upper() if db_nivel else mapping.get_level(prog)
-                
-                db_area = r.get("area_de_conocimiento")
-                area = str(db_area).strip().upper() if db_area else mapping.get_area(prog)
-                
-                # Metric fields
-                leads = _safe_int(r.get("leads"))
-                leads_no_util = _safe_int(r.get("leads_no_util"))
-                op_venta = _safe_int(r.get("leads_op_venta"))
-                proceso_pago = _safe_int(r.get("leads_proc_pago"))
-                en_gestion = _safe_int(r.get("leads_en_gestion"))
-                toques_prom = 0.0
-                
-                # Dimension totals
-                total_leads += leads
-                total_en_gestion += en_gestion
-                total_op_venta += op_venta
-                total_proceso_pago += proceso_pago
-                total_no_util += leads_no_util
-
-                # Admission fields
-                sol = _safe_int(r.get("solicitados"))
-                adm_val = _safe_int(r.get("admitidos"))
-                pag = _safe_int(r.get("pagados"))
-                meta = _safe_int(r.get("metas"))
-                
-                sol_25 = _safe_int(r.get("solicitados_aa"))
-                adm_25 = _safe_int(r.get("admitidos_aa"))
-                pag_25 = _safe_int(r.get("pagados_aa"))
-
-                total_sol += sol
-                total_adm += adm_val
-                total_pag += pag
-                total_meta += meta
-                
-                total_sol_25 += sol_25
-                total_adm_25 += adm_25
-                total_pag_25 += pag_25
-                total_sol_var += _safe_int(r.get("solicitados_var"))
-                total_adm_var += _safe_int(r.get("admitidos_var"))
-                total_pag_var += _safe_int(r.get("pagados_var"))
-                
-                # Fetch dates to find latest
-                if r.get("fecha"):
-                    if latest_fecha is None or r.get("fecha") > latest_fecha:
-                        latest_fecha = r.get("fecha")
-                if r.get("fecha_pos"):
-                    if latest_fecha_pos is None or r.get("fecha_pos") > latest_fecha_pos:
-                        latest_fecha_pos = r.get("fecha_pos")
-                
-                merged_programs.append({
-                    "programa": prog,
-                    "nivel": nivel,
-                    "area": area,
-                    "leads": leads,
-                    "en_gestion": en_gestion,
-                    "no_util": leads_no_util,
-                    "op_venta": op_venta,
-                    "proceso_pago": proceso_pago,
-                    "toques_prom": toques_prom,
-                    "solicitados": sol,
-                    "admitidos": adm_val,
-                    "pagados": pag,
-                    "meta": meta,
-                    "solicitados_25": sol_25,
-                    "admitidos_25": adm_25,
-                    "pagados_25": pag_25,
-                    "solicitados_var": _safe_int(r.get("solicitados_var")),
-                    "admitidos_var": _safe_int(r.get("admitidos_var")),
-                    "pagados_var": _safe_int(r.get("pagados_var"))
-                })
-                
-            data["merged_programs"] = merged_programs
-            
-            # KPI Totals
-            data["total_leads"] = total_leads
-            data["en_gestion"] = total_en_gestion
-            data["op_venta"] = total_op_venta
-            data["proceso_pago"] = total_proceso_pago
-            
-            # Use the sum from the subcategory breakdown to ensure percentages are consistent
-            data["no_util_total"] = sum(item.get("leads", 0) for item in data.get("no_util", []))
-
-            data["totals"] = {
-                "solicitados": total_sol,
-                "admitidos": total_adm,
-                "pagados": total_pag,
-                "metas": total_meta,
-                "solicitados_25": total_sol_25,
-                "admitidos_25": total_adm_25,
-                "pagados_25": total_pag_25,
-                "solicitados_var": total_sol_var,
-                "admitidos_var": total_adm_var,
-                "pagados_var": total_pag_var,
-            }
+        age = self.age_seconds
+        if (
+            watermark is not None
+            and watermark == self._watermark
+            and self.data
+            and age is not None
+            and age < self.max_skip_seconds
+        ):
+            stats["skipped"] += 1
+            self.last_validated = datetime.now(timezone.utc)
+            print(f"[Cache] Source tables unchanged, skipping refresh ({stats['skipped']} skipped so far)")
+            return False
+
+        await self._refresh(watermark)
+        if self.last_error is None:
+            stats["refreshed"] += 1
+        return True
+
+    async def _probe(self) -> dict | None:
+        """probe_watermarks(), recorded in probe_stats; None if the probe failed."""
+        stats = self.probe_stats
+        stats["probes"] += 1
+        stats["last_probe_at"] = datetime.now(timezone.utc).isoformat()
+        try:
+            watermark = await self.probe_watermarks()
+            stats["last_probe_error"] = None
+        except Exception as e:
+            # Can't tell what changed; the caller falls back to a full refresh
+            print(f"[Cache] Watermark probe failed: {e}")
+            stats["last_probe_error"] = str(e)
+            watermark = None
+        stats["watermark"] = watermark
+        return watermark
 
+    def status(self) -> dict:
+        """Data age and refresh state, for API callers and monitoring."""
+        age = self.age_seconds
+        return {
+            "last_refresh": self.last_refresh.isoformat() if self.last_refresh else None,
+            "version": self.version,
+            "role": self.role,
+            "age_seconds": round(age, 1) if age is not None else None,
+            "ttl_seconds": self.ttl,
+            "stale": self.is_stale,
+            "refreshing": self.is_refreshing,
+            "stale_while_revalidate": self.stale_while_revalidate,
+            "last_refresh_duration_ms": (
+                round(self.last_refresh_duration * 1000) if self.last_refresh_duration is not None else None
+            ),
+            "last_error": self.last_error,
+            "retry_in_seconds": (
+                round(self.retry_seconds - (time.monotonic() - self._failed_at), 1) if self.in_backoff else None
+            ),
+            "last_validated": self.last_validated.isoformat() if self.last_validated else None,
+            "change_detection": {"enabled": self.change_detection, **self.probe_stats},
+        }
+
+    async def _refresh(self, watermark: dict | None = None):
+        """
+        Pull fresh data from PostgreSQL and build a new snapshot off to the side.
+        Readers keep using the current snapshot until it is replaced in one swap.
+        `watermark`: the probe the caller already made, else one is made here.
+        """
+        started = time.perf_counter()
+        if watermark is None and self.change_detection:
+            # Probed before the fetch: rows the ETL loads meanwhile change it again, so
+            # the next probe refreshes instead of mistaking them for already loaded
+            watermark = await self._probe()
+        # The outgoing snapshot becomes the baseline for trends, kept by reference
+        current = self._snapshot
+        previous = current.data if current else self._boot_previous
+
+        data = {}
+
+        # ── Get All Data in Parallel ──
+        try:
+            agg_task = fetch_all("SELECT * FROM agg_dim_contactos_leads", workload=REFRESH)
+            no_util_query = """
+                SELECT 
+                    descrip_subcat AS descripcion_sub,
+                    COUNT(*) AS leads,
+                    SUM(CASE WHEN fecha_a_utilizar::timestamp >= NOW() - INTERVAL '7 days' THEN 1 ELSE 0 END) AS leads_7d,
+                    SUM(CASE WHEN fecha_a_utilizar::timestamp >= NOW() - INTERVAL '14 days' THEN 1 ELSE 0 END) AS leads_14d
+                FROM dim_contactos
+                WHERE descrip_cat ILIKE '%no util%' OR descrip_cat ILIKE '%descarte%'
+                GROUP BY descrip_subcat
+                ORDER BY leads DESC
+            """
+            no_util_task = fetch_all(no_util_query, workload=REFRESH)
+            catalog_task = _fetch_catalog()
             
-            # Funnel for the chart
-            data["funnel"] = [
-                {"stage": "Total Leads", "value": data["total_leads"], "color": "#f59e0b"},
-                {"stage": "En Gestión", "value": data["en_gestion"], "color": "#d97706"},
-                {"stage": "Oportunidad de Venta", "value": data["op_venta"], "color": "#ea580c"},
-                {"stage": "Proceso Pago", "value": data["proceso_pago"], "color": "#dc2626"},
-                {"stage": "Matriculados", "value": total_pag, "color": "#16a34a"}, 
-            ]
-
-            # ── Last update date ──
-            if latest_fecha_pos:
-                data["fecha_actualizacion"] = latest_fecha_pos.strftime("%d/%m/%Y %H:%M")
-            elif latest_fecha:
-                data["fecha_actualizacion"] = latest_fecha.strftime("%d/%m/%Y %H:%M")
-            else:
-                data["fecha_actualizacion"] = datetime.now().strftime("%d/%m/%Y %H:%M")
+            results = await asyncio.gather(agg_task, no_util_task, catalog_task)
+            agg_rows = results[0]
+            no_util_rows = results[1]
+            data["no_util"] = [dict(r) for r in no_util_rows]
+            # A failed catalog query keeps the previous catalog instead of failing the refresh
+            data["catalog"] = results[2] if results[2] is not None else (current.data.get("catalog") if current else None)
+        except Exception as e:
+            print(f"[Cache] Error during parallel fetch: {e}")
+            self.last_error = str(e)
+            self._failed_at = time.monotonic()
+            # Try fallback or empty defaults if needed, but gather should fail together
+            return 
 
-            # Calculate actual update trends
-            trends = {
-                "total_leads": 0, "matriculados": 0, "en_gestion": 0, "pagados": 0,
-                "op_venta": 0, "proceso_pago": 0, "no_util": 0
-            }
+        columns = {field: [] for field in ["programa", "nivel", "area", *METRIC_FIELDS]}
+        
+        latest_fecha = None
+        latest_fecha_pos = None
+
+        for r in agg_rows:
+            # Use standard normalization: UPPER + TRIM
+            prog = str(r.get("programa", "")).strip().upper()
             
-            def calc_trend(prev_v, curr_v):
-                if not prev_v or prev_v == 0: return 0.0
-                return round(((curr_v - prev_v) / prev_v) * 100, 1)
-
-            if self.previous_snapshot:
-                prev = self.previous_snapshot
-                trends["total_leads"] = calc_trend(prev.get("total_leads", 0), data["total_leads"])
-                trends["en_gestion"] = calc_trend(prev.get("en_gestion", 0), data["en_gestion"])
-                trends["op_venta"] = calc_trend(prev.get("op_venta", 0), data["op_venta"])
-                trends["proceso_pago"] = calc_trend(prev.get("proceso_pago", 0), data["proceso_pago"])
-                trends["no_util"] = calc_trend(prev.get("no_util_total", 0), data["no_util_total"])
-                
-                prev_totals = prev.get("totals", {})
-                trends["matriculados"] = calc_trend(prev_totals.get("pagados", 0), data["totals"]["pagados"])
-                trends["pagados"] = calc_trend(prev_totals.get("pagados", 0), data["totals"]["pagados"])
-            elif data.get("totals"):
-                # Fallback to DB variance columns if no snapshot exists
-                t = data["totals"]
-                # For Pagados/Matriculados we have _var
-                trends["matriculados"] = calc_trend(t.get("pagados", 0) - t.get("pagados_var", 0), t.get("pagados", 0))
-                trends["pagados"] = trends["matriculados"]
-                # Others don't have _var, they stay at 0 until next refresh
+            db_nivel = r.get("nivel")
+            nivel = str(db_nivel).strip().upper() if db_nivel else mapping.get_level(prog)
             
-            data["trends"] = trends
+            db_area = r.get("area_de_conocimiento")
+            area = str(db_area).strip().upper() if db_area else mapping.get_area(prog)
+
+            columns["programa"].append(prog)
+            columns["nivel"].append(nivel)
+            columns["area"].append(area)
+            for field, src in _AGG_COLUMNS.items():
+                columns[field].append(_safe_int(r.get(src)))
             
-            self.data = data
-            self.last_refresh = datetime.now(timezone.utc)
-            print(f"[Cache] Refreshed at {self.last_refresh.isoformat()} — {data.get('total_leads', 0)} leads loaded")
+            # Fetch dates to find latest
+            if r.get("fecha"):
+                if latest_fecha is None or r.get("fecha") > latest_fecha:
+                    latest_fecha = r.get("fecha")
+            if r.get("fecha_pos"):
+                if latest_fecha_pos is None or r.get("fecha_pos") > latest_fecha_pos:
+                    latest_fecha_pos = r.get("fecha_pos")
+
+        # Column arrays; program dicts are only materialized at the response boundary
+        programs = ProgramTable.from_columns(columns)
+        data["programs"] = programs
+
+        # Pre-aggregated (nivel, area) rollups so filtered requests don't rescan programs
+        data["rollups"] = _build_rollups(programs)
+        overall = get_rollup(data)
+        
+        # KPI Totals
+        data["total_leads"] = overall["total_leads"]
+        data["en_gestion"] = overall["en_gestion"]
+        data["op_venta"] = overall["op_venta"]
+        data["proceso_pago"] = overall["proceso_pago"]
+        
+        # Use the sum from the subcategory breakdown to ensure percentages are consistent
+        data["no_util_total"] = sum(item.get("leads", 0) for item in data.get("no_util", []))
+
+        data["totals"] = dict(overall["totals"])
+        
+        # Funnel for the chart
+        data["funnel"] = overall["funnel"]
+
+        # ── Last update date ──
+        if latest_fecha_pos:
+            data["fecha_actualizacion"] = latest_fecha_pos.strftime("%d/%m/%Y %H:%M")
+        elif latest_fecha:
+            data["fecha_actualizacion"] = latest_fecha.strftime("%d/%m/%Y %H:%M")
+        else:
+            data["fecha_actualizacion"] = datetime.now().strftime("%d/%m/%Y %H:%M")
+
+        # Calculate actual update trends
+        trends = {
+            "total_leads": 0, "matriculados": 0, "en_gestion": 0, "pagados": 0,
+            "op_venta": 0, "proceso_pago": 0, "no_util": 0
+        }
+        
+        def calc_trend(prev_v, curr_v):
+            if not prev_v or prev_v == 0: return 0.0
+            return round(((curr_v - prev_v) / prev_v) * 100, 1)
+
+        if previous:
+            prev = previous
+            trends["total_leads"] = calc_trend(prev.get("total_leads", 0), data["total_leads"])
+            trends["en_gestion"] = calc_trend(prev.get("en_gestion", 0), data["en_gestion"])
+            trends["op_venta"] = calc_trend(prev.get("op_venta", 0), data["op_venta"])
+            trends["proceso_pago"] = calc_trend(prev.get("proceso_pago", 0), data["proceso_pago"])
+            trends["no_util"] = calc_trend(prev.get("no_util_total", 0), data["no_util_total"])
             
-            # Diagnostic logging for refresh
-            if data:
-                merged = data.get("merged_programs", [])
-                levels = {}
-                for p in merged:
-                    lvl = p.get("nivel", "MISSING")
-                    levels[lvl] = levels.get(lvl, 0) + 1
-                print(f"[Cache] refresh: {len(merged)} programs, levels: {levels}")
+            prev_totals = prev.get("totals", {})
+            trends["matriculados"] = calc_trend(prev_totals.get("pagados", 0), data["totals"]["pagados"])
+            trends["pagados"] = calc_trend(prev_totals.get("pagados", 0), data["totals"]["pagados"])
+        elif data.get("totals"):
+            # Fallback to DB variance columns if no snapshot exists
+            t = data["totals"]
+            # For Pagados/Matriculados we have _var
+            trends["matriculados"] = calc_trend(t.get("pagados", 0) - t.get("pagados_var", 0), t.get("pagados", 0))
+            trends["pagados"] = trends["matriculados"]
+            # Others don't have _var, they stay at 0 until next refresh
+        
+        data["trends"] = trends
+        
+        # Publish: a single reference swap, no copying and no lock held while building
+        self._snapshot = Snapshot(
+            data=MappingProxyType(data),
+            previous=previous,
+            version=(current.version + 1) if current else 1,
+            built_at=datetime.now(timezone.utc),
+        )
+        self.last_validated = self._snapshot.built_at
+        self.last_refresh_duration = time.perf_counter() - started
+        self.last_error = None
+        self._failed_at = None
+        self._watermark = watermark
+        print(f"[Cache] Refreshed at {self.last_refresh.isoformat()} — {data.get('total_leads', 0)} leads loaded")
+        
+        # Diagnostic logging for refresh
+        levels = {
+            key.split("|", 1)[0]: len(r["index"])
+            for key, r in data["rollups"].items()
+            if key.endswith("|*") and not key.startswith("*|")
+        }
+        print(f"[Cache] refresh: {len(programs)} programs, levels: {levels}")
 
+        # Keep the SQL-side program -> nivel/area table in line with this classification
+        await sync_program_dimension(programs)
+        # Typeahead index over the new data, built in the background
+        lead_suggest.rebuild(
+            self._snapshot.version, programs,
+            watermark=watermark.get("dim_contactos") if watermark else None,
+            publish_path=self.shared.suggest_index_path if self.role == "leader" else None,
+        )
 
-    async def get(self, key: str, default=None):
-        if self.is_stale:
+        # Persist the trend baseline, history and shared copy without blocking the event loop
+        if current:
+            try:
+                await asyncio.to_thread(_write_json_atomic, self.snapshot_file, _baseline_fields(current.data))
+            except Exception as e:
+                print(f"[Cache] Could not save snapshot to file: {e}")
+        if self.history is not None:
+            try:
+                await asyncio.to_thread(self.history.append, self._snapshot.built_at, self._snapshot.data)
+            except Exception as e:
+                print(f"[Cache] Could not append snapshot to history: {e}")
+        snapshot = self._snapshot
+        if self.warm_start_file:
+            try:
+                await asyncio.to_thread(
+                    write_snapshot, self.warm_start_file, snapshot.data, snapshot.version, snapshot.built_at
+                )
+            except Exception as e:
+                print(f"[Cache] Could not save warm start snapshot: {e}")
+        if self.role == "leader":
+            # Other workers map this file instead of querying PostgreSQL themselves
+            try:
+                await asyncio.to_thread(self.shared.publish, snapshot.data, snapshot.version, snapshot.built_at)
+            except Exception as e:
+                print(f"[Cache] Could not publish shared snapshot: {e}")
+
+    async def _sync_shared(self) -> bool:
+        """Follower side: adopt the leader's snapshot if its version changed."""
+        self.last_validated = datetime.now(timezone.utc)
+        # The leader publishes the typeahead index some time after the snapshot
+        lead_suggest.load_shared(self.shared.suggest_index_path)
+        if self.shared.current_version() in (0, self.version):
+            return False
+        loaded = await asyncio.to_thread(self.shared.load)
+        if loaded is None:
+            return False
+        self._adopt(*loaded)
+        print(f"[Cache] Loaded shared snapshot v{self.version} built at {self.last_refresh.isoformat()}")
+        return True
+
+    def load_warm_start(self) -> bool:
+        """
+        Adopt the snapshot persisted by a previous run. It is served as stale
+        (last_validated stays unset) until the first refresh confirms or replaces it.
+        """
+        if not self.warm_start_file or self._snapshot is not None:
+            return False
+        try:
+            loaded = load_snapshot(self.warm_start_file)
+        except Exception as e:
+            print(f"[Cache] Failed to load warm start snapshot: {e}")
+            return False
+        if loaded is None:
+            return False
+        self._adopt(*loaded)
+        print(f"[Cache] Warm start from snapshot v{self.version} built at {self.last_refresh.isoformat()}")
+        if self.role == "leader" and self.shared.current_version() < self.version:
+            # Followers serve it too right away instead of waiting for the first full refresh
+            try:
+                self.shared.publish(self.data, self.version, self.last_refresh)
+            except Exception as e:
+                print(f"[Cache] Could not publish warm start snapshot: {e}")
+        return True
+
+    def _adopt(self, data: dict, version: int, built_at: datetime):
+        """Publish a snapshot loaded from disk; rollups are derived, never stored."""
+        data["rollups"] = _build_rollups(data["programs"])
+        current = self._snapshot
+        self._snapshot = Snapshot(
+            data=MappingProxyType(data),
+            previous=current.data if current else self._boot_previous,
+            version=version,
+            built_at=built_at,
+        )
+        lead_suggest.set_programs(data["programs"], version)
+
+    async def _ensure_fresh(self):
+        if not self.is_stale:
+            return
+        if self.in_backoff and not self.is_refreshing:
+            # The last refresh just failed: don't start one per request against a database that is down
+            return
+        if self.role == "follower" and not self.data:
+            # The leader loads the first snapshot on its own: wait for it instead of re-requesting
+            await self._wait_for_shared(self.shared.wait_timeout)
+            return
+        if self.data and self.stale_while_revalidate:
+            # Serve what we have; a single background task rebuilds the snapshot
+            self._start_refresh(check_changes=self.change_detection)
+        else:
             await self.refresh()
+
+    async def get(self, key: str, default=None):
+        await self._ensure_fresh()
         return self.data.get(key, default)
 
     async def get_all(self) -> dict:
-        if self.is_stale:
-            await self.refresh()
-        
-        # Diagnostic logging
-        if self.data:
-            merged = self.data.get("merged_programs", [])
-            levels = {}
-            for p in merged:
-                lvl = p.get("nivel", "MISSING")
-                levels[lvl] = levels.get(lvl, 0) + 1
-            print(f"[Cache] get_all: {len(merged)} programs, levels: {levels}")
-            
+        await self._ensure_fresh()
         return self.data
 
     def get_changes_summary(self) -> str:
@@ -325,6 +597,209 @@ class DashboardCache:
         return "Cambios desde la última actualización:\n" + "\n".join(changes)
 
 
+ROLLUP_ALL = "*"
+
+_FUNNEL_STAGES = [
+    ("Total Leads", "#f59e0b"),
+    ("En Gestión", "#d97706"),
+    ("Oportunidad de Venta", "#ea580c"),
+    ("Proceso Pago", "#dc2626"),
+    ("Matriculados", "#16a34a"),
+]
+
+# ProgramTable metric -> agg_dim_contactos_leads column
+_AGG_COLUMNS = {
+    "leads": "leads",
+    "en_gestion": "leads_en_gestion",
+    "no_util": "leads_no_util",
+    "op_venta": "leads_op_venta",
+    "proceso_pago": "leads_proc_pago",
+    "solicitados": "solicitados",
+    "admitidos": "admitidos",
+    "pagados": "pagados",
+    "meta": "metas",
+    "solicitados_25": "solicitados_aa",
+    "admitidos_25": "admitidos_aa",
+    "pagados_25": "pagados_aa",
+    "solicitados_var": "solicitados_var",
+    "admitidos_var": "admitidos_var",
+    "pagados_var": "pagados_var",
+}
+
+_ROLLUP_SUMS = {
+    # rollup field -> program field
+    "total_leads": "leads",
+    "en_gestion": "en_gestion",
+    "op_venta": "op_venta",
+    "proceso_pago": "proceso_pago",
+    "no_util_total": "no_util",
+}
+
+_ROLLUP_TOTALS = {
+    "solicitados": "solicitados",
+    "admitidos": "admitidos",
+    "pagados": "pagados",
+    "metas": "meta",
+    "solicitados_25": "solicitados_25",
+    "admitidos_25": "admitidos_25",
+    "pagados_25": "pagados_25",
+    "solicitados_var": "solicitados_var",
+    "admitidos_var": "admitidos_var",
+    "pagados_var": "pagados_var",
+}
+
+
+def _build_funnel(total_leads, en_gestion, op_venta, proceso_pago, pagados) -> list:
+    values = [total_leads, en_gestion, op_venta, proceso_pago, pagados]
+    return [
+        {"stage": stage, "value": value, "color": color}
+        for (stage, color), value in zip(_FUNNEL_STAGES, values)
+    ]
+
+
+def _rollup_key(nivel: str | None, area: str | None) -> str:
+    return f"{nivel or ROLLUP_ALL}|{area or ROLLUP_ALL}"
+
+
+def _make_rollup(sums, index: np.ndarray) -> dict:
+    """Rollup from a metric-sum vector (ordered as METRIC_FIELDS) and its program rows."""
+    by_field = dict(zip(METRIC_FIELDS, (int(v) for v in sums)))
+    rollup = {field: by_field[src] for field, src in _ROLLUP_SUMS.items()}
+    rollup["totals"] = {field: by_field[src] for field, src in _ROLLUP_TOTALS.items()}
+    rollup["funnel"] = _build_funnel(
+        rollup["total_leads"], rollup["en_gestion"], rollup["op_venta"],
+        rollup["proceso_pago"], rollup["totals"]["pagados"],
+    )
+    rollup["index"] = index
+    return rollup
+
+
+def _build_rollups(programs: ProgramTable) -> dict:
+    """
+    Aggregate programs once per refresh into every (nivel, area) combination,
+    including the '*' wildcards, so filtered requests become a dict lookup.
+    """
+    grouped = programs.grouped_sums()
+    rollups = {}
+    for i, nivel in enumerate(programs.nivel_categories):
+        for j, area in enumerate(programs.area_categories):
+            index = programs.select(nivel, area)
+            if len(index):
+                rollups[_rollup_key(nivel, area)] = _make_rollup(grouped[i, j], index)
+        rollups[_rollup_key(nivel, None)] = _make_rollup(grouped[i].sum(axis=0), programs.select(nivel))
+    for j, area in enumerate(programs.area_categories):
+        rollups[_rollup_key(None, area)] = _make_rollup(grouped[:, j].sum(axis=0), programs.select(area=area))
+    if len(programs):
+        rollups[_rollup_key(None, None)] = _make_rollup(grouped.sum(axis=(0, 1)), programs.select())
+    return rollups
+
+
+def normalize_filter(value: str | None) -> str | None:
+    value = value.strip().upper() if value else None
+    return value if value and value != "TODOS" else None
+
+
+def get_rollup(data: Mapping, nivel: str | None = None, area: str | None = None) -> dict:
+    """
+    Look up the pre-aggregated rollup for a nivel/area filter.
+    'TODOS' or empty values mean no filter on that dimension.
+    """
+    rollup = data.get("rollups", {}).get(_rollup_key(normalize_filter(nivel), normalize_filter(area)))
+    if rollup is None:
+        rollup = _make_rollup([0] * len(METRIC_FIELDS), np.empty(0, dtype=np.int64))
+    return rollup
+
+
+def get_programs(data: Mapping, nivel: str | None = None, area: str | None = None) -> list[dict]:
+    """Program rows as dicts for a nivel/area filter (materialized on demand)."""
+    programs = data.get("programs")
+    if programs is None:
+        return []
+    return programs.records(get_rollup(data, nivel, area)["index"])
+
+
+def get_program_names(data: Mapping, nivel: str | None = None, area: str | None = None) -> list[str]:
+    programs = data.get("programs")
+    if programs is None:
+        return []
+    return programs.names(get_rollup(data, nivel, area)["index"])
+
+
+# Catalog dimension -> dim_contactos expression; one GROUPING SETS scan counts them all
+_CATALOG_DIMENSIONS = {
+    "bases": "base",
+    "estados": "ultima_mejor_subcat_string",
+    "subcategorias": "descrip_subcat",
+    "programas": PROGRAM_KEY_EXPR,
+}
+
+CATALOG_QUERY = f"""
+    SELECT {", ".join(f"{expr} AS {name}" for name, expr in _CATALOG_DIMENSIONS.items())},
+           {", ".join(f"GROUPING({expr}) AS g_{name}" for name, expr in _CATALOG_DIMENSIONS.items())},
+           COUNT(*) AS leads
+    FROM dim_contactos
+    GROUP BY GROUPING SETS ({", ".join(f"({expr})" for expr in _CATALOG_DIMENSIONS.values())})
+    ORDER BY {", ".join(_CATALOG_DIMENSIONS)}
+"""
+
+
+def _build_catalog(rows: list[dict]) -> dict:
+    """Distinct non-null values with lead counts per dimension, in the query's (collation) order."""
+    catalog = {name: [] for name in _CATALOG_DIMENSIONS}
+    for r in rows:
+        for name in _CATALOG_DIMENSIONS:
+            if r[f"g_{name}"] == 0:
+                if r[name] is not None:
+                    catalog[name].append({"value": r[name], "leads": _safe_int(r["leads"])})
+                break
+    return catalog
+
+
+async def _fetch_catalog() -> dict | None:
+    try:
+        rows = await fetch_all(CATALOG_QUERY, workload=REFRESH)
+    except Exception as e:
+        print(f"[Cache] Catalog query failed, keeping the previous catalog: {e}")
+        return None
+    return _build_catalog(rows)
+
+
+def get_catalog_values(data: Mapping, dimension: str) -> list | None:
+    """Catalog values of one dimension, or None if the snapshot predates the catalog."""
+    catalog = data.get("catalog")
+    if catalog is None:
+        return None
+    return [item["value"] for item in catalog.get(dimension, [])]
+
+
+def _baseline_fields(data: Mapping) -> dict:
+    """The subset of a snapshot persisted to last_snapshot.json as the trend baseline."""
+    return {
+        "total_leads": data.get("total_leads"),
+        "en_gestion": data.get("en_gestion"),
+        "op_venta": data.get("op_venta"),
+        "proceso_pago": data.get("proceso_pago"),
+        "no_util_total": data.get("no_util_total"),
+        "totals": data.get("totals"),
+    }
+
+
+def _write_json_atomic(path: str, payload: dict):
+    """Write to a temp file and rename over the target so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _log_task_error(task: asyncio.Task):
+    """Retrieve background refresh errors so they are logged instead of lost."""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[Cache] Background refresh failed: {task.exception()}")
+
+
 def _safe_int(val) -> int:
     """Safely convert a value to int, returning 0 for None/empty/non-numeric."""
     if val is None or val == "" or val == "None":
@@ -345,4 +820,15 @@ def _safe_float(val) -> float:
 
 
 # Global singleton
-cache = DashboardCache(ttl_seconds=3600)
+cache = DashboardCache(
+    ttl_seconds=3600,
+    stale_while_revalidate=os.getenv("CACHE_STALE_WHILE_REVALIDATE", "1") != "0",
+    change_detection=os.getenv("CACHE_CHANGE_DETECTION", "1") != "0",
+    max_skip_seconds=int(os.getenv("CACHE_MAX_SKIP_SECONDS", str(6 * 3600))),
+    history=history if os.getenv("HISTORY_ENABLED", "1") != "0" else None,
+    warm_start_file=(
+        os.getenv("CACHE_WARM_START_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "full_snapshot.bin"))
+        if os.getenv("CACHE_WARM_START", "1") != "0" else None
+    ),
+    retry_seconds=float(os.getenv("CACHE_RETRY_SECONDS", "30")),
+)
@@ -0,0 +1,19 @@
+import asyncio
+import sys
+from database import connect
+
+# Usage: python check_notify.py [channel] [payload]
+# Sends the NOTIFY the ETL would emit, to test the cache listener against a local Postgres.
+
+async def main():
+    channel = sys.argv[1] if len(sys.argv) > 1 else "agg_dim_contactos_leads"
+    payload = sys.argv[2] if len(sys.argv) > 2 else "manual"
+    conn = await connect()
+    try:
+        await conn.execute("SELECT pg_notify($1, $2)", channel, payload)
+        print(f"Sent NOTIFY on '{channel}' with payload '{payload}'")
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,43 +1,340 @@
+"""
+PostgreSQL access through workload-isolated connection pools.
+
+Interactive requests, heavy exports and cache refreshes each get their own
+pool (bulkhead), with its own size, statement_timeout and queue limit, so a
+few concurrent exports can't starve the dashboard. When a workload's pool and
+queue are full, callers fail fast with PoolSaturated (served as 503 with
+Retry-After) instead of piling up.
+
+Per workload, e.g. for export: DB_POOL_EXPORT_MIN, DB_POOL_EXPORT_MAX,
+DB_POOL_EXPORT_TIMEOUT_MS (statement_timeout), DB_POOL_EXPORT_QUEUE (callers
+allowed to wait), DB_POOL_EXPORT_ACQUIRE_TIMEOUT, DB_POOL_EXPORT_RETRY_AFTER.
+"""
+import asyncio
 import os
+import time
+from contextlib import asynccontextmanager
 import asyncpg
 from dotenv import load_dotenv
+from query_stats import query_stats
 
 load_dotenv()
 
-_pool = None
+# Keeps sampled EXPLAIN tasks referenced until they finish
+_explain_tasks: set = set()
+
+
+def connect_kwargs() -> dict:
+    """Connection settings shared by the pool and dedicated connections."""
+    return dict(
+        host=os.getenv("DB_HOST", "77.37.68.210"),
+        port=int(os.getenv("DB_PORT", "5432")),
+        database=os.getenv("DB_NAME", "unab"),
+        user=os.getenv("DB_USER", "nicoyapur"),
+        password=os.getenv("DB_PASSWORD", "Yapur2025###"),
+    )
+
+
+class PoolSaturated(Exception):
+    """A workload's connections and wait queue are all taken."""
+
+    def __init__(self, workload: str, retry_after: int):
+        super().__init__(f"Database pool '{workload}' is saturated")
+        self.workload = workload
+        self.retry_after = retry_after
+
+
+class Workload:
+    """One bulkhead: a lazily created pool plus admission control in front of it."""
 
+    def __init__(
+        self,
+        name: str,
+        min_size: int,
+        max_size: int,
+        statement_timeout_ms: int,
+        queue_limit: int,
+        acquire_timeout: float,
+        retry_after: int,
+    ):
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_timeout_ms = statement_timeout_ms
+        self.queue_limit = queue_limit
+        self.acquire_timeout = acquire_timeout
+        self.retry_after = retry_after
+        self.pool: asyncpg.Pool | None = None
+        # Concurrent first callers must not each create a pool
+        self._init_lock = asyncio.Lock()
+        # Callers holding or waiting for a connection
+        self.pending = 0
+        self.rejected = 0
 
-async def get_pool():
-    global _pool
-    if _pool is None:
-        _pool = await asyncpg.create_pool(
-            host=os.getenv("DB_HOST", "77.37.68.210"),
-            port=int(os.getenv("DB_PORT", "5432")),
-            database=os.getenv("DB_NAME", "unab"),
-            user=os.getenv("DB_USER", "nicoyapur"),
-            password=os.getenv("DB_PASSWORD", "Yapur2025###"),
-            min_size=2,
-            max_size=10,
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "Workload":
+        prefix = f"DB_POOL_{name.upper()}_"
+        return cls(
+            name,
+            min_size=int(os.getenv(prefix + "MIN", defaults["min_size"])),
+            max_size=int(os.getenv(prefix + "MAX", defaults["max_size"])),
+            statement_timeout_ms=int(os.getenv(prefix + "TIMEOUT_MS", defaults["statement_timeout_ms"])),
+            queue_limit=int(os.getenv(prefix + "QUEUE", defaults["queue_limit"])),
+            acquire_timeout=float(os.getenv(prefix + "ACQUIRE_TIMEOUT", defaults["acquire_timeout"])),
+            retry_after=int(os.getenv(prefix + "RETRY_AFTER", defaults["retry_after"])),
         )
-    return _pool
+
+    async def get_pool(self) -> asyncpg.Pool:
+        if self.pool is None:
+            async with self._init_lock:
+                if self.pool is None:
+                    self.pool = await asyncpg.create_pool(
+                        **connect_kwargs(),
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        server_settings={
+                            "statement_timeout": str(self.statement_timeout_ms),
+                            "application_name": f"unab_dashboard_{self.name}",
+                        },
+                    )
+        return self.pool
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self.pending >= self.max_size + self.queue_limit:
+            self.rejected += 1
+            raise PoolSaturated(self.name, self.retry_after)
+        self.pending += 1
+        try:
+            pool = await self.get_pool()
+            try:
+                conn = await pool.acquire(timeout=self.acquire_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise PoolSaturated(self.name, self.retry_after)
+            try:
+                yield conn
+            finally:
+                await pool.release(conn)
+        finally:
+            self.pending -= 1
+
+    def status(self) -> dict:
+        pool = self.pool
+        return {
+            "size": pool.get_size() if pool else 0,
+            "idle": pool.get_idle_size() if pool else 0,
+            "max_size": self.max_size,
+            "pending": self.pending,
+            "queue_limit": self.queue_limit,
+            "rejected": self.rejected,
+            "statement_timeout_ms": self.statement_timeout_ms,
+        }
+
+    async def close(self):
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            await pool.close()
+
+
+INTERACTIVE = "interactive"
+EXPORT = "export"
+REFRESH = "refresh"
+
+workloads = {
+    # Dashboard requests: short queries, fail fast
+    INTERACTIVE: Workload.from_env(
+        INTERACTIVE, min_size=2, max_size=8, statement_timeout_ms=15000,
+        queue_limit=50, acquire_timeout=5, retry_after=1,
+    ),
+    # Excel/CSV downloads: few at a time, long statements allowed
+    EXPORT: Workload.from_env(
+        EXPORT, min_size=0, max_size=2, statement_timeout_ms=300000,
+        queue_limit=4, acquire_timeout=30, retry_after=15,
+    ),
+    # Cache refreshes and change probes
+    REFRESH: Workload.from_env(
+        REFRESH, min_size=0, max_size=3, statement_timeout_ms=120000,
+        queue_limit=10, acquire_timeout=60, retry_after=5,
+    ),
+}
+
+
+async def get_pool(workload: str = INTERACTIVE) -> asyncpg.Pool:
+    return await workloads[workload].get_pool()
+
+
+def acquire(workload: str = INTERACTIVE):
+    """Connection from a workload's pool, for multi-statement work (transactions, COPY)."""
+    return workloads[workload].acquire()
+
+
+def pool_status() -> dict:
+    return {name: w.status() for name, w in workloads.items()}
+
+
+async def connect():
+    """Open a dedicated connection outside the pool (e.g. for LISTEN)."""
+    return await asyncpg.connect(**connect_kwargs())
+
+
+async def fetch_all(query: str, *args, workload: str = INTERACTIVE):
+    started = time.perf_counter()
+    async with workloads[workload].acquire() as conn:
+        acquired = time.perf_counter()
+        try:
+            rows = await conn.fetch(query, *args)
+        except Exception as e:
+            _record(query, args, started, acquired, error=e)
+            raise
+        executed = time.perf_counter()
+    # Converted after the connection is back in the pool; the release itself isn't counted
+    converting = time.perf_counter()
+    result = [dict(r) for r in rows]
+    _record(query, args, started, acquired, executed, len(result), convert=time.perf_counter() - converting)
+    return result
+
+
+async def fetch_one(query: str, *args, workload: str = INTERACTIVE):
+    started = time.perf_counter()
+    async with workloads[workload].acquire() as conn:
+        acquired = time.perf_counter()
+        try:
+            row = await conn.fetchrow(query, *args)
+        except Exception as e:
+            _record(query, args, started, acquired, error=e)
+            raise
+        executed = time.perf_counter()
+    converting = time.perf_counter()
+    result = dict(row) if row else None
+    _record(query, args, started, acquired, executed, 1 if row else 0, convert=time.perf_counter() - converting)
+    return result
+
+
+async def stream(query: str, *args, batch_size: int = 5000, columns: bool = False, workload: str = EXPORT):
+    """
+    Iterate a large result set through a server-side cursor, one batch at a time,
+    so memory stays bounded by batch_size instead of the full result.
+
+    Yields lists of dict rows, or with columns=True dicts of column name -> values.
+    The pool connection is held until the iteration finishes or is closed.
+    """
+    started = time.perf_counter()
+    rows = 0
+    convert = 0.0
+    async with workloads[workload].acquire() as conn:
+        acquired = time.perf_counter()
+        try:
+            # Cursors only live inside a transaction
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor(query, *args)
+                while True:
+                    records = await cursor.fetch(batch_size)
+                    if not records:
+                        break
+                    rows += len(records)
+                    converting = time.perf_counter()
+                    if columns:
+                        names = list(records[0].keys())
+                        batch = {name: [r[i] for r in records] for i, name in enumerate(names)}
+                    else:
+                        batch = [dict(r) for r in records]
+                    convert += time.perf_counter() - converting
+                    yield batch
+        except Exception as e:
+            _record(query, args, started, acquired, rows=rows, error=e)
+            raise
+    # Execution time here includes time the consumer spent between batches
+    finished = time.perf_counter()
+    query_stats.record(
+        query, wait=acquired - started, execute=finished - acquired - convert, rows=rows, convert=convert,
+    )
+
+
+async def copy_csv(query: str, *args, header: bool = True, queue_size: int = 16, workload: str = EXPORT):
+    """
+    Stream `COPY (query) TO STDOUT` in CSV format: yields the bytes PostgreSQL
+    produces, with no per-row work in Python. A bounded queue between the COPY
+    and the consumer applies backpressure, so a slow client pauses the COPY
+    instead of buffering the result. Closing the iteration cancels the COPY.
+    """
+    started = time.perf_counter()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    size = 0
+    async with workloads[workload].acquire() as conn:
+        acquired = time.perf_counter()
+
+        async def run():
+            # End-of-data sentinel only while the consumer is still reading: once it is
+            # gone (cancelled) a put on the full queue would never return
+            try:
+                status = await conn.copy_from_query(query, *args, output=queue.put, format="csv", header=header)
+            except Exception:
+                await queue.put(None)
+                raise
+            await queue.put(None)
+            return status
+
+        task = asyncio.create_task(run())
+        try:
+            while (chunk := await queue.get()) is not None:
+                # Join whatever else already arrived: PostgreSQL sends small messages
+                parts = [chunk]
+                while not queue.empty() and (chunk := queue.get_nowait()) is not None:
+                    parts.append(chunk)
+                data = b"".join(parts)
+                size += len(data)
+                yield data
+                if chunk is None:
+                    break
+            status = await task
+        except BaseException as e:
+            # Client gone or COPY failed: stop the COPY and free the queue before waiting for it
+            task.cancel()
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.wait([task])
+            if isinstance(e, Exception):
+                _record(query, args, started, acquired, error=e)
+            raise
+    # "COPY <rows>"
+    rows = int(status.split()[-1]) if status and status.split()[-1].isdigit() else 0
+    query_stats.record(query, wait=acquired - started, execute=time.perf_counter() - acquired, rows=rows, convert=0.0)
 
 
-async def fetch_all(query: str, *args):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(query, *args)
-        return [dict(r) for r in rows]
+def _record(query, args, started, acquired, executed=None, rows=0, error=None, convert=0.0):
+    """Account pool wait / execution / conversion time; sample an EXPLAIN for slow reads."""
+    if executed is None:
+        executed = time.perf_counter()
+    entry = query_stats.record(
+        query,
+        wait=acquired - started,
+        execute=executed - acquired,
+        rows=rows,
+        convert=convert,
+        error=error,
+    )
+    if entry is not None and error is None and query_stats.should_explain(query, entry["shape"]):
+        task = asyncio.create_task(_capture_explain(entry, query, args))
+        _explain_tasks.add(task)
+        task.add_done_callback(_explain_tasks.discard)
 
 
-async def fetch_one(query: str, *args):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(query, *args)
-        return dict(row) if row else None
+async def _capture_explain(entry: dict, query: str, args: tuple):
+    """
+    Re-run a sampled slow statement under EXPLAIN (ANALYZE, BUFFERS), off the
+    request path and on the background (refresh) pool so it never takes an
+    interactive connection.
+    """
+    try:
+        async with workloads[REFRESH].acquire() as conn:
+            rows = await conn.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *args)
+        query_stats.attach_plan(entry, "\n".join(r[0] for r in rows))
+    except Exception as e:
+        query_stats.attach_plan(entry, f"EXPLAIN failed: {e}")
 
 
 async def close_pool():
-    global _pool
-    if _pool:
-        await _pool.close()
-        _pool = None
+    for workload in workloads.values():
+        await workload.close()
@@ -0,0 +1,93 @@
+"""
+Report styling for the openpyxl workbooks written by the export endpoints.
+
+Styling is applied per style, not per cell: the header row uses one shared
+named style, while data borders, alternate-row shading and the GRADO/POSGRADO
+highlight are conditional formatting rules over the data range (a handful of
+rules whatever the row count). Column widths come from the string lengths of
+the DataFrame columns, computed column-wise on a sample of rows.
+
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name="Admisiones")
+        style_sheet(writer.sheets["Admisiones"], df)
+"""
+from openpyxl.formatting.rule import CellIsRule, FormulaRule
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from xlsx_stream import BORDER_COLOR, HEADER_FILL, HEADER_FONT, STRIPE_FILL
+
+HEADER_STYLE = "unab_header"
+# Text values highlighted in any data cell: (fill, font color)
+NIVEL_COLORS = {
+    "GRADO": ("DBEAFE", "1E40AF"),
+    "POSGRADO": ("F3E8FF", "6B21A8"),
+}
+# Rows looked at per column for the width estimate
+WIDTH_SAMPLE_ROWS = 2000
+WIDTH_PADDING = 4
+MAX_WIDTH = 50
+
+
+def _solid(color: str) -> PatternFill:
+    return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+
+def _thin_border() -> Border:
+    side = Side(style="thin", color=BORDER_COLOR)
+    return Border(left=side, right=side, top=side, bottom=side)
+
+
+def _header_style() -> NamedStyle:
+    return NamedStyle(
+        name=HEADER_STYLE,
+        font=Font(color=HEADER_FONT, bold=True, size=11),
+        fill=_solid(HEADER_FILL),
+        alignment=Alignment(horizontal="center", vertical="center"),
+        border=_thin_border(),
+    )
+
+
+def column_widths(frame, sample_rows: int = WIDTH_SAMPLE_ROWS) -> list[float]:
+    """Width per DataFrame column: longest str() of the header or of an evenly spaced row sample."""
+    if len(frame) > sample_rows:
+        frame = frame.iloc[:: -(-len(frame) // sample_rows)]
+    widths = []
+    for header in frame.columns:
+        values = frame[header]
+        longest = int(values.astype(str).str.len().max()) if len(values) else 0
+        widths.append(min(max(longest, len(str(header))) + WIDTH_PADDING, MAX_WIDTH))
+    return widths
+
+
+def style_sheet(worksheet, frame=None, sample_rows: int = WIDTH_SAMPLE_ROWS):
+    """
+    Style a sheet written by DataFrame.to_excel (header in row 1). Pass the
+    DataFrame to size the columns; without it only the header is measured.
+    """
+    workbook = worksheet.parent
+    if HEADER_STYLE not in workbook.named_styles:
+        workbook.add_named_style(_header_style())
+
+    n_cols = worksheet.max_column
+    n_rows = worksheet.max_row
+    for cell in worksheet[1]:
+        cell.style = HEADER_STYLE
+
+    if frame is not None:
+        widths = column_widths(frame, sample_rows)
+    else:
+        widths = [min(len(str(c.value or "")) + WIDTH_PADDING, MAX_WIDTH) for c in worksheet[1]]
+    for i, width in enumerate(widths, start=1):
+        worksheet.column_dimensions[get_column_letter(i)].width = width
+
+    if n_rows < 2:
+        return
+    data_range = f"A2:{get_column_letter(n_cols)}{n_rows}"
+    rules = worksheet.conditional_formatting
+    # Highest priority first: a nivel highlight wins over the row stripe
+    for value, (fill, font) in NIVEL_COLORS.items():
+        rules.add(data_range, CellIsRule(
+            operator="equal", formula=[f'"{value}"'], fill=_solid(fill), font=Font(color=font, bold=True),
+        ))
+    rules.add(data_range, FormulaRule(formula=["MOD(ROW(),2)=0"], fill=_solid(STRIPE_FILL)))
+    rules.add(data_range, FormulaRule(formula=["TRUE"], border=_thin_border()))
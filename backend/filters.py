@@ -0,0 +1,102 @@
+"""
+Shared WHERE-clause compiler for the dim_contactos lead filters (/leads, /export).
+
+The SQL text only depends on which filters are active (and the kind of
+search), never on their values. Nivel/area filters are a semi-join on the
+dim_programa_nivel table maintained by the cache refresh; when that table is
+unavailable, the program list from the cache is bound as one text[] parameter
+with = ANY($n::text[]) instead of one placeholder per program. The same
+filter combination therefore always produces the same statement, which
+asyncpg's prepared-statement cache can reuse, and each shape is compiled once.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from indexes import PROGRAM_KEY_EXPR, SEARCH_SQL, classify_search
+from program_dimension import TABLE as DIMENSION_TABLE
+
+NO_UTIL_SQL = "(descrip_cat ILIKE '%no util%' OR descrip_cat ILIKE '%descarte%')"
+
+# Clause templates, in the order they are emitted; {p} is the clause's placeholder
+_CLAUSES = {
+    "base": "base = {p}",
+    "programa": "txtprogramainteres ILIKE {p}",
+    "estado": "ultima_mejor_subcat_string = {p}",
+    "fecha_inicio": "fecha_a_utilizar >= {p}",
+    "fecha_fin": "fecha_a_utilizar <= {p}",
+    "programs": f"{PROGRAM_KEY_EXPR} = ANY({{p}}::text[])",
+    "nivel": f"{PROGRAM_KEY_EXPR} IN (SELECT programa_key FROM {DIMENSION_TABLE} WHERE nivel = {{p}})",
+    "area": f"{PROGRAM_KEY_EXPR} IN (SELECT programa_key FROM {DIMENSION_TABLE} WHERE area = {{p}})",
+    "nivel_area": (
+        f"{PROGRAM_KEY_EXPR} IN (SELECT programa_key FROM {DIMENSION_TABLE} WHERE nivel = {{p}} AND area = {{p2}})"
+    ),
+}
+
+
+@dataclass(frozen=True)
+class LeadFilters:
+    search: str | None = None
+    base: str | None = None
+    programa: str | None = None
+    estado: str | None = None
+    fecha_inicio: str | None = None
+    fecha_fin: str | None = None
+    # Normalized nivel/area, filtered through dim_programa_nivel
+    nivel: str | None = None
+    area: str | None = None
+    # Fallback when the dimension table is unavailable: programs of the
+    # selected nivel/area from the cache; None means no such filter
+    programs: tuple[str, ...] | None = None
+    no_util: bool = False
+
+
+def compile_filters(filters: LeadFilters, first_param: int = 1) -> tuple[str, list]:
+    """(where_sql, args) for the filters; placeholders start at $first_param."""
+    shape = []
+    args = []
+    if filters.no_util:
+        shape.append("no_util")
+    if filters.search and filters.search.strip():
+        kind, patterns = classify_search(filters.search)
+        shape.append(f"search:{kind}")
+        args.extend(patterns)
+    for name in ("base", "programa", "estado", "fecha_inicio", "fecha_fin"):
+        value = getattr(filters, name)
+        if value:
+            shape.append(name)
+            args.append(f"%{value}%" if name == "programa" else value)
+    if filters.nivel and filters.area:
+        shape.append("nivel_area")
+        args.extend([filters.nivel, filters.area])
+    elif filters.nivel or filters.area:
+        shape.append("nivel" if filters.nivel else "area")
+        args.append(filters.nivel or filters.area)
+    if filters.programs is not None:
+        if filters.programs:
+            shape.append("programs")
+            args.append(list(filters.programs))
+        else:
+            # Nivel with no programs: nothing can match
+            shape.append("none")
+    return _compile_shape(tuple(shape), first_param), args
+
+
+@lru_cache(maxsize=256)
+def _compile_shape(shape: tuple[str, ...], first_param: int) -> str:
+    clauses = []
+    param = first_param
+    for item in shape:
+        if item == "no_util":
+            clauses.append(NO_UTIL_SQL)
+        elif item == "none":
+            clauses.append("1=0")
+        elif item == "nivel_area":
+            clauses.append(_CLAUSES[item].format(p=f"${param}", p2=f"${param + 1}"))
+            param += 2
+        elif item.startswith("search:"):
+            template = SEARCH_SQL[item.split(":", 1)[1]]
+            clauses.append(template.format(p=f"${param}", p2=f"${param + 1}"))
+            param += 2 if "{p2}" in template else 1
+        else:
+            clauses.append(_CLAUSES[item].format(p=f"${param}"))
+            param += 1
+    return " AND ".join(clauses) or "1=1"
@@ -0,0 +1,200 @@
+"""
+Append-only history of cache snapshots on disk.
+
+Every refresh appends one record (KPIs, totals, per-program metrics and the
+no-util breakdown) to a per-day segment file under backend/history/. Records
+are framed as a fixed 12-byte header (timestamp float64 + payload length uint32)
+followed by a zlib-compressed, column-oriented JSON payload, so range reads can
+skip over records by header alone without decompressing them.
+
+Old segments are downsampled to one record per bucket and removed after the
+retention window. Nothing is kept in RAM between reads.
+"""
+import json
+import os
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Mapping
+from programs_table import METRIC_FIELDS
+
+_HEADER = struct.Struct("<dI")
+_SEGMENT_SUFFIX = ".seg"
+_COMPACTED_SUFFIX = ".ds.seg"
+
+KPI_FIELDS = ["total_leads", "en_gestion", "op_venta", "proceso_pago", "no_util_total"]
+PROGRAM_TEXT_FIELDS = ["programa", "nivel", "area"]
+PROGRAM_METRIC_FIELDS = METRIC_FIELDS
+NO_UTIL_FIELDS = ["descripcion_sub", "leads", "leads_7d", "leads_14d"]
+
+
+def _columns(rows: list, fields: list) -> dict:
+    return {f: [r.get(f) for r in rows] for f in fields}
+
+
+def _rows(columns: dict) -> list:
+    fields = list(columns)
+    return [dict(zip(fields, values)) for values in zip(*columns.values())]
+
+
+def encode_snapshot(data: Mapping) -> bytes:
+    """Compact, column-oriented encoding of one cache snapshot."""
+    programs = data.get("programs")
+    program_columns = programs.to_columns() if programs is not None else {}
+    record = {
+        "kpis": {f: data.get(f, 0) for f in KPI_FIELDS},
+        "totals": dict(data.get("totals", {})),
+        "programs": {f: program_columns.get(f, []) for f in PROGRAM_TEXT_FIELDS + PROGRAM_METRIC_FIELDS},
+        "no_util": _columns(data.get("no_util", []), NO_UTIL_FIELDS),
+    }
+    return zlib.compress(json.dumps(record, separators=(",", ":"), default=str).encode("utf-8"), 6)
+
+
+def decode_snapshot(payload: bytes, programs: bool = True) -> dict:
+    record = json.loads(zlib.decompress(payload))
+    if programs:
+        record["programs"] = _rows(record["programs"])
+        record["no_util"] = _rows(record["no_util"])
+    else:
+        record.pop("programs", None)
+        record.pop("no_util", None)
+    return record
+
+
+class SnapshotHistory:
+    def __init__(
+        self,
+        directory: str,
+        retention_days: int = 365,
+        downsample_after_days: int = 7,
+        downsample_seconds: int = 3600,
+    ):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.downsample_after_days = downsample_after_days
+        self.downsample_seconds = downsample_seconds
+        self._last_maintenance_day: str | None = None
+
+    # ── Writing ──
+
+    def append(self, ts: datetime, data: Mapping):
+        """Append one snapshot. Blocking: call through asyncio.to_thread."""
+        os.makedirs(self.directory, exist_ok=True)
+        payload = encode_snapshot(data)
+        day = ts.astimezone(timezone.utc).strftime("%Y-%m-%d")
+        with open(self._segment_path(day), "ab") as f:
+            f.write(_HEADER.pack(ts.timestamp(), len(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Retention and downsampling run once per day, on the first append
+        if self._last_maintenance_day != day:
+            self._last_maintenance_day = day
+            self.maintain(ts)
+
+    def maintain(self, now: datetime | None = None):
+        """Drop segments past retention and downsample old ones."""
+        now = now or datetime.now(timezone.utc)
+        retention_cutoff = (now - timedelta(days=self.retention_days)).strftime("%Y-%m-%d")
+        downsample_cutoff = (now - timedelta(days=self.downsample_after_days)).strftime("%Y-%m-%d")
+        for day, path in self._segments():
+            if day < retention_cutoff:
+                os.remove(path)
+                self._remove_raw_leftover(day)
+            elif path.endswith(_COMPACTED_SUFFIX):
+                self._remove_raw_leftover(day)
+            elif day < downsample_cutoff:
+                self._downsample(day, path)
+
+    def _remove_raw_leftover(self, day: str):
+        """Raw segment of a day already downsampled (left behind by a crash mid-compaction)."""
+        raw_path = self._segment_path(day)
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+    def _downsample(self, day: str, path: str):
+        """Keep the last record of each downsample bucket; atomic rewrite."""
+        kept = {}
+        for ts, payload in _read_frames(path):
+            kept[int(ts // self.downsample_seconds)] = (ts, payload)
+        out_path = os.path.join(self.directory, day + _COMPACTED_SUFFIX)
+        tmp_path = out_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for ts, payload in kept.values():
+                f.write(_HEADER.pack(ts, len(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, out_path)
+        os.remove(path)
+
+    # ── Reading ──
+
+    def read_range(self, start: datetime, end: datetime, programs: bool = True) -> Iterator[tuple[datetime, dict]]:
+        """Yield (timestamp, record) for snapshots in [start, end], oldest first."""
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        first_day = start.astimezone(timezone.utc).strftime("%Y-%m-%d")
+        last_day = end.astimezone(timezone.utc).strftime("%Y-%m-%d")
+        for day, path in self._segments():
+            if day < first_day or day > last_day:
+                continue
+            for ts, payload in _read_frames(path, start_ts, end_ts):
+                yield datetime.fromtimestamp(ts, timezone.utc), decode_snapshot(payload, programs)
+
+    def kpi_series(self, start: datetime, end: datetime, programa: str | None = None) -> list:
+        """KPIs and totals over time, optionally for a single program."""
+        series = []
+        target = programa.strip().upper() if programa else None
+        for ts, record in self.read_range(start, end, programs=target is not None):
+            point = {"timestamp": ts.isoformat()}
+            if target is None:
+                point.update(record["kpis"])
+                point["totals"] = record["totals"]
+            else:
+                match = next((p for p in record["programs"] if p.get("programa") == target), None)
+                if match is None:
+                    continue
+                point.update({f: match.get(f, 0) for f in PROGRAM_METRIC_FIELDS})
+            series.append(point)
+        return series
+
+    def _segment_path(self, day: str) -> str:
+        return os.path.join(self.directory, day + _SEGMENT_SUFFIX)
+
+    def _segments(self) -> list[tuple[str, str]]:
+        """(day, path) for every day, sorted by day; a downsampled segment wins over a raw one."""
+        if not os.path.isdir(self.directory):
+            return []
+        segments = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(_SEGMENT_SUFFIX):
+                day = name[:10]
+                if day not in segments or name.endswith(_COMPACTED_SUFFIX):
+                    segments[day] = os.path.join(self.directory, name)
+        return sorted(segments.items())
+
+
+def _read_frames(path: str, start_ts: float = float("-inf"), end_ts: float = float("inf")):
+    """Walk record frames, seeking past payloads that are out of range."""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return  # End of file (or a record still being written)
+            ts, length = _HEADER.unpack(header)
+            if ts > end_ts:
+                return  # Records within a segment are in time order
+            if ts < start_ts:
+                f.seek(length, os.SEEK_CUR)
+                continue
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield ts, payload
+
+
+history = SnapshotHistory(
+    directory=os.getenv("HISTORY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history")),
+    retention_days=int(os.getenv("HISTORY_RETENTION_DAYS", "365")),
+    downsample_after_days=int(os.getenv("HISTORY_DOWNSAMPLE_AFTER_DAYS", "7")),
+    downsample_seconds=int(os.getenv("HISTORY_DOWNSAMPLE_SECONDS", "3600")),
+)
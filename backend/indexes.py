@@ -0,0 +1,225 @@
+"""
+Indexes the lead listing and export queries rely on, and the search clause
+that matches them.
+
+The search expressions below are used verbatim by both the index definitions
+and the queries, so the planner can actually pick the indexes:
+
+    - pg_trgm GIN indexes make ILIKE '%term%' on name/email/phone an index scan
+    - a digits-only phone expression lets "+54 (11) 1234" match "541112 34..."
+    - btree indexes cover the equality filters and the keyset sort
+
+Check or create them from the command line:
+
+    python indexes.py            # report, plus an EXPLAIN of a keyset page
+    python indexes.py --create   # create what is missing (CONCURRENTLY)
+
+or at startup with DB_ENSURE_INDEXES=1.
+"""
+import asyncio
+import json
+import re
+import sys
+from dataclasses import dataclass
+from database import connect
+
+# Normalized search expressions, shared by the queries and the index definitions
+PHONE_DIGITS_EXPR = "regexp_replace(teltelefono, '[^0-9]', '', 'g')"
+PROGRAM_KEY_EXPR = "UPPER(TRIM(txtprogramainteres))"
+
+# Shortest digit run treated as a phone search
+MIN_PHONE_DIGITS = 4
+_PHONE_LIKE = re.compile(r"^[\d\s+\-().]+$")
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    name: str
+    table: str
+    method: str
+    expression: str
+    purpose: str
+
+    def create_sql(self) -> str:
+        return (
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.name} "
+            f"ON {self.table} USING {self.method} ({self.expression})"
+        )
+
+
+INDEXES = [
+    IndexSpec("ix_dim_contactos_nombre_trgm", "dim_contactos", "gin",
+              "txtnombreapellido gin_trgm_ops", "search by name"),
+    IndexSpec("ix_dim_contactos_email_trgm", "dim_contactos", "gin",
+              "emlmail gin_trgm_ops", "search by email"),
+    IndexSpec("ix_dim_contactos_telefono_trgm", "dim_contactos", "gin",
+              "teltelefono gin_trgm_ops", "search by phone (as typed)"),
+    IndexSpec("ix_dim_contactos_telefono_digits_trgm", "dim_contactos", "gin",
+              f"({PHONE_DIGITS_EXPR}) gin_trgm_ops", "search by phone digits"),
+    IndexSpec("ix_dim_contactos_programa_trgm", "dim_contactos", "gin",
+              "txtprogramainteres gin_trgm_ops", "programa filter (ILIKE)"),
+    IndexSpec("ix_dim_contactos_programa_key", "dim_contactos", "btree",
+              f"({PROGRAM_KEY_EXPR})", "nivel filter (program list)"),
+    IndexSpec("ix_dim_contactos_base", "dim_contactos", "btree",
+              "base", "base filter"),
+    IndexSpec("ix_dim_contactos_estado", "dim_contactos", "btree",
+              "ultima_mejor_subcat_string", "estado filter"),
+    IndexSpec("ix_dim_contactos_fecha_id", "dim_contactos", "btree",
+              "fecha_a_utilizar DESC NULLS LAST, idinterno DESC", "sort, keyset pagination, date range"),
+]
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+_TEXT_SEARCH_SQL = "txtnombreapellido ILIKE {p} OR emlmail ILIKE {p} OR teltelefono ILIKE {p}"
+
+# WHERE templates per search kind; {p}, {p2} are the placeholders of its arguments
+SEARCH_SQL = {
+    "email": "emlmail ILIKE {p}",
+    # Digit terms ("2024", "+54 11 ...") still match names/emails, and also the digits-only phone
+    "phone": f"({_TEXT_SEARCH_SQL} OR {PHONE_DIGITS_EXPR} LIKE {{p2}})",
+    "text": f"({_TEXT_SEARCH_SQL})",
+}
+
+
+def classify_search(search: str) -> tuple[str, list[str]]:
+    """
+    (kind, LIKE patterns) for the free-text lead search. An email-looking term
+    only scans the email index; any other term keeps the name/email/phone
+    ILIKE (each backed by its trigram index), and a phone-looking term also
+    matches the digits-only phone expression, so "+54 (11) 1234" finds
+    "541112 34..." too.
+    """
+    term = search.strip()
+    digits = re.sub(r"\D", "", term)
+    if "@" in term:
+        return "email", [f"%{_escape_like(term)}%"]
+    if _PHONE_LIKE.match(term) and len(digits) >= MIN_PHONE_DIGITS:
+        return "phone", [f"%{_escape_like(term)}%", f"%{digits}%"]
+    return "text", [f"%{_escape_like(term)}%"]
+
+
+async def check_indexes(conn=None) -> dict:
+    """Which expected indexes exist, are missing, or were left invalid by a failed build."""
+    own_conn = conn is None
+    if own_conn:
+        conn = await connect()
+    try:
+        trgm = await conn.fetchval("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        rows = await conn.fetch(
+            """
+            SELECT c.relname AS name, i.indisvalid AS valid
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = ANY($1::text[])
+            """,
+            [spec.name for spec in INDEXES],
+        )
+    finally:
+        if own_conn:
+            await conn.close()
+
+    found = {r["name"]: r["valid"] for r in rows}
+    indexes = []
+    for spec in INDEXES:
+        state = "missing" if spec.name not in found else ("ok" if found[spec.name] else "invalid")
+        indexes.append({"name": spec.name, "table": spec.table, "purpose": spec.purpose, "state": state})
+    return {
+        "pg_trgm": bool(trgm),
+        "indexes": indexes,
+        "missing": [i["name"] for i in indexes if i["state"] != "ok"],
+    }
+
+
+def _plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+async def check_keyset_plan(conn=None) -> dict:
+    """
+    EXPLAIN a deep /leads keyset page and report whether the row comparison is
+    an index condition (a seek) or only a filter over rows scanned from the top.
+    """
+    from pagination import ORDER_BY, keyset_branches
+
+    own_conn = conn is None
+    if own_conn:
+        conn = await connect()
+    try:
+        # Seek from the oldest dated row: the deepest page, where a scan from the top costs most
+        row = await conn.fetchrow(
+            "SELECT fecha_a_utilizar, idinterno FROM dim_contactos WHERE fecha_a_utilizar IS NOT NULL "
+            "ORDER BY fecha_a_utilizar, idinterno LIMIT 1"
+        )
+        if row is None:
+            return {"ok": None, "detail": "no dated rows to seek from"}
+        clause, args = keyset_branches(row["fecha_a_utilizar"], row["idinterno"], 1)[0]
+        plan = await conn.fetchval(
+            f"EXPLAIN (FORMAT JSON) SELECT idinterno FROM dim_contactos WHERE {clause} ORDER BY {ORDER_BY} LIMIT 25",
+            *args,
+        )
+    finally:
+        if own_conn:
+            await conn.close()
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    for node in _plan_nodes(plan[0]["Plan"]):
+        cond = node.get("Index Cond", "")
+        if "fecha_a_utilizar" in cond and "idinterno" in cond:
+            return {"ok": True, "index": node.get("Index Name"), "index_cond": cond, "filter": node.get("Filter")}
+    scan = next((n for n in _plan_nodes(plan[0]["Plan"]) if "Scan" in n["Node Type"]), {})
+    return {"ok": False, "index": scan.get("Index Name"), "index_cond": scan.get("Index Cond"),
+            "filter": scan.get("Filter"), "node": scan.get("Node Type")}
+
+
+async def ensure_indexes() -> dict:
+    """
+    Create pg_trgm and every missing index. Builds run CONCURRENTLY on a
+    dedicated connection without statement_timeout, so reads are not blocked;
+    invalid leftovers of interrupted builds are dropped and rebuilt.
+    """
+    conn = await connect()
+    try:
+        await conn.execute("SET statement_timeout = 0")
+        try:
+            await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except Exception as e:
+            print(f"[Indexes] Could not create pg_trgm (trigram indexes will fail): {e}")
+        report = await check_indexes(conn)
+        states = {i["name"]: i["state"] for i in report["indexes"]}
+        for spec in INDEXES:
+            if states[spec.name] == "ok":
+                continue
+            try:
+                if states[spec.name] == "invalid":
+                    await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {spec.name}")
+                print(f"[Indexes] Creating {spec.name} ({spec.purpose})...")
+                await conn.execute(spec.create_sql())
+            except Exception as e:
+                print(f"[Indexes] Failed to create {spec.name}: {e}")
+        return await check_indexes(conn)
+    finally:
+        await conn.close()
+
+
+async def main():
+    report = await (ensure_indexes() if "--create" in sys.argv else check_indexes())
+    print(f"pg_trgm: {'installed' if report['pg_trgm'] else 'MISSING'}")
+    for index in report["indexes"]:
+        print(f"  [{index['state']:>7}] {index['name']:<40} {index['purpose']}")
+    if report["missing"]:
+        print(f"{len(report['missing'])} missing/invalid. Run: python indexes.py --create")
+    keyset = await check_keyset_plan()
+    if keyset["ok"]:
+        print(f"keyset seek: Index Cond {keyset['index_cond']} on {keyset['index']}")
+    elif keyset["ok"] is False:
+        print(f"keyset seek: NOT an index condition ({keyset.get('node')}, filter: {keyset['filter']})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
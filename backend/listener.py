@@ -0,0 +1,139 @@
+"""
+PostgreSQL LISTEN/NOTIFY driven cache invalidation.
+
+Holds one dedicated connection (outside the pool) listening on the channels the
+ETL notifies after loading data, and triggers a debounced cache refresh. The
+hourly periodic refresh in server.py stays in place as a fallback.
+
+The ETL only needs to run, after each load:
+
+    NOTIFY agg_dim_contactos_leads;
+    -- or: SELECT pg_notify('agg_no_utiles', '');
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from database import connect
+
+
+class CacheInvalidationListener:
+    def __init__(self, cache, channels: list[str], debounce_seconds: float = 5.0, max_wait_seconds: float = 60.0):
+        self.cache = cache
+        self.channels = channels
+        # Bursts of notifications (one per table, per batch...) collapse into one refresh
+        self.debounce_seconds = debounce_seconds
+        # ...but a steady stream of them can't postpone the refresh forever
+        self.max_wait_seconds = max_wait_seconds
+        self._task: asyncio.Task | None = None
+        self._pending: asyncio.Task | None = None
+        self._first_pending_at: float | None = None
+        # time.monotonic() of the latest notification: refreshes must start after it
+        self._notified_at: float = 0.0
+        self.connected = False
+        self.notifications = 0
+        self.refreshes = 0
+        self.last_notification: dict | None = None
+        self.last_error: str | None = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._pending, self._task):
+            if task and not task.done():
+                task.cancel()
+        self._task = None
+        self._pending = None
+
+    def status(self) -> dict:
+        return {
+            "channels": self.channels,
+            "connected": self.connected,
+            "notifications": self.notifications,
+            "refreshes": self.refreshes,
+            "refresh_pending": self._pending is not None and not self._pending.done(),
+            "last_notification": self.last_notification,
+            "last_error": self.last_error,
+        }
+
+    async def _run(self):
+        """Keep a listener connection open, reconnecting with backoff if it drops."""
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = await connect()
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda _conn: closed.set())
+                for channel in self.channels:
+                    await conn.add_listener(channel, self._on_notify)
+                self.connected = True
+                self.last_error = None
+                backoff = 1
+                print(f"[Listener] Listening on {', '.join(self.channels)}")
+                await closed.wait()
+                print("[Listener] Connection closed, reconnecting...")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[Listener] Error: {e} (retrying in {backoff}s)")
+            finally:
+                self.connected = False
+                if conn is not None and not conn.is_closed():
+                    try:
+                        await conn.close()
+                    except Exception:
+                        pass
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    def _on_notify(self, _conn, _pid, channel: str, payload: str):
+        self.notifications += 1
+        self.last_notification = {
+            "channel": channel,
+            "payload": payload,
+            "received_at": datetime.now(timezone.utc).isoformat(),
+        }
+        now = time.monotonic()
+        self._notified_at = now
+        if self._pending is not None and not self._pending.done():
+            if now - self._first_pending_at >= self.max_wait_seconds:
+                return  # Let the scheduled refresh fire instead of pushing it back again
+            self._pending.cancel()
+        else:
+            self._first_pending_at = now
+        self._pending = asyncio.create_task(self._refresh_after_debounce())
+
+    async def _refresh_after_debounce(self):
+        await asyncio.sleep(self.debounce_seconds)
+        try:
+            # Notifications that arrive while refreshing (and weren't rescheduled
+            # because of max_wait) get one more refresh
+            while True:
+                notified_at = self._notified_at
+                await self.cache.refresh(since=notified_at)
+                self.refreshes += 1
+                if self._notified_at == notified_at:
+                    break
+        except Exception as e:
+            print(f"[Listener] Refresh after notify failed: {e}")
+
+
+def _channels_from_env() -> list[str]:
+    raw = os.getenv("CACHE_NOTIFY_CHANNELS", "agg_dim_contactos_leads,agg_no_utiles")
+    return [c.strip() for c in raw.split(",") if c.strip()]
+
+
+def create_listener(cache) -> CacheInvalidationListener | None:
+    """Build the listener from env settings, or None when CACHE_LISTEN=0."""
+    if os.getenv("CACHE_LISTEN", "1") == "0":
+        return None
+    return CacheInvalidationListener(
+        cache,
+        channels=_channels_from_env(),
+        debounce_seconds=float(os.getenv("CACHE_NOTIFY_DEBOUNCE", "5")),
+        max_wait_seconds=float(os.getenv("CACHE_NOTIFY_MAX_WAIT", "60")),
+    )
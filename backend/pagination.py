@@ -0,0 +1,83 @@
+"""
+Keyset (cursor) pagination for lead listings.
+
+Pages are ordered by (fecha_a_utilizar DESC NULLS LAST, idinterno DESC); a
+cursor carries the sort key of the last row served, so the next page is a
+range condition the index can seek to instead of an OFFSET that has to walk
+every earlier row. Cursors are opaque base64 tokens bound to the filters they
+were issued for.
+"""
+import base64
+import hashlib
+import json
+from datetime import date, datetime
+
+ORDER_BY = "fecha_a_utilizar DESC NULLS LAST, idinterno DESC"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def filter_signature(filters: dict) -> str:
+    """Stable short hash of the active filters (empty values ignored)."""
+    active = {k: v for k, v in sorted(filters.items()) if v not in (None, "", False)}
+    raw = json.dumps(active, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _tag(value):
+    # Keep the Python type so the value binds to the same column type on decode
+    if isinstance(value, datetime):
+        return ["dt", value.isoformat()]
+    if isinstance(value, date):
+        return ["d", value.isoformat()]
+    return ["v", value]
+
+
+def _untag(tagged):
+    kind, value = tagged
+    if kind == "dt":
+        return datetime.fromisoformat(value)
+    if kind == "d":
+        return date.fromisoformat(value)
+    return value
+
+
+def encode_cursor(row: dict, signature: str) -> str:
+    payload = {"f": _tag(row.get("fecha_a_utilizar")), "i": _tag(row.get("idinterno")), "s": signature}
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, signature: str) -> tuple:
+    """(fecha_a_utilizar, idinterno) of the last row served; InvalidCursor if unusable."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        fecha, idinterno = _untag(payload["f"]), _untag(payload["i"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("Cursor inválido") from e
+    if payload.get("s") != signature:
+        raise InvalidCursor("El cursor corresponde a otros filtros")
+    return fecha, idinterno
+
+
+def keyset_branches(fecha, idinterno, next_param: int) -> list[tuple[str, list]]:
+    """
+    WHERE fragments selecting rows after (fecha, idinterno) in ORDER_BY order,
+    each with its arguments; placeholders start at $next_param. Rows come from
+    the branches in order: each one is a single range the
+    (fecha_a_utilizar DESC NULLS LAST, idinterno DESC) index seeks to, so the
+    NULL-date tail is queried separately (only once the dated rows run out)
+    instead of OR-ed into the row comparison, which the index can't seek.
+    """
+    if fecha is None:
+        # Already in the NULLS LAST tail
+        return [(f"fecha_a_utilizar IS NULL AND idinterno < ${next_param}", [idinterno])]
+    a, b = next_param, next_param + 1
+    return [
+        # A NULL fecha never compares true, so this branch only sees dated rows
+        (f"(fecha_a_utilizar, idinterno) < (${a}, ${b})", [fecha, idinterno]),
+        ("fecha_a_utilizar IS NULL", []),
+    ]
@@ -0,0 +1,94 @@
+"""
+dim_programa_nivel: the program -> nivel/area classification, materialized in
+PostgreSQL.
+
+The cache refresh classifies every program (agg_dim_contactos_leads columns,
+falling back to ProgramMapping) and rewrites this small table with the result,
+so lead queries can filter by nivel/area with an indexed semi-join instead of
+shipping the program list from Python on every request. The table is created
+on the first sync of the process, and refreshes that leave the classification
+unchanged don't touch it. Whether the table is usable is re-checked every
+DIMENSION_CHECK_SECONDS, and forgotten as soon as a query finds it missing.
+"""
+import os
+import time
+from datetime import datetime, timezone
+from database import INTERACTIVE, REFRESH, acquire
+from programs_table import ProgramTable
+
+TABLE = "dim_programa_nivel"
+CHECK_SECONDS = float(os.getenv("DIMENSION_CHECK_SECONDS", "60"))
+
+_DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+        programa_key TEXT NOT NULL,
+        nivel TEXT NOT NULL,
+        area TEXT NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (programa_key, nivel, area)
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS ix_{TABLE}_nivel_area ON {TABLE} (nivel, area, programa_key)",
+    f"CREATE INDEX IF NOT EXISTS ix_{TABLE}_area ON {TABLE} (area, programa_key)",
+]
+
+# None until known: set by a sync, or by checking the table exists (followers, warm starts)
+_state = {"ready": None, "rows": 0, "synced_at": None, "last_error": None}
+# Whether this process already ran the DDL, the classification it last wrote,
+# and when "ready" was last confirmed (monotonic)
+_synced = {"schema": False, "records": None, "checked_at": None}
+
+
+async def sync_program_dimension(programs: ProgramTable):
+    """Replace the table contents with the snapshot's classification, atomically."""
+    records = sorted(set(zip(programs.names(), programs.nivel().tolist(), programs.area().tolist())))
+    if records == _synced["records"]:
+        return
+    now = datetime.now(timezone.utc)
+    try:
+        async with acquire(REFRESH) as conn:
+            async with conn.transaction():
+                if not _synced["schema"]:
+                    for statement in _DDL:
+                        await conn.execute(statement)
+                # Readers keep seeing the previous rows until commit
+                await conn.execute(f"DELETE FROM {TABLE}")
+                await conn.copy_records_to_table(
+                    TABLE,
+                    records=[(prog, nivel, area, now) for prog, nivel, area in records],
+                    columns=["programa_key", "nivel", "area", "updated_at"],
+                )
+    except Exception as e:
+        _state["last_error"] = str(e)
+        print(f"[Dimension] Could not sync {TABLE}: {e}")
+        return
+    _synced.update(schema=True, records=records, checked_at=time.monotonic())
+    _state.update(ready=True, rows=len(records), synced_at=now.isoformat(), last_error=None)
+
+
+async def dimension_available() -> bool:
+    """True if nivel/area filters can use the table; re-checked every CHECK_SECONDS."""
+    checked_at = _synced["checked_at"]
+    if _state["ready"] is None or checked_at is None or time.monotonic() - checked_at >= CHECK_SECONDS:
+        _synced["checked_at"] = time.monotonic()
+        try:
+            async with acquire(INTERACTIVE) as conn:
+                _state["ready"] = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", TABLE)
+        except Exception as e:
+            # Treated as unavailable until the next check
+            _state.update(ready=False, last_error=str(e))
+            return False
+    return bool(_state["ready"])
+
+
+def invalidate_dimension(error: Exception = None):
+    """Forget the cached availability after a query failed on a missing table."""
+    _state["ready"] = None
+    _synced.update(schema=False, records=None, checked_at=None)
+    if error is not None:
+        _state["last_error"] = str(error)
+
+
+def dimension_status() -> dict:
+    return dict(_state)
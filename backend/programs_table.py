@@ -0,0 +1,151 @@
+"""
+Column-oriented (struct-of-arrays) store for the per-program metrics.
+
+Metrics live in one int64 NumPy matrix in column-major order, so every metric
+is a contiguous column; nivel and area are stored as small integer codes into
+category lists. Filters, grouped sums and conversion percentages are vectorized
+over the arrays; dict rows are only materialized at the JSON/Excel boundary.
+"""
+import numpy as np
+
+# Integer metric columns, in the order they appear in program records
+METRIC_FIELDS = [
+    "leads", "en_gestion", "no_util", "op_venta", "proceso_pago",
+    "solicitados", "admitidos", "pagados", "meta",
+    "solicitados_25", "admitidos_25", "pagados_25",
+    "solicitados_var", "admitidos_var", "pagados_var",
+]
+_METRIC_INDEX = {f: i for i, f in enumerate(METRIC_FIELDS)}
+
+# Record key order, kept identical to the historical dict layout
+RECORD_FIELDS = ["programa", "nivel", "area"] + METRIC_FIELDS[:5] + ["toques_prom"] + METRIC_FIELDS[5:]
+
+
+class ProgramTable:
+    def __init__(
+        self,
+        programa: np.ndarray,
+        nivel_codes: np.ndarray,
+        nivel_categories: list[str],
+        area_codes: np.ndarray,
+        area_categories: list[str],
+        values: np.ndarray,
+        toques_prom: np.ndarray,
+    ):
+        self.programa = programa
+        self.nivel_codes = nivel_codes
+        self.nivel_categories = nivel_categories
+        self.area_codes = area_codes
+        self.area_categories = area_categories
+        self.values = values
+        self.toques_prom = toques_prom
+        # Snapshots are shared between requests: make accidental writes fail loudly
+        for arr in (programa, nivel_codes, area_codes, values, toques_prom):
+            arr.flags.writeable = False
+
+    @classmethod
+    def from_columns(cls, columns: dict) -> "ProgramTable":
+        """Build from plain per-field lists (as produced by the refresh loop)."""
+        nivel_codes, nivel_categories = _encode_categories(columns["nivel"])
+        area_codes, area_categories = _encode_categories(columns["area"])
+        n = len(columns["programa"])
+        values = np.empty((n, len(METRIC_FIELDS)), dtype=np.int64, order="F")
+        for i, field in enumerate(METRIC_FIELDS):
+            values[:, i] = columns[field] if n else 0
+        return cls(
+            programa=np.array(columns["programa"], dtype=object),
+            nivel_codes=nivel_codes,
+            nivel_categories=nivel_categories,
+            area_codes=area_codes,
+            area_categories=area_categories,
+            values=values,
+            toques_prom=np.asarray(columns.get("toques_prom") or [0.0] * n, dtype=np.float64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.programa)
+
+    def column(self, field: str, idx: np.ndarray | None = None) -> np.ndarray:
+        col = self.values[:, _METRIC_INDEX[field]]
+        return col if idx is None else col[idx]
+
+    def nivel(self, idx: np.ndarray | None = None) -> np.ndarray:
+        cats = np.array(self.nivel_categories, dtype=object)
+        return cats[self.nivel_codes if idx is None else self.nivel_codes[idx]]
+
+    def area(self, idx: np.ndarray | None = None) -> np.ndarray:
+        cats = np.array(self.area_categories, dtype=object)
+        return cats[self.area_codes if idx is None else self.area_codes[idx]]
+
+    def select(self, nivel: str | None = None, area: str | None = None) -> np.ndarray:
+        """Row indices matching the (already normalized) nivel/area filter."""
+        mask = np.ones(len(self), dtype=bool)
+        if nivel is not None:
+            mask &= self.nivel_codes == _code_of(self.nivel_categories, nivel)
+        if area is not None:
+            mask &= self.area_codes == _code_of(self.area_categories, area)
+        return np.flatnonzero(mask)
+
+    def sums(self, idx: np.ndarray | None = None) -> dict:
+        values = self.values if idx is None else self.values[idx]
+        return dict(zip(METRIC_FIELDS, values.sum(axis=0).tolist()))
+
+    def grouped_sums(self) -> np.ndarray:
+        """Metric sums for every (nivel, area) pair: shape (n_nivel, n_area, n_metrics)."""
+        n_area = len(self.area_categories)
+        out = np.zeros((len(self.nivel_categories) * n_area, len(METRIC_FIELDS)), dtype=np.int64)
+        np.add.at(out, self.nivel_codes.astype(np.int64) * n_area + self.area_codes, self.values)
+        return out.reshape(len(self.nivel_categories), n_area, len(METRIC_FIELDS))
+
+    def pct(self, num_field: str, den_field: str, idx: np.ndarray | None = None) -> np.ndarray:
+        return pct(self.column(num_field, idx), self.column(den_field, idx))
+
+    def names(self, idx: np.ndarray | None = None) -> list[str]:
+        return (self.programa if idx is None else self.programa[idx]).tolist()
+
+    def records(self, idx: np.ndarray | None = None) -> list[dict]:
+        """Materialize dict rows (the JSON boundary)."""
+        values = self.values if idx is None else self.values[idx]
+        columns = {
+            "programa": self.names(idx),
+            "nivel": self.nivel(idx).tolist(),
+            "area": self.area(idx).tolist(),
+            "toques_prom": (self.toques_prom if idx is None else self.toques_prom[idx]).tolist(),
+        }
+        for i, field in enumerate(METRIC_FIELDS):
+            columns[field] = values[:, i].tolist()
+        return [dict(zip(RECORD_FIELDS, row)) for row in zip(*(columns[f] for f in RECORD_FIELDS))]
+
+    def to_columns(self) -> dict:
+        """Plain per-field lists, for persistence."""
+        columns = {
+            "programa": self.names(),
+            "nivel": self.nivel().tolist(),
+            "area": self.area().tolist(),
+            "toques_prom": self.toques_prom.tolist(),
+        }
+        for i, field in enumerate(METRIC_FIELDS):
+            columns[field] = self.values[:, i].tolist()
+        return columns
+
+
+def pct(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    """Vectorized _pct: num/den*100 rounded to 1 decimal, 0.0 where den is 0."""
+    num = np.asarray(num, dtype=np.float64)
+    den = np.asarray(den, dtype=np.float64)
+    out = np.zeros(np.broadcast(num, den).shape, dtype=np.float64)
+    np.divide(num, den, out=out, where=den != 0)
+    return np.round(out * 100, 1)
+
+
+def _encode_categories(values: list) -> tuple[np.ndarray, list[str]]:
+    categories = sorted(set(values))
+    lookup = {c: i for i, c in enumerate(categories)}
+    return np.fromiter((lookup[v] for v in values), dtype=np.int16, count=len(values)), categories
+
+
+def _code_of(categories: list[str], value: str) -> int:
+    try:
+        return categories.index(value)
+    except ValueError:
+        return -1
@@ -0,0 +1,197 @@
+"""
+Per-query instrumentation for database.py.
+
+Every fetch records, under its normalized query shape (literals and
+placeholder lists collapsed), the time spent waiting for a pool connection,
+the execution time in PostgreSQL, the rows returned and the time spent
+converting records to dicts. Statements slower than DB_SLOW_QUERY_MS go to a
+rolling slow-query log; a sampled fraction of those also get an
+EXPLAIN (ANALYZE, BUFFERS) captured in the background.
+
+    DB_QUERY_STATS=0            disable
+    DB_SLOW_QUERY_MS=500        slow-query threshold
+    DB_SLOW_LOG_SIZE=100        slow-query log length
+    DB_EXPLAIN_SAMPLE_RATE=0    fraction of slow SELECTs to EXPLAIN (0 = never)
+    DB_EXPLAIN_INTERVAL=300     seconds between EXPLAINs of the same shape
+"""
+import os
+import random
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+# Distinct shapes kept; beyond this new shapes are counted under one bucket
+MAX_SHAPES = 500
+_OVERFLOW_SHAPE = "<other>"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\$\d+(?:\s*,\s*\$\d+)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Query shape: literals replaced by ?, $n lists collapsed, whitespace squeezed."""
+    shape = _STRING_LITERAL.sub("?", query)
+    shape = _PLACEHOLDER_LIST.sub("$n...", shape)
+    # Digits inside $n placeholders and identifiers are kept by the word boundaries
+    shape = _NUMBER.sub(lambda m: m.group(0) if m.start() and shape[m.start() - 1] == "$" else "?", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+def _is_explainable(query: str) -> bool:
+    # EXPLAIN ANALYZE executes the statement: only ever do it for reads
+    head = query.lstrip().split(None, 1)[0].upper() if query.strip() else ""
+    return head in ("SELECT", "WITH")
+
+
+class _ShapeStats:
+    __slots__ = (
+        "calls", "errors", "rows", "wait_total", "wait_max",
+        "exec_total", "exec_max", "convert_total", "slow", "last_plan",
+    )
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.exec_total = 0.0
+        self.exec_max = 0.0
+        self.convert_total = 0.0
+        self.slow = 0
+        self.last_plan: dict | None = None
+
+    def to_dict(self) -> dict:
+        calls = self.calls or 1
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "slow": self.slow,
+            "rows_total": self.rows,
+            "rows_avg": round(self.rows / calls, 1),
+            "wait_ms_avg": round(self.wait_total / calls * 1000, 2),
+            "wait_ms_max": round(self.wait_max * 1000, 2),
+            "exec_ms_avg": round(self.exec_total / calls * 1000, 2),
+            "exec_ms_max": round(self.exec_max * 1000, 2),
+            "exec_ms_total": round(self.exec_total * 1000, 1),
+            "convert_ms_avg": round(self.convert_total / calls * 1000, 2),
+            "last_plan": self.last_plan,
+        }
+
+
+class QueryStats:
+    def __init__(
+        self,
+        enabled: bool = True,
+        slow_ms: float = 500,
+        slow_log_size: int = 100,
+        explain_sample_rate: float = 0.0,
+        explain_interval: float = 300,
+    ):
+        self.enabled = enabled
+        self.slow_seconds = slow_ms / 1000
+        self.explain_sample_rate = explain_sample_rate
+        self.explain_interval = explain_interval
+        self.since = datetime.now(timezone.utc)
+        self._shapes: dict[str, _ShapeStats] = {}
+        self._slow_log: deque = deque(maxlen=slow_log_size)
+        self._last_explain: dict[str, float] = {}
+
+    def reset(self):
+        self.since = datetime.now(timezone.utc)
+        self._shapes.clear()
+        self._slow_log.clear()
+        self._last_explain.clear()
+
+    def record(
+        self,
+        query: str,
+        wait: float,
+        execute: float,
+        rows: int = 0,
+        convert: float = 0.0,
+        error: Exception | None = None,
+    ) -> dict | None:
+        """
+        Account one statement (durations in seconds). Returns the slow-log entry
+        if the statement was slow, so the caller can attach an EXPLAIN to it.
+        """
+        if not self.enabled:
+            return None
+        shape = normalize_query(query)
+        stats = self._shapes.get(shape)
+        if stats is None:
+            if len(self._shapes) >= MAX_SHAPES:
+                shape = _OVERFLOW_SHAPE
+                stats = self._shapes.setdefault(shape, _ShapeStats())
+            else:
+                stats = self._shapes[shape] = _ShapeStats()
+        stats.calls += 1
+        stats.rows += rows
+        stats.wait_total += wait
+        stats.wait_max = max(stats.wait_max, wait)
+        stats.exec_total += execute
+        stats.exec_max = max(stats.exec_max, execute)
+        stats.convert_total += convert
+        if error is not None:
+            stats.errors += 1
+
+        if execute < self.slow_seconds:
+            return None
+        stats.slow += 1
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "shape": shape,
+            "wait_ms": round(wait * 1000, 2),
+            "exec_ms": round(execute * 1000, 2),
+            "convert_ms": round(convert * 1000, 2),
+            "rows": rows,
+            "error": str(error) if error is not None else None,
+            "plan": None,
+        }
+        self._slow_log.append(entry)
+        print(f"[DB] Slow query ({entry['exec_ms']} ms, {rows} rows, waited {entry['wait_ms']} ms): {shape[:200]}")
+        return entry
+
+    def should_explain(self, query: str, shape: str) -> bool:
+        """Sampling decision for a slow statement; at most one EXPLAIN per shape per interval."""
+        if self.explain_sample_rate <= 0 or not _is_explainable(query):
+            return False
+        if random.random() >= self.explain_sample_rate:
+            return False
+        now = time.monotonic()
+        if now - self._last_explain.get(shape, float("-inf")) < self.explain_interval:
+            return False
+        self._last_explain[shape] = now
+        return True
+
+    def attach_plan(self, entry: dict, plan: str):
+        captured = {"at": datetime.now(timezone.utc).isoformat(), "plan": plan}
+        entry["plan"] = captured
+        stats = self._shapes.get(entry["shape"])
+        if stats is not None:
+            stats.last_plan = captured
+
+    def snapshot(self, limit: int = 50) -> dict:
+        """Shapes ordered by total execution time, plus the slow-query log (newest first)."""
+        shapes = sorted(self._shapes.items(), key=lambda item: item[1].exec_total, reverse=True)
+        return {
+            "enabled": self.enabled,
+            "since": self.since.isoformat(),
+            "slow_ms": self.slow_seconds * 1000,
+            "explain_sample_rate": self.explain_sample_rate,
+            "shapes": [{"shape": shape, **stats.to_dict()} for shape, stats in shapes[:limit]],
+            "slow_log": list(reversed(self._slow_log)),
+        }
+
+
+query_stats = QueryStats(
+    enabled=os.getenv("DB_QUERY_STATS", "1") != "0",
+    slow_ms=float(os.getenv("DB_SLOW_QUERY_MS", "500")),
+    slow_log_size=int(os.getenv("DB_SLOW_LOG_SIZE", "100")),
+    explain_sample_rate=float(os.getenv("DB_EXPLAIN_SAMPLE_RATE", "0")),
+    explain_interval=float(os.getenv("DB_EXPLAIN_INTERVAL", "300")),
+)
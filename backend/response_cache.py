@@ -0,0 +1,94 @@
+"""
+Pre-serialized JSON responses with strong ETags.
+
+Dashboard endpoints derived from the cache snapshot produce identical JSON
+until the snapshot changes, so each (endpoint, filters) body is serialized
+and gzip-compressed once per snapshot version and then served as bytes.
+Requests carrying a matching If-None-Match get an empty 304.
+"""
+import gzip
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+# Below this size gzip costs more than it saves
+GZIP_MIN_BYTES = 1024
+
+
+@dataclass(frozen=True)
+class CachedBody:
+    body: bytes
+    etag: str
+    gzip_body: bytes | None
+    gzip_etag: str | None
+
+    def matches(self, if_none_match: str | None) -> bool:
+        if not if_none_match:
+            return False
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        return "*" in tags or self.etag in tags or (self.gzip_etag is not None and self.gzip_etag in tags)
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = 256):
+        # Keys include client-supplied filter values: keep the least recently used only
+        self.maxsize = maxsize
+        self._version: int | None = None
+        self._entries: OrderedDict[tuple, CachedBody] = OrderedDict()
+
+    def get(self, version: int, key: tuple, build: Callable[[], object]) -> CachedBody:
+        if version != self._version:
+            # New snapshot: every stored body is outdated
+            self._entries = OrderedDict()
+            self._version = version
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _serialize(version, build())
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(key)
+        return entry
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _serialize(version: int, payload) -> CachedBody:
+    body = json.dumps(jsonable_encoder(payload), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    digest = hashlib.blake2b(body, digest_size=10).hexdigest()
+    etag = f'"v{version}-{digest}"'
+    if len(body) >= GZIP_MIN_BYTES:
+        return CachedBody(body, etag, gzip.compress(body, compresslevel=6, mtime=0), f'"v{version}-{digest}-gz"')
+    return CachedBody(body, etag, None, None)
+
+
+def cached_json_response(
+    request: Request,
+    response_cache: ResponseCache,
+    version: int,
+    key: tuple,
+    build: Callable[[], object],
+    headers: dict | None = None,
+) -> Response:
+    """Serve `build()` as JSON from the per-version byte cache, honoring If-None-Match."""
+    entry = response_cache.get(version, key, build)
+    headers = {
+        **(headers or {}),
+        # Always revalidate, but let the browser keep the body and send If-None-Match
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding, Authorization",
+    }
+    use_gzip = entry.gzip_body is not None and "gzip" in request.headers.get("accept-encoding", "")
+    headers["ETag"] = entry.gzip_etag if use_gzip else entry.etag
+
+    if entry.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=entry.gzip_body, media_type="application/json", headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
@@ -0,0 +1,96 @@
+"""
+Small in-process LRU caches for query results derived from the database.
+
+Entries are tied to the cache snapshot version: when a refresh publishes a new
+snapshot (i.e. the ETL loaded data), everything cached for the old version is
+dropped. A TTL bounds staleness between refreshes. Concurrent misses for the
+same key share one load instead of each querying the database.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+
+_MISSING = object()
+
+
+class VersionedLRU:
+    def __init__(self, maxsize: int = 256, ttl_seconds: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl_seconds
+        self._version: int | None = None
+        self._entries: OrderedDict = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _check_version(self, version: int):
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, version: int, key: Hashable, default=None):
+        self._check_version(version)
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def has(self, version: int, key: Hashable) -> bool:
+        """Cached or being loaded (no hit/miss accounting)."""
+        if (version, key) in self._inflight:
+            return True
+        entry = self._entries.get(key) if version == self._version else None
+        return entry is not None and time.monotonic() - entry[0] <= self.ttl
+
+    async def get_or_load(self, version: int, key: Hashable, load: Callable[[], Awaitable]):
+        """Cached value, or the result of `load()`; identical concurrent misses share one load."""
+        value = self.get(version, key, _MISSING)
+        if value is not _MISSING:
+            return value
+        flight_key = (version, key)
+        task = self._inflight.get(flight_key)
+        if task is None:
+            task = asyncio.create_task(load())
+            self._inflight[flight_key] = task
+            task.add_done_callback(lambda t: self._finish_load(version, key, t))
+        else:
+            self.coalesced += 1
+        # Shielded: one caller disconnecting must not cancel the load the others await
+        return await asyncio.shield(task)
+
+    def _finish_load(self, version: int, key: Hashable, task: asyncio.Task):
+        self._inflight.pop((version, key), None)
+        if task.cancelled() or task.exception() is not None:
+            return  # Errors are not cached; the awaiting callers see them
+        if version == self._version:
+            # A load that outlived its snapshot version is discarded
+            self.set(version, key, task.result())
+
+    def set(self, version: int, key: Hashable, value):
+        self._check_version(version)
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def status(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "version": self._version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
@@ -1,71 +1,182 @@
-from fastapi import APIRouter, Depends, Query, Response
+from fastapi import APIRouter, Depends, Query, Request, Response
 from fastapi.responses import StreamingResponse
 from typing import Optional
 from routes.auth import require_auth
-from cache import cache
-from datetime import datetime
+from cache import cache, get_catalog_values, get_rollup, get_programs, get_program_names, normalize_filter
+from response_cache import ResponseCache, cached_json_response
+from result_cache import VersionedLRU
+from filters import LeadFilters, compile_filters
+from indexes import PROGRAM_KEY_EXPR
+from excel_style import style_sheet
+import asyncpg
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 import io
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 
 router = APIRouter(prefix="/api/dashboard", tags=["dashboard"])
 
+# Serialized bodies of the snapshot-derived endpoints, per cache version
+_responses = ResponseCache(maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "256")))
+
+# /leads totals per (count mode, filter signature), dropped on every new snapshot
+_lead_counts = VersionedLRU(
+    maxsize=int(os.getenv("LEADS_COUNT_CACHE_SIZE", "512")),
+    ttl_seconds=float(os.getenv("LEADS_COUNT_TTL", "600")),
+)
+# count=auto serves the planner estimate when it is at least this large
+LEADS_COUNT_ESTIMATE_THRESHOLD = int(os.getenv("LEADS_COUNT_ESTIMATE_THRESHOLD", "50000"))
+# Whole /leads responses per (filters, count mode, page size, page/cursor)
+_lead_pages = VersionedLRU(
+    maxsize=int(os.getenv("LEADS_PAGE_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.getenv("LEADS_PAGE_TTL", "120")),
+)
+# /leads/facets results per filter signature
+_lead_facets = VersionedLRU(
+    maxsize=int(os.getenv("LEADS_FACETS_CACHE_SIZE", "128")),
+    ttl_seconds=float(os.getenv("LEADS_FACETS_TTL", "600")),
+)
+# Facet column -> grouping expression
+_FACETS = {
+    "base": "base",
+    "estado": "ultima_mejor_subcat_string",
+    "programa": PROGRAM_KEY_EXPR,
+}
+# Load page N+1 in the background after serving page N
+LEADS_PREFETCH = os.getenv("LEADS_PREFETCH", "1") != "0"
+_prefetch_tasks: set = set()
+
+
+def _cached_json(request: Request, endpoint: str, nivel, area, build):
+    """Serve `build()` once per (endpoint, nivel, area, snapshot version), with ETag/304."""
+    version = cache.version
+    key = (endpoint, normalize_filter(nivel), normalize_filter(area))
+    age = cache.age_seconds
+    headers = {"X-Cache-Version": str(version)}
+    if age is not None:
+        headers["X-Cache-Age"] = str(int(age))
+    return cached_json_response(request, _responses, version, key, build, headers=headers)
+
+
+def _program_frame(data, nivel, columns: dict) -> pd.DataFrame:
+    """
+    DataFrame of programs for a nivel filter, one column per header.
+    A (num, den) tuple becomes a vectorized percentage column.
+    """
+    programs = data.get("programs")
+    if programs is None:
+        return pd.DataFrame(columns=list(columns))
+    idx = get_rollup(data, nivel)["index"]
+    text_columns = {"programa": programs.names, "nivel": programs.nivel, "area": programs.area}
+    frame = {}
+    for header, source in columns.items():
+        if isinstance(source, tuple):
+            frame[header] = programs.pct(*source, idx)
+        elif source in text_columns:
+            frame[header] = text_columns[source](idx)
+        else:
+            frame[header] = programs.column(source, idx)
+    return pd.DataFrame(frame)
+
+
+# /export: rows fetched per cursor round trip, and the sheet's (header, width) columns
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+EXPORT_LEADS_COLUMNS = [
+    ("ID INTERNO", 14),
+    ("NOMBRE Y APELLIDO", 34),
+    ("EMAIL", 34),
+    ("TELEFONO", 18),
+    ("PROGRAMA INTERES", 44),
+    ("BASE DE DATOS", 22),
+    ("ESTADO GESTION", 26),
+    ("SUBCATEGORIA", 30),
+    ("FECHA ACTIVIDAD", 18),
+]
+
+
+# Lead export rows; column aliases are the sheet/CSV headers
+EXPORT_LEADS_QUERY = """
+    SELECT 
+        idinterno AS "ID INTERNO", 
+        txtnombreapellido AS "NOMBRE Y APELLIDO", 
+        emlmail AS "EMAIL", 
+        teltelefono AS "TELEFONO", 
+        txtprogramainteres AS "PROGRAMA INTERES", 
+        base AS "BASE DE DATOS",
+        ultima_mejor_subcat_string AS "ESTADO GESTION",
+        descrip_subcat AS "SUBCATEGORIA",
+        fecha_a_utilizar AS "FECHA ACTIVIDAD"
+    FROM dim_contactos
+    WHERE {where}
+    ORDER BY {order}
+"""
+class _ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that always closes `source`, the generator the body
+    reads from, once the response ends: also when the client left before the
+    body started, which never runs the body's own finally.
+    """
 
-def _pct(num, den):
-    """Calcula el porcentaje de forma segura."""
-    if not den or den == 0:
-        return 0.0
-    return round(float(num) / float(den) * 100, 1)
+    def __init__(self, content, source, **kwargs):
+        super().__init__(content, **kwargs)
+        self.source = source
 
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            # Releases the cursor/COPY connection and its bulkhead slot
+            await self.source.aclose()
 
-def apply_excel_style(worksheet, sheet_name="Sheet1"):
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    
-    # Styling constants
-    header_fill = PatternFill(start_color='1E3A8A', end_color='1E3A8A', fill_type='solid') # Blue-900
-    header_font = Font(color='FFFFFF', bold=True, size=11)
-    center_alignment = Alignment(horizontal='center', vertical='center')
-    border = Border(
-        left=Side(style='thin', color='E2E8F0'),
-        right=Side(style='thin', color='E2E8F0'),
-        top=Side(style='thin', color='E2E8F0'),
-        bottom=Side(style='thin', color='E2E8F0')
-    )
-    
-    # Format Headers (First Row)
-    for cell in worksheet[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = center_alignment
-        cell.border = border
-        
-    # Auto-adjust column width and alternate row shading
-    for col in worksheet.columns:
-        max_length = 0
-        column = col[0].column_letter # Get the column name
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-                
-                # Apply borders and padding-like styling
-                if cell.row > 1:
-                    cell.border = border
-                    
-                    # Colores condicionales para el NIVEL
-                    val_str = str(cell.value).upper() if cell.value else ""
-                    if val_str == "GRADO":
-                        cell.fill = PatternFill(start_color='DBEAFE', end_color='DBEAFE', fill_type='solid') # Azul claro
-                        cell.font = Font(color='1E40AF', bold=True) # Azul oscuro
-                    elif val_str == "POSGRADO":
-                        cell.fill = PatternFill(start_color='F3E8FF', end_color='F3E8FF', fill_type='solid') # Violeta claro
-                        cell.font = Font(color='6B21A8', bold=True) # Violeta oscuro
-                    elif cell.row % 2 == 0:
-                        cell.fill = PatternFill(start_color='F8FAFC', end_color='F8FAFC', fill_type='solid')
-            except:
-                pass
-        adjusted_width = (max_length + 4)
-        worksheet.column_dimensions[column].width = min(adjusted_width, 50) # Cap width
+
+# UTF-8 byte order mark: makes Excel open CSV files as UTF-8
+UTF8_BOM = b"\xef\xbb\xbf"
+
+
+async def _csv_download(request: Request, query: str, args: list, filename: str, gzip: bool, bom: bool):
+    """
+    Stream `query` as CSV straight out of PostgreSQL's COPY protocol. With
+    gzip (and a client that accepts it) the body is compressed on the fly and
+    sent with Content-Encoding: gzip, so browsers still save a plain .csv.
+    """
+    import zlib
+    from database import copy_csv
+
+    chunks = copy_csv(query, *args)
+    # Pull the first chunk up front so saturation/query errors still get a proper status
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    use_gzip = gzip and "gzip" in request.headers.get("accept-encoding", "")
+
+    async def generate():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+        try:
+            data = (UTF8_BOM if bom else b"") + first
+            while True:
+                if compressor is None:
+                    yield data
+                elif out := compressor.compress(data):
+                    yield out
+                try:
+                    data = await chunks.__anext__()
+                except StopAsyncIteration:
+                    break
+            if compressor is not None:
+                yield compressor.flush()
+        finally:
+            await chunks.aclose()
+
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        headers["Vary"] = "Accept-Encoding"
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+    return _ClosingStreamingResponse(generate(), chunks, media_type="text/csv; charset=utf-8", headers=headers)
 
 
 @router.get("/export")
@@ -74,129 +185,116 @@ async def export_leads(
     base: Optional[str] = Query(None),
     programa: Optional[str] = Query(None),
     nivel: Optional[str] = Query(None),
+    area: Optional[str] = Query(None),
     estado: Optional[str] = Query(None),
     fecha_inicio: Optional[str] = Query(None),
     fecha_fin: Optional[str] = Query(None),
     no_util: Optional[bool] = Query(False),
     _user: str = Depends(require_auth),
 ):
-    from database import fetch_all
-    
-    where_clauses = ["1=1"]
-    args = []
+    from database import stream
+    from pagination import ORDER_BY
+    from xlsx_stream import XlsxStreamWriter
 
-    if no_util:
-        where_clauses.append("(descrip_cat ILIKE '%no util%' OR descrip_cat ILIKE '%descarte%')")
-    
-    if search:
-        where_clauses.append(f"(txtnombreapellido ILIKE ${len(args)+1} OR emlmail ILIKE ${len(args)+1} OR teltelefono ILIKE ${len(args)+1})")
-        args.append(f"%{search}%")
-        
-    if base:
-        where_clauses.append(f"base = ${len(args)+1}")
-        args.append(base)
-        
-    if programa:
-        where_clauses.append(f"txtprogramainteres ILIKE ${len(args)+1}")
-        args.append(f"%{programa}%")
-        
-    if estado:
-        where_clauses.append(f"ultima_mejor_subcat_string = ${len(args)+1}")
-        args.append(estado)
-        
-    if fecha_inicio:
-        where_clauses.append(f"fecha_a_utilizar >= ${len(args)+1}")
-        args.append(fecha_inicio)
-        
-    if fecha_fin:
-        where_clauses.append(f"fecha_a_utilizar <= ${len(args)+1}")
-        args.append(fecha_fin)
-        
-    if nivel and nivel.upper() != "TODOS":
-        target_nivel = nivel.upper()
-        data_cache = await cache.get_all()
-        programs_of_level = [p["programa"] for p in data_cache.get("merged_programs", []) if p.get("nivel") == target_nivel]
-        
-        if programs_of_level:
-            placeholders = ",".join(f"${len(args)+i+1}" for i in range(len(programs_of_level)))
-            where_clauses.append(f"UPPER(TRIM(txtprogramainteres)) IN ({placeholders})")
-            args.extend(programs_of_level)
-        else:
-            where_clauses.append("1=0")
-        
-    where_sql = " AND ".join(where_clauses)
-    
-    data_query = f"""
-        SELECT 
-            idinterno AS "ID INTERNO", 
-            txtnombreapellido AS "NOMBRE Y APELLIDO", 
-            emlmail AS "EMAIL", 
-            teltelefono AS "TELEFONO", 
-            txtprogramainteres AS "PROGRAMA INTERES", 
-            base AS "BASE DE DATOS",
-            ultima_mejor_subcat_string AS "ESTADO GESTION",
-            descrip_subcat AS "SUBCATEGORIA",
-            fecha_a_utilizar AS "FECHA ACTIVIDAD"
-        FROM dim_contactos
-        WHERE {where_sql}
-        ORDER BY fecha_a_utilizar DESC NULLS LAST
-    """
-    
-    rows = await fetch_all(data_query, *args)
-    print(f"[Export] Exporting {len(rows)} leads for user. Filters: no_util={no_util}, nivel={nivel}, search={search}")
-    df = pd.DataFrame(rows)
+    filters = await _lead_filters(
+        search, base, programa, nivel, estado, fecha_inicio, fecha_fin, area=area, no_util=no_util,
+    )
+    where_sql, args = compile_filters(filters)
     
-    # Generate Excel in memory
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Leads')
-        apply_excel_style(writer.sheets['Leads'])
+    data_query = EXPORT_LEADS_QUERY.format(where=where_sql, order=ORDER_BY)
+    batches = stream(data_query, *args, batch_size=EXPORT_BATCH_SIZE)
+    # Pull the first batch up front so saturation/query errors still get a proper status
+    try:
+        first = await batches.__anext__()
+    except StopAsyncIteration:
+        first = []
+    print(f"[Export] Streaming leads export. Filters: no_util={no_util}, nivel={nivel}, search={search}")
+
+    async def generate():
+        # Rows go straight from the cursor into the zip stream: memory is bounded by one batch
+        writer = XlsxStreamWriter(EXPORT_LEADS_COLUMNS, sheet_name="Leads")
+        try:
+            yield writer.header()
+            batch = first
+            while batch:
+                yield await asyncio.to_thread(writer.write_rows, [tuple(row.values()) for row in batch])
+                try:
+                    batch = await batches.__anext__()
+                except StopAsyncIteration:
+                    break
+            yield writer.close()
+            print(f"[Export] Exported {writer.rows_written} leads")
+        finally:
+            await batches.aclose()
 
-    output.seek(0)
-    
     headers = {
         'Content-Disposition': 'attachment; filename="Expert_Leads_Report.xlsx"'
     }
     
-    return StreamingResponse(
-        output,
+    return _ClosingStreamingResponse(
+        generate(),
+        batches,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers=headers
     )
 
 
+@router.get("/export-csv")
+async def export_leads_csv(
+    request: Request,
+    search: Optional[str] = Query(None),
+    base: Optional[str] = Query(None),
+    programa: Optional[str] = Query(None),
+    nivel: Optional[str] = Query(None),
+    area: Optional[str] = Query(None),
+    estado: Optional[str] = Query(None),
+    fecha_inicio: Optional[str] = Query(None),
+    fecha_fin: Optional[str] = Query(None),
+    no_util: Optional[bool] = Query(False),
+    gzip: bool = Query(False),
+    bom: bool = Query(True),
+    _user: str = Depends(require_auth),
+):
+    """Same rows and filters as /export, as CSV streamed with COPY ... TO STDOUT."""
+    from pagination import ORDER_BY
+
+    filters = await _lead_filters(
+        search, base, programa, nivel, estado, fecha_inicio, fecha_fin, area=area, no_util=no_util,
+    )
+    where_sql, args = compile_filters(filters)
+    print(f"[Export] Streaming leads CSV. Filters: no_util={no_util}, nivel={nivel}, search={search}")
+    filename = f"Reporte_Leads_{datetime.now().strftime('%Y%m%d')}.csv"
+    return await _csv_download(
+        request, EXPORT_LEADS_QUERY.format(where=where_sql, order=ORDER_BY), args, filename, gzip, bom,
+    )
+
+
 @router.get("/export-admisiones")
 async def export_admisiones(
     nivel: Optional[str] = Query(None),
     _user: str = Depends(require_auth)
 ):
     data = await cache.get_all()
-    merged = data.get("merged_programs", [])
     
     if nivel and nivel.upper() != "TODOS":
         nivel = nivel.upper()
-        merged = [p for p in merged if p.get("nivel") == nivel]
-    
-    # Clean data for export
-    export_data = []
-    for p in merged:
-        export_data.append({
-            "PROGRAMA": p.get("programa"),
-            "NIVEL": p.get("nivel"),
-            "AREA": p.get("area"),
-            "LEADS": p.get("leads"),
-            "SOLICITADOS": p.get("solicitados"),
-            "ADMITIDOS": p.get("admitidos"),
-            "PAGADOS": p.get("pagados"),
-            "META": p.get("meta"),
-            "CUMPLIMIENTO %": _pct(p.get("pagados", 0), p.get("meta", 0))
-        })
     
-    df = pd.DataFrame(export_data)
+    # Built column-wise straight from the program arrays
+    df = _program_frame(data, nivel, {
+        "PROGRAMA": "programa",
+        "NIVEL": "nivel",
+        "AREA": "area",
+        "LEADS": "leads",
+        "SOLICITADOS": "solicitados",
+        "ADMITIDOS": "admitidos",
+        "PAGADOS": "pagados",
+        "META": "meta",
+        "CUMPLIMIENTO %": ("pagados", "meta"),
+    })
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
         df.to_excel(writer, index=False, sheet_name='Admisiones')
-        apply_excel_style(writer.sheets['Admisiones'])
+        style_sheet(writer.sheets['Admisiones'], df)
 
     output.seek(0)
     filename = f"Reporte_Admisiones_{nivel if nivel else 'GLOBAL'}_{datetime.now().strftime('%Y%m%d')}.xlsx"
@@ -209,9 +307,19 @@ async def export_admisiones(
 
 
 @router.get("/kpis")
-async def get_kpis(nivel: Optional[str] = Query(None), _user: str = Depends(require_auth)):
+async def get_kpis(
+    request: Request,
+    nivel: Optional[str] = Query(None),
+    area: Optional[str] = Query(None),
+    _user: str = Depends(require_auth),
+):
     data = await cache.get_all()
-    if not nivel or nivel.upper() == "TODOS":
+    return _cached_json(request, "kpis", nivel, area, lambda: _kpis_payload(data, nivel, area))
+
+
+def _kpis_payload(data, nivel, area) -> dict:
+    nivel, area = normalize_filter(nivel), normalize_filter(area)
+    if not nivel and not area:
         totals = data.get("totals", {})
         return {
             "total_leads": data.get("total_leads", 0),
@@ -228,86 +336,73 @@ async def get_kpis(nivel: Optional[str] = Query(None), _user: str = Depends(requ
             "trends": data.get("trends", {})
         }
     
-    # Filter and re-aggregate
-    nivel = nivel.upper()
-    programs = [p for p in data.get("merged_programs", []) if str(p.get("nivel", "")).upper() == nivel]
-    
-    total_leads = sum(p.get("leads", 0) for p in programs)
-    en_gestion = sum(p.get("en_gestion", 0) for p in programs)
-    op_venta = sum(p.get("op_venta", 0) for p in programs)
-    solicitados = sum(p.get("solicitados", 0) for p in programs)
-    admitidos = sum(p.get("admitidos", 0) for p in programs)
-    pagados = sum(p.get("pagados", 0) for p in programs)
-    metas = sum(p.get("meta", 0) for p in programs)
-    proceso_pago = sum(p.get("proceso_pago", 0) for p in programs)
-    no_util_total = sum(p.get("no_util", 0) for p in programs)
+    # Pre-aggregated at refresh time
+    rollup = get_rollup(data, nivel, area)
+    totals = rollup["totals"]
 
     return {
-        "total_leads": total_leads,
-        "en_gestion": en_gestion,
-        "op_venta": op_venta,
-        "solicitados": solicitados,
-        "admitidos": admitidos,
-        "pagados": pagados,
-        "metas": metas,
-        "matriculados": pagados,
-        "proceso_pago": proceso_pago,
-        "no_util_total": no_util_total,
+        "total_leads": rollup["total_leads"],
+        "en_gestion": rollup["en_gestion"],
+        "op_venta": rollup["op_venta"],
+        "solicitados": totals["solicitados"],
+        "admitidos": totals["admitidos"],
+        "pagados": totals["pagados"],
+        "metas": totals["metas"],
+        "matriculados": totals["pagados"],
+        "proceso_pago": rollup["proceso_pago"],
+        "no_util_total": rollup["no_util_total"],
         "fecha_actualizacion": data.get("fecha_actualizacion", ""),
         "trends": {} # Trends are complex to re-calc on the fly, keeping empty for filtered view
     }
 
 
 @router.get("/funnel")
-async def get_funnel(nivel: Optional[str] = Query(None), _user: str = Depends(require_auth)):
+async def get_funnel(
+    request: Request,
+    nivel: Optional[str] = Query(None),
+    area: Optional[str] = Query(None),
+    _user: str = Depends(require_auth),
+):
     data = await cache.get_all()
-    
-    if not nivel or nivel.upper() == "TODOS":
+    return _cached_json(request, "funnel", nivel, area, lambda: _funnel_payload(data, nivel, area))
+
+
+def _funnel_payload(data, nivel, area) -> list:
+    nivel, area = normalize_filter(nivel), normalize_filter(area)
+    if not nivel and not area:
         funnel_data = data.get("funnel", [])
         total_leads = data.get("total_leads", 0)
     else:
-        nivel = nivel.upper()
-        programs = [p for p in data.get("merged_programs", []) if str(p.get("nivel", "")).upper() == nivel]
-        total_leads = sum(p.get("leads", 0) for p in programs)
-        en_gestion = sum(p.get("en_gestion", 0) for p in programs)
-        op_venta = sum(p.get("op_venta", 0) for p in programs)
-        proceso_pago = sum(p.get("proceso_pago", 0) for p in programs)
-        pagados = sum(p.get("pagados", 0) for p in programs)
-        
-        funnel_data = [
-            {"stage": "Total Leads", "value": total_leads, "color": "#f59e0b"},
-            {"stage": "En Gestión", "value": en_gestion, "color": "#d97706"},
-            {"stage": "Oportunidad de Venta", "value": op_venta, "color": "#ea580c"},
-            {"stage": "Proceso Pago", "value": proceso_pago, "color": "#dc2626"},
-            {"stage": "Matriculados", "value": pagados, "color": "#16a34a"},
-        ]
-    
-    # Calculate percentages for safety
-    for f in funnel_data:
-        f["percent"] = round(f["value"] / total_leads * 100, 2) if total_leads else 0
-        
-    return funnel_data
+        rollup = get_rollup(data, nivel, area)
+        funnel_data = rollup["funnel"]
+        total_leads = rollup["total_leads"]
+    
+    # Calculate percentages on copies so the cached funnel stays untouched
+    return [
+        {**f, "percent": round(f["value"] / total_leads * 100, 2) if total_leads else 0}
+        for f in funnel_data
+    ]
 
 
 @router.get("/admisiones")
-async def get_admisiones(nivel: Optional[str] = Query(None), _user: str = Depends(require_auth)):
+async def get_admisiones(
+    request: Request,
+    nivel: Optional[str] = Query(None),
+    area: Optional[str] = Query(None),
+    _user: str = Depends(require_auth),
+):
     data = await cache.get_all()
-    merged = data.get("merged_programs", [])
-    
-    if nivel and nivel.upper() != "TODOS":
-        nivel = nivel.upper()
-        merged = [p for p in merged if p.get("nivel") == nivel]
-        
-        totals = {
-            "solicitados": sum(p.get("solicitados", 0) for p in merged),
-            "admitidos": sum(p.get("admitidos", 0) for p in merged),
-            "pagados": sum(p.get("pagados", 0) for p in merged),
-            "metas": sum(p.get("meta", 0) for p in merged),
-        }
-        return {"programas": merged, "totals": totals, "trends": {}}
+    return _cached_json(request, "admisiones", nivel, area, lambda: _admisiones_payload(data, nivel, area))
+
+
+def _admisiones_payload(data, nivel, area) -> dict:
+    nivel, area = normalize_filter(nivel), normalize_filter(area)
+    if nivel or area:
+        rollup = get_rollup(data, nivel, area)
+        return {"programas": get_programs(data, nivel, area), "totals": rollup["totals"], "trends": {}}
 
     return {
-        "programas": merged,
+        "programas": get_programs(data),
         "totals": data.get("totals", {}),
         "trends": data.get("trends", {}),
     }
@@ -319,36 +414,30 @@ async def export_estados(
     _user: str = Depends(require_auth)
 ):
     data = await cache.get_all()
-    merged = data.get("merged_programs", [])
     
     if nivel and nivel.upper() != "TODOS":
         nivel = nivel.upper()
-        merged = [p for p in merged if p.get("nivel") == nivel]
     
-    # Clean data for export
-    export_data = []
-    for p in merged:
-        export_data.append({
-            "PROGRAMA": p.get("programa"),
-            "NIVEL": p.get("nivel"),
-            "LEADS": p.get("leads"),
-            "EN GESTION": p.get("en_gestion"),
-            "NO UTIL": p.get("no_util"),
-            "OP. VENTA": p.get("op_venta"),
-            "PROC. PAGO": p.get("proceso_pago"),
-            "SOLICITADOS": p.get("solicitados"),
-            "ADMITIDOS": p.get("admitidos"),
-            "PAGADOS": p.get("pagados"),
-            "META": p.get("meta"),
-            "AVANCE %": _pct(p.get("pagados", 0), p.get("meta", 0)),
-            "CONVERSION %": _pct(p.get("pagados", 0), p.get("leads", 0))
-        })
-    
-    df = pd.DataFrame(export_data)
+    # Built column-wise straight from the program arrays
+    df = _program_frame(data, nivel, {
+        "PROGRAMA": "programa",
+        "NIVEL": "nivel",
+        "LEADS": "leads",
+        "EN GESTION": "en_gestion",
+        "NO UTIL": "no_util",
+        "OP. VENTA": "op_venta",
+        "PROC. PAGO": "proceso_pago",
+        "SOLICITADOS": "solicitados",
+        "ADMITIDOS": "admitidos",
+        "PAGADOS": "pagados",
+        "META": "meta",
+        "AVANCE %": ("pagados", "meta"),
+        "CONVERSION %": ("pagados", "leads"),
+    })
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
         df.to_excel(writer, index=False, sheet_name='Estados de Gestion')
-        apply_excel_style(writer.sheets['Estados de Gestion'])
+        style_sheet(writer.sheets['Estados de Gestion'], df)
 
     output.seek(0)
     filename = f"Reporte_Estados_{nivel if nivel else 'GLOBAL'}_{datetime.now().strftime('%Y%m%d')}.xlsx"
@@ -360,24 +449,24 @@ async def export_estados(
     )
 
 @router.get("/estados")
-async def get_estados(nivel: Optional[str] = Query(None), _user: str = Depends(require_auth)):
+async def get_estados(
+    request: Request,
+    nivel: Optional[str] = Query(None),
+    area: Optional[str] = Query(None),
+    _user: str = Depends(require_auth),
+):
     data = await cache.get_all()
-    merged = data.get("merged_programs", [])
-    
-    if nivel and nivel.upper() != "TODOS":
-        nivel = nivel.upper()
-        merged = [p for p in merged if p.get("nivel") == nivel]
-        
-        totals = {
-            "solicitados": sum(p.get("solicitados", 0) for p in merged),
-            "admitidos": sum(p.get("admitidos", 0) for p in merged),
-            "pagados": sum(p.get("pagados", 0) for p in merged),
-            "metas": sum(p.get("meta", 0) for p in merged),
-        }
-        return {"estados_by_programa": merged, "totals": totals, "trends": {}, "admitidos_status": {}, "estados_gestion": []}
+    return _cached_json(request, "estados", nivel, area, lambda: _estados_payload(data, nivel, area))
+
+
+def _estados_payload(data, nivel, area) -> dict:
+    nivel, area = normalize_filter(nivel), normalize_filter(area)
+    if nivel or area:
+        rollup = get_rollup(data, nivel, area)
+        return {"estados_by_programa": get_programs(data, nivel, area), "totals": rollup["totals"], "trends": {}, "admitidos_status": {}, "estados_gestion": []}
 
     return {
-        "estados_by_programa": merged,
+        "estados_by_programa": get_programs(data),
         "totals": data.get("totals", {}),
         "trends": data.get("trends", {}),
         "admitidos_status": {},
@@ -388,34 +477,45 @@ async def get_estados(nivel: Optional[str] = Query(None), _user: str = Depends(r
 @router.get("/no-util")
 async def get_no_util(nivel: Optional[str] = Query(None), _user: str = Depends(require_auth)):
     from database import fetch_all
+    from program_dimension import TABLE as DIMENSION_TABLE, dimension_available, invalidate_dimension
     data_cache = await cache.get_all()
 
     rows = []
     try:
         # Query agg_no_utiles directly so we get all subcategories
-        if nivel and nivel.upper() != "TODOS":
-            target_nivel = nivel.upper()
-            programs_of_level = [p["programa"] for p in data_cache.get("merged_programs", []) if p.get("nivel") == target_nivel]
-
-            if not programs_of_level:
-                return {"no_util": [], "no_util_total": 0, "trends": {}}
+        if normalize_filter(nivel):
+            target_nivel = normalize_filter(nivel)
+            if await dimension_available():
+                # Nivel resolved in SQL through the program dimension table
+                program_filter = f"UPPER(TRIM(programa)) IN (SELECT programa_key FROM {DIMENSION_TABLE} WHERE nivel = $1)"
+                filter_arg = target_nivel
+            else:
+                programs_of_level = get_program_names(data_cache, target_nivel)
+                if not programs_of_level:
+                    return {"no_util": [], "no_util_total": 0, "trends": {}}
+                program_filter = "UPPER(TRIM(programa)) = ANY($1::text[])"
+                filter_arg = programs_of_level
 
-            placeholders = ",".join(f"${i+1}" for i in range(len(programs_of_level)))
             query = f"""
                 SELECT descripcion_sub,
                        SUM(leads_no_utiles) AS leads
                 FROM agg_no_utiles
-                WHERE UPPER(TRIM(programa)) IN ({placeholders})
+                WHERE {program_filter}
                 GROUP BY descripcion_sub
                 ORDER BY leads DESC
             """
-            rows = await fetch_all(query, *programs_of_level)
+            rows = await fetch_all(query, filter_arg)
+            if not rows:
+                # No programs (or no no-util leads) for this nivel; the global fallback below would be wrong
+                return {"no_util": [], "no_util_total": 0, "trends": {}}
         else:
             rows = await fetch_all(
                 "SELECT descripcion_sub, SUM(leads_no_utiles) AS leads FROM agg_no_utiles GROUP BY descripcion_sub ORDER BY leads DESC"
             )
     except Exception as e:
         print(f"[no-util] agg_no_utiles query failed ({e}), falling back to cache")
+        if isinstance(e, asyncpg.exceptions.UndefinedTableError):
+            invalidate_dimension(e)
         rows = []
 
     # Fallback: if query returned nothing, use the cached dim_contactos data
@@ -455,10 +555,12 @@ async def export_no_util(
     nivel: Optional[str] = Query(None),
     _user: str = Depends(require_auth)
 ):
-    from database import fetch_all
+    from database import EXPORT, PoolSaturated, fetch_all
     
     try:
-        rows = await fetch_all("SELECT * FROM agg_no_utiles_completo")
+        rows = await fetch_all("SELECT * FROM agg_no_utiles_completo", workload=EXPORT)
+    except PoolSaturated:
+        raise
     except Exception as e:
         print(f"[Export No Util] Error: {e}")
         from fastapi import HTTPException
@@ -486,7 +588,7 @@ async def export_no_util(
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
         df.to_excel(writer, index=False, sheet_name='Detalle No Utiles')
-        apply_excel_style(writer.sheets['Detalle No Utiles'])
+        style_sheet(writer.sheets['Detalle No Utiles'], df)
 
     output.seek(0)
     filename = f"Detalle_No_Utiles_{nivel if nivel else 'TODOS'}_{datetime.now().strftime('%Y%m%d')}.xlsx"
@@ -499,35 +601,24 @@ async def export_no_util(
 
 
 @router.get("/no-util-csv")
-async def download_no_util_csv(_user: str = Depends(require_auth)):
-    """Download the full agg_no_utiles_completo table as a CSV file."""
-    from database import fetch_all
+async def download_no_util_csv(
+    request: Request,
+    gzip: bool = Query(False),
+    bom: bool = Query(True),
+    _user: str = Depends(require_auth),
+):
+    """Download the full agg_no_utiles_completo table as CSV, streamed with COPY ... TO STDOUT."""
+    from database import PoolSaturated
+
     try:
-        rows = await fetch_all("SELECT * FROM agg_no_utiles_completo")
+        return await _csv_download(
+            request, "SELECT * FROM agg_no_utiles_completo", [], "agg_no_utiles_completo.csv", gzip, bom,
+        )
+    except PoolSaturated:
+        raise
     except Exception as e:
         print(f"[no-util-csv] Error fetching agg_no_utiles_completo: {e}")
         return Response(content=f"Error al acceder a la tabla: {e}", media_type="text/plain", status_code=500)
-    
-    if not rows:
-        return Response(content="Sin datos en agg_no_utiles_completo", media_type="text/plain")
-    
-    headers_list = list(rows[0].keys())
-    lines = [",".join(headers_list)]
-    for row in rows:
-        values = []
-        for h in headers_list:
-            val = str(row.get(h, "") if row.get(h) is not None else "")
-            if "," in val or '"' in val:
-                val = f'"{val.replace(chr(34), chr(34)+chr(34))}"'
-            values.append(val)
-        lines.append(",".join(values))
-    csv_content = "\n".join(lines)
-    
-    return Response(
-        content=csv_content.encode("utf-8-sig"),
-        media_type="text/csv",
-        headers={"Content-Disposition": 'attachment; filename="agg_no_utiles_completo.csv"'},
-    )
 
 
 @router.get("/admitidos")
@@ -540,115 +631,387 @@ async def get_admitidos(_user: str = Depends(require_auth)):
     }
 
 
+async def _lead_filters(
+    search, base, programa, nivel, estado, fecha_inicio, fecha_fin, area=None, no_util=False,
+) -> LeadFilters:
+    """
+    Lead filters from query params. Nivel/area filter through dim_programa_nivel,
+    or through the program list in the cache when that table is unavailable.
+    """
+    from program_dimension import dimension_available
+
+    nivel, area = normalize_filter(nivel), normalize_filter(area)
+    programs = None
+    if (nivel or area) and not await dimension_available():
+        data = await cache.get_all()
+        programs = tuple(get_program_names(data, nivel, area))
+        nivel = area = None
+    return LeadFilters(
+        search=search, base=base, programa=programa, estado=estado,
+        fecha_inicio=fecha_inicio, fecha_fin=fecha_fin,
+        nivel=nivel, area=area, programs=programs, no_util=bool(no_util),
+    )
+
+
+async def _count_leads(where_sql: str, args: list, mode: str) -> tuple[int, bool]:
+    """
+    (total, is_estimate) for a /leads filter. 'estimate' reads the planner's row
+    estimate instead of counting; 'auto' only counts exactly when that estimate
+    is small, where an exact count is cheap and the error would be noticeable.
+    """
+    from database import fetch_one
+
+    if mode in ("estimate", "auto"):
+        plan_row = await fetch_one(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM dim_contactos WHERE {where_sql}", *args)
+        plan = plan_row["QUERY PLAN"] if plan_row else None
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]["Plan"]["Plan Rows"]) if plan else 0
+        if mode == "estimate" or estimate >= LEADS_COUNT_ESTIMATE_THRESHOLD:
+            return estimate, True
+
+    total_row = await fetch_one(f"SELECT COUNT(*) as total FROM dim_contactos WHERE {where_sql}", *args)
+    return (total_row["total"] if total_row else 0), False
+
+
+async def _load_leads_page(
+    where_sql: str, args: list, signature: str, count: str, version: int,
+    per_page: int, page: int | None = None, after: tuple | None = None,
+) -> dict:
+    """
+    One /leads response. page=N uses OFFSET (legacy clients); otherwise keyset
+    mode seeks past `after`, the (fecha, idinterno) of the last row served, so
+    any depth costs the same.
+    """
+    from database import fetch_all
+    from pagination import ORDER_BY, encode_cursor, keyset_branches
+
+    branches, offset = [(where_sql, list(args))], 0
+    if page is not None:
+        offset = (page - 1) * per_page
+    elif after is not None:
+        branches = [
+            (f"{where_sql} AND {clause}", [*args, *clause_args])
+            for clause, clause_args in keyset_branches(*after, len(args) + 1)
+        ]
+
+    async def fetch_page():
+        rows = []
+        for branch_where, branch_args in branches:
+            rows += await fetch_all(f"""
+                SELECT 
+                    idinterno, txtnombreapellido, emlmail, teltelefono, 
+                    feccreacionoportunidad, txtprogramainteres, base,
+                    descrip_subcat, ultima_mejor_subcat_string, cant_toques_call_crm, fecha_a_utilizar
+                FROM dim_contactos
+                WHERE {branch_where}
+                ORDER BY {ORDER_BY}
+                LIMIT {per_page - len(rows)} OFFSET {offset}
+            """, *branch_args)
+            if len(rows) >= per_page:
+                break
+        return rows
+    
+    # Paging through the same filter reuses its total; otherwise count alongside the page query
+    counted = _lead_counts.get(version, (count, signature))
+    if counted is None:
+        counted, rows = await asyncio.gather(_count_leads(where_sql, args, count), fetch_page())
+        _lead_counts.set(version, (count, signature), counted)
+    else:
+        rows = await fetch_page()
+    total, total_is_estimate = counted
+    next_cursor = encode_cursor(rows[-1], signature) if len(rows) == per_page else None
+    
+    response = {
+        "data": rows,
+        "total": total,
+        "total_is_estimate": total_is_estimate,
+        "per_page": per_page,
+        "next_cursor": next_cursor,
+    }
+    if page is not None:
+        response["page"] = page
+    return response
+
+
+def _prefetch_leads_page(version: int, key: tuple, load):
+    """Warm the page cache for the page the user is likely to open next."""
+    if _lead_pages.has(version, key):
+        return
+
+    async def run():
+        try:
+            await _lead_pages.get_or_load(version, key, load)
+        except Exception as e:
+            print(f"[Leads] Prefetch failed: {e}")
+
+    task = asyncio.create_task(run())
+    _prefetch_tasks.add(task)
+    task.add_done_callback(_prefetch_tasks.discard)
+
+
 @router.get("/leads")
 async def get_leads(
     page: int = Query(1, ge=1),
     per_page: int = Query(25, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Keyset mode: '' for the first page, then next_cursor"),
+    count: str = Query("exact", pattern="^(exact|estimate|auto)$"),
+    prefetch: bool = Query(True),
     search: Optional[str] = Query(None),
     base: Optional[str] = Query(None),
     programa: Optional[str] = Query(None),
     nivel: Optional[str] = Query(None),
+    area: Optional[str] = Query(None),
     estado: Optional[str] = Query(None),
     fecha_inicio: Optional[str] = Query(None),
     fecha_fin: Optional[str] = Query(None),
     _user: str = Depends(require_auth),
 ):
-    from database import fetch_all, fetch_one
-    from mapping import mapping
-    
-    where_clauses = ["1=1"]
-    args = []
-    
-    if search:
-        where_clauses.append(f"(txtnombreapellido ILIKE ${len(args)+1} OR emlmail ILIKE ${len(args)+1} OR teltelefono ILIKE ${len(args)+1})")
-        args.append(f"%{search}%")
-        
-    if base:
-        where_clauses.append(f"base = ${len(args)+1}")
-        args.append(base)
-        
-    if programa:
-        where_clauses.append(f"txtprogramainteres ILIKE ${len(args)+1}")
-        args.append(f"%{programa}%")
-        
-    if estado:
-        where_clauses.append(f"ultima_mejor_subcat_string = ${len(args)+1}")
-        args.append(estado)
-        
-    if fecha_inicio:
-        where_clauses.append(f"fecha_a_utilizar >= ${len(args)+1}")
-        args.append(fecha_inicio)
-        
-    if fecha_fin:
-        where_clauses.append(f"fecha_a_utilizar <= ${len(args)+1}")
-        args.append(fecha_fin)
-        
-    if nivel and nivel.upper() != "TODOS":
-        target_nivel = nivel.upper()
-        # Use the programs already classified in the cache to ensure consistency
-        data = await cache.get_all()
-        programs_of_level = [p["programa"] for p in data.get("merged_programs", []) if p.get("nivel") == target_nivel]
-        
-        if programs_of_level:
-            placeholders = ",".join(f"${len(args)+i+1}" for i in range(len(programs_of_level)))
-            where_clauses.append(f"UPPER(TRIM(txtprogramainteres)) IN ({placeholders})")
-            args.extend(programs_of_level)
+    from fastapi import HTTPException
+    from pagination import InvalidCursor, decode_cursor, filter_signature
+    
+    signature = filter_signature({
+        "search": search, "base": base, "programa": programa, "nivel": normalize_filter(nivel),
+        "area": normalize_filter(area), "estado": estado, "fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin,
+    })
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor, signature)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    filters = await _lead_filters(search, base, programa, nivel, estado, fecha_inicio, fecha_fin, area=area)
+    where_sql, args = compile_filters(filters)
+    version = cache.version
+
+    def loader(**position):
+        return lambda: _load_leads_page(where_sql, args, signature, count, version, per_page, **position)
+
+    if cursor is None:
+        key, position = ("page", page), {"page": page}
+    else:
+        key, position = ("cursor", cursor), {"after": after}
+    base_key = (signature, count, per_page)
+    response = await _lead_pages.get_or_load(version, base_key + key, loader(**position))
+
+    if LEADS_PREFETCH and prefetch and response["next_cursor"]:
+        if cursor is None:
+            _prefetch_leads_page(version, base_key + ("page", page + 1), loader(page=page + 1))
         else:
-            # If no programs match this level, force no results
-            where_clauses.append("1=0")
-        
-    where_sql = " AND ".join(where_clauses)
-    
-    count_query = f"SELECT COUNT(*) as total FROM dim_contactos WHERE {where_sql}"
-    total_row = await fetch_one(count_query, *args)
-    total = total_row["total"] if total_row else 0
-    
-    offset = (page - 1) * per_page
-    data_query = f"""
-        SELECT 
-            idinterno, txtnombreapellido, emlmail, teltelefono, 
-            feccreacionoportunidad, txtprogramainteres, base,
-            descrip_subcat, ultima_mejor_subcat_string, cant_toques_call_crm, fecha_a_utilizar
+            next_cursor = response["next_cursor"]
+            _prefetch_leads_page(
+                version, base_key + ("cursor", next_cursor), loader(after=decode_cursor(next_cursor, signature)),
+            )
+    return response
+
+
+async def _load_lead_facets(where_sql: str, args: list) -> dict:
+    """All facet counts plus the total in one scan, with GROUPING SETS."""
+    from database import fetch_all
+
+    grouping = ", ".join(f"GROUPING({expr}) AS g_{name}" for name, expr in _FACETS.items())
+    columns = ", ".join(f"{expr} AS {name}" for name, expr in _FACETS.items())
+    sets = ", ".join(f"({expr})" for expr in _FACETS.values())
+    rows = await fetch_all(
+        f"""
+        SELECT {columns}, {grouping}, COUNT(*) AS leads
         FROM dim_contactos
         WHERE {where_sql}
-        ORDER BY fecha_a_utilizar DESC NULLS LAST
-        LIMIT {per_page} OFFSET {offset}
+        GROUP BY GROUPING SETS ({sets}, ())
+        """,
+        *args,
+    )
+    total = 0
+    facets = {name: [] for name in _FACETS}
+    for r in rows:
+        # GROUPING() is 0 for the column the row is grouped by
+        grouped_by = [name for name in _FACETS if r[f"g_{name}"] == 0]
+        if not grouped_by:
+            total = r["leads"]
+        else:
+            facets[grouped_by[0]].append({"value": r[grouped_by[0]], "count": r["leads"]})
+    for values in facets.values():
+        values.sort(key=lambda v: (-v["count"], v["value"] is None, v["value"] or ""))
+    return {"total": total, "facets": facets}
+
+
+@router.get("/leads/facets")
+async def get_lead_facets(
+    search: Optional[str] = Query(None),
+    base: Optional[str] = Query(None),
+    programa: Optional[str] = Query(None),
+    nivel: Optional[str] = Query(None),
+    area: Optional[str] = Query(None),
+    estado: Optional[str] = Query(None),
+    fecha_inicio: Optional[str] = Query(None),
+    fecha_fin: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    _user: str = Depends(require_auth),
+):
     """
-    
-    rows = await fetch_all(data_query, *args)
-    
+    Lead counts by base, estado and programa for the current filters, computed
+    in a single scan. Active filters also apply to their own facet.
+    """
+    from pagination import filter_signature
+
+    signature = filter_signature({
+        "search": search, "base": base, "programa": programa, "nivel": normalize_filter(nivel),
+        "area": normalize_filter(area), "estado": estado, "fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin,
+    })
+    filters = await _lead_filters(search, base, programa, nivel, estado, fecha_inicio, fecha_fin, area=area)
+    where_sql, args = compile_filters(filters)
+    result = await _lead_facets.get_or_load(cache.version, signature, lambda: _load_lead_facets(where_sql, args))
     return {
-        "data": rows,
-        "total": total,
-        "page": page,
-        "per_page": per_page,
+        "total": result["total"],
+        "facets": {name: values[:limit] for name, values in result["facets"].items()},
+        "truncated": {name: len(values) > limit for name, values in result["facets"].items()},
     }
 
 
+@router.get("/leads/suggest")
+async def suggest_leads(
+    q: str = Query("", max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    _user: str = Depends(require_auth),
+):
+    """
+    Typeahead for the leads search box, answered from the in-memory prefix
+    index. 'ready' is false (and no leads are suggested) until the first lead
+    index build or load after startup finishes.
+    """
+    from suggest_index import lead_suggest
+
+    index = lead_suggest.index
+    return {
+        "query": q,
+        "ready": index is not None,
+        "version": index.version if index is not None else None,
+        **lead_suggest.lookup(q, limit),
+    }
+
+
+@router.get("/catalog")
+async def get_catalog(request: Request, _user: str = Depends(require_auth)):
+    """Distinct bases, estados, subcategorías and programas with lead counts, from the cache."""
+    data = await cache.get_all()
+    catalog = data.get("catalog")
+    if catalog is None:
+        from fastapi import HTTPException
+        raise HTTPException(status_code=503, detail="Catálogo no disponible todavía", headers={"Retry-After": "5"})
+    return _cached_json(request, "catalog", None, None, lambda: {"version": cache.version, **catalog})
+
+
 @router.get("/bases")
-async def get_bases(_user: str = Depends(require_auth)):
-    from database import fetch_all
-    query = "SELECT DISTINCT base FROM dim_contactos WHERE base IS NOT NULL ORDER BY base"
-    rows = await fetch_all(query)
-    return [r["base"] for r in rows]
+async def get_bases(request: Request, _user: str = Depends(require_auth)):
+    data = await cache.get_all()
+    values = get_catalog_values(data, "bases")
+    if values is None:
+        # Snapshot from before the catalog existed (warm start): ask PostgreSQL
+        from database import fetch_all
+        query = "SELECT DISTINCT base FROM dim_contactos WHERE base IS NOT NULL ORDER BY base"
+        rows = await fetch_all(query)
+        return [r["base"] for r in rows]
+    return _cached_json(request, "bases", None, None, lambda: values)
 
 @router.get("/estados-gestion")
-async def get_estados_gestion(_user: str = Depends(require_auth)):
-    from database import fetch_all
-    query = "SELECT DISTINCT ultima_mejor_subcat_string FROM dim_contactos WHERE ultima_mejor_subcat_string IS NOT NULL ORDER BY ultima_mejor_subcat_string"
-    rows = await fetch_all(query)
-    return [r["ultima_mejor_subcat_string"] for r in rows]
+async def get_estados_gestion(request: Request, _user: str = Depends(require_auth)):
+    data = await cache.get_all()
+    values = get_catalog_values(data, "estados")
+    if values is None:
+        from database import fetch_all
+        query = "SELECT DISTINCT ultima_mejor_subcat_string FROM dim_contactos WHERE ultima_mejor_subcat_string IS NOT NULL ORDER BY ultima_mejor_subcat_string"
+        rows = await fetch_all(query)
+        return [r["ultima_mejor_subcat_string"] for r in rows]
+    return _cached_json(request, "estados-gestion", None, None, lambda: values)
 
 @router.get("/meta")
-async def get_meta(_user: str = Depends(require_auth)):
+async def get_meta(request: Request, _user: str = Depends(require_auth)):
     data = await cache.get_all()
-    return {
+    last_refresh = cache.last_refresh
+    # Live cache state (age, refreshing...) changes every second, so it is kept out
+    # of the body: see the X-Cache-* headers and GET /api/status for the full status
+    return _cached_json(request, "meta", None, None, lambda: {
         "fecha_actualizacion": data.get("fecha_actualizacion", ""),
-        "last_refresh": cache.last_refresh.isoformat() if cache.last_refresh else None,
+        "last_refresh": last_refresh.isoformat() if last_refresh else None,
         "total_leads": data.get("total_leads", 0),
+        "version": cache.version,
+    })
+
+@router.get("/db-stats")
+async def get_db_stats(limit: int = Query(50, ge=1, le=500), _user: str = Depends(require_auth)):
+    """Pool usage per workload, per-query-shape timings and the slow-query log."""
+    from database import pool_status
+    from query_stats import query_stats
+    from program_dimension import dimension_status
+    from suggest_index import lead_suggest
+    return {
+        "pools": pool_status(),
+        "leads_count_cache": _lead_counts.status(),
+        "leads_page_cache": _lead_pages.status(),
+        "leads_facets_cache": _lead_facets.status(),
+        "suggest_index": lead_suggest.status(),
+        "program_dimension": dimension_status(),
+        **query_stats.snapshot(limit),
     }
 
+@router.post("/db-stats/reset")
+async def reset_db_stats(_user: str = Depends(require_auth)):
+    """Clear the per-query-shape timings and the slow-query log."""
+    from query_stats import query_stats
+    query_stats.reset()
+    return {"status": "success"}
+
+@router.get("/indexes")
+async def get_indexes(_user: str = Depends(require_auth)):
+    """Which of the indexes the lead queries rely on exist (create them with `python indexes.py --create`)."""
+    from indexes import check_indexes, check_keyset_plan
+    report = await check_indexes()
+    # Whether deep /leads pages seek the sort index (Index Cond) or filter a scan from the top
+    report["keyset_seek"] = await check_keyset_plan()
+    return report
+
+@router.get("/history")
+async def get_history(
+    desde: Optional[str] = Query(None),
+    hasta: Optional[str] = Query(None),
+    programa: Optional[str] = Query(None),
+    _user: str = Depends(require_auth),
+):
+    """KPI series from the snapshot history (default: last 30 days)."""
+    from fastapi import HTTPException
+
+    history = cache.history
+    if history is None:
+        raise HTTPException(status_code=404, detail="El historial está deshabilitado (HISTORY_ENABLED=0)")
+    try:
+        end = datetime.fromisoformat(hasta) if hasta else datetime.now(timezone.utc)
+        start = datetime.fromisoformat(desde) if desde else end - timedelta(days=30)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fechas inválidas, usar formato ISO (YYYY-MM-DD)")
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        # A bare date means the whole day
+        end = end.replace(tzinfo=timezone.utc)
+        if len(hasta or "") == 10:
+            end += timedelta(days=1) - timedelta(microseconds=1)
+
+    series = await asyncio.to_thread(history.kpi_series, start, end, programa)
+    return {"desde": start.isoformat(), "hasta": end.isoformat(), "programa": programa, "series": series}
+
+
 @router.post("/refresh")
 async def manual_refresh(_user: str = Depends(require_auth)):
+    from fastapi.responses import JSONResponse
+    version = cache.version
     await cache.refresh()
-    return {"status": "success", "last_refresh": cache.last_refresh.isoformat()}
+    last_refresh = cache.last_refresh.isoformat() if cache.last_refresh else None
+    if cache.version != version:
+        return {"status": "success", "last_refresh": last_refresh}
+    if cache.role == "follower":
+        # Requested from the leader, whose snapshot didn't arrive in time; it will be picked up
+        return JSONResponse(status_code=202, content={"status": "pending", "last_refresh": last_refresh})
+    return JSONResponse(
+        status_code=503, content={"status": "error", "detail": cache.last_error, "last_refresh": last_refresh},
+    )
@@ -7,42 +7,124 @@ dotenv_path = os.path.join(backend_dir, ".env")
 load_dotenv(dotenv_path)
 
 import asyncio
+import asyncpg
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from database import close_pool
+from fastapi.responses import JSONResponse
+from database import PoolSaturated, close_pool
 from cache import cache
-from routes.auth import router as auth_router
+from listener import create_listener
+from shared_snapshot import create_shared_store
+from routes.auth import require_auth, router as auth_router
 from routes.dashboard import router as dashboard_router
 from routes.ai import router as ai_router
 
 
+listener = create_listener(cache)
+shared = create_shared_store()
+cache.shared = shared
+background_tasks: list[asyncio.Task] = []
+
+
 async def periodic_refresh():
-    """Background task: refresh cache every hour."""
+    """
+    Background task: every hour, refresh the cache if the source tables changed.
+    Fallback for when ETL notifications are missed or the listener is disabled.
+    """
     while True:
+        await asyncio.sleep(3600)
         try:
-            await cache.refresh()
+            await cache.revalidate()
         except Exception as e:
             print(f"[Periodic Refresh Error] {e}")
-        await asyncio.sleep(3600)
+
+
+async def ensure_indexes():
+    """Opt-in (DB_ENSURE_INDEXES=1): build missing lead search indexes in the background."""
+    from indexes import ensure_indexes as build
+    try:
+        report = await build()
+        print(f"[Indexes] Missing after ensure: {report['missing'] or 'none'}")
+    except Exception as e:
+        print(f"[Indexes] Ensure failed: {e}")
+
+
+def start_refresh_tasks():
+    """Database-facing refresh machinery; runs in the standalone process or the leader only."""
+    background_tasks.append(asyncio.create_task(periodic_refresh()))
+    if os.getenv("DB_ENSURE_INDEXES", "0") == "1":
+        background_tasks.append(asyncio.create_task(ensure_indexes()))
+    if listener:
+        listener.start()
+
+
+async def initial_refresh():
+    """After a warm start: replace the persisted snapshot without holding up startup."""
+    try:
+        await cache.revalidate()
+        print("[Startup] Background refresh finished")
+    except Exception as e:
+        print(f"[Startup] Background refresh failed (serving the persisted snapshot): {e}")
+
+
+async def coordinate_workers():
+    """
+    Multi-worker mode: followers pick up the leader's snapshots and take over
+    if the leader exits; the leader serves refresh requests from followers.
+    """
+    while True:
+        await asyncio.sleep(shared.poll_interval)
+        try:
+            if shared.is_leader:
+                # Requests that arrive while the database is failing wait for the retry backoff
+                if not cache.in_backoff and shared.take_refresh_request():
+                    await cache.refresh()
+                continue
+            # Sync first so a promoted leader starts from the latest published version
+            await cache.revalidate()
+            if shared.try_acquire_leadership():
+                print("[Shared] Leader exited, this worker takes over refreshes")
+                start_refresh_tasks()
+        except Exception as e:
+            print(f"[Shared] Coordination error: {e}")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: initial cache load + start background refresh
-    print("[Startup] Loading initial cache...")
-    try:
-        await cache.refresh()
-        print("[Startup] Cache loaded successfully")
-    except Exception as e:
-        print(f"[Startup] Cache load failed (server will still start): {e}")
+    is_leader = shared is None or shared.try_acquire_leadership()
+    if is_leader and cache.load_warm_start():
+        # Serve the last-good snapshot right away; PostgreSQL is queried in the background
+        print(f"[Startup] Serving persisted snapshot v{cache.version} ({cache.role}), refreshing in background")
+        background_tasks.append(asyncio.create_task(initial_refresh()))
+    else:
+        print(f"[Startup] Loading initial cache ({cache.role})...")
+        try:
+            # Leader/standalone: also records the first table watermarks for the hourly change probe.
+            # Follower: maps the snapshot the leader published.
+            await cache.revalidate()
+            print("[Startup] Cache loaded successfully")
+        except Exception as e:
+            print(f"[Startup] Cache load failed (server will still start): {e}")
+        if not cache.data and cache.role == "follower" and cache.load_warm_start():
+            # The leader hasn't published yet: serve the persisted snapshot until it does
+            print(f"[Startup] Serving persisted snapshot v{cache.version} until the leader publishes")
 
-    refresh_task = asyncio.create_task(periodic_refresh())
+    if is_leader:
+        start_refresh_tasks()
+    if shared:
+        background_tasks.append(asyncio.create_task(coordinate_workers()))
 
     yield
 
     # Shutdown
-    refresh_task.cancel()
+    for task in background_tasks:
+        task.cancel()
+    if listener:
+        await listener.stop()
+    if shared:
+        shared.release_leadership()
     await close_pool()
     print("[Shutdown] Database pool closed")
 
@@ -62,6 +144,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated):
+    # Shed load quickly instead of queueing behind a busy workload
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Servidor ocupado, reintente en unos segundos", "workload": exc.workload},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(asyncpg.exceptions.UndefinedTableError)
+async def undefined_table_handler(request: Request, exc: asyncpg.exceptions.UndefinedTableError):
+    # Likely dim_programa_nivel was dropped: stop routing filters through it until re-checked
+    from program_dimension import invalidate_dimension
+    invalidate_dimension(exc)
+    print(f"[Dimension] Query on a missing table, falling back: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Datos temporalmente no disponibles, reintente en unos segundos"},
+        headers={"Retry-After": "1"},
+    )
+
+
 app.include_router(auth_router)
 app.include_router(dashboard_router)
 app.include_router(ai_router)
@@ -77,6 +183,15 @@ async def root():
     }
 
 
+@app.get("/api/status")
+async def status(_user: str = Depends(require_auth)):
+    """Cache and listener internals (errors, watermarks); authenticated, unlike the liveness check."""
+    return {
+        "cache": cache.status(),
+        "listener": listener.status() if listener else None,
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=True)
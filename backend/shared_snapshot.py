@@ -0,0 +1,218 @@
+"""
+Cross-process snapshot sharing for multi-worker deployments.
+
+With several uvicorn workers, one of them is elected leader through an
+exclusive file lock. Only the leader queries PostgreSQL; every snapshot it
+builds is written to a single file (ideally on /dev/shm) that the other
+workers memory-map. The program metric columns are read zero-copy straight
+from the mapping with np.frombuffer; the small scalar/list part of the
+snapshot is JSON. Followers notice new snapshots through the version number
+in the file header, and take over the lock if the leader exits.
+
+Enable by pointing every worker at the same path:
+
+    SHARED_SNAPSHOT_PATH=/dev/shm/unab_snapshot.bin uvicorn server:app --workers 4
+
+File layout (little endian):
+    header   magic, version, meta length, row count, metric count, built_at (epoch)
+    meta     JSON: snapshot fields except the program table, plus program
+             names and nivel/area categories
+    arrays   8-byte aligned: metrics int64 (column-major), toques_prom float64,
+             nivel codes int16, area codes int16
+"""
+import json
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+from typing import Mapping
+import numpy as np
+from programs_table import METRIC_FIELDS, ProgramTable
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, shared mode is unavailable
+    fcntl = None
+
+_MAGIC = b"UNABSNP1"
+_HEADER = struct.Struct("<8sQQQQd")
+
+# Snapshot fields that are derived locally and never written
+_DERIVED_FIELDS = {"programs", "rollups"}
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _array_layout(meta_len: int, n_rows: int, n_metrics: int) -> dict:
+    """Byte offsets of each array section, shared by writer and reader."""
+    offset = _align(_HEADER.size + meta_len)
+    layout = {"values": offset}
+    offset = _align(offset + n_rows * n_metrics * 8)
+    layout["toques_prom"] = offset
+    offset = _align(offset + n_rows * 8)
+    layout["nivel_codes"] = offset
+    offset = _align(offset + n_rows * 2)
+    layout["area_codes"] = offset
+    layout["end"] = _align(offset + n_rows * 2)
+    return layout
+
+
+def write_snapshot(path: str, data: Mapping, version: int, built_at: datetime):
+    """Serialize a snapshot to `path` atomically (write temp file, then rename)."""
+    programs: ProgramTable = data["programs"]
+    meta = {k: v for k, v in data.items() if k not in _DERIVED_FIELDS}
+    meta["__programs__"] = {
+        "programa": programs.names(),
+        "nivel_categories": programs.nivel_categories,
+        "area_categories": programs.area_categories,
+    }
+    meta_bytes = json.dumps(meta, separators=(",", ":"), default=str).encode("utf-8")
+    n_rows, n_metrics = len(programs), len(METRIC_FIELDS)
+    layout = _array_layout(len(meta_bytes), n_rows, n_metrics)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, version, len(meta_bytes), n_rows, n_metrics, built_at.timestamp()))
+        f.write(meta_bytes)
+        # Columns stored one after another: the transpose of a column-major matrix is C-contiguous
+        for name, arr in (
+            ("values", np.ascontiguousarray(programs.values.T, dtype="<i8")),
+            ("toques_prom", programs.toques_prom.astype("<f8")),
+            ("nivel_codes", programs.nivel_codes.astype("<i2")),
+            ("area_codes", programs.area_codes.astype("<i2")),
+        ):
+            f.seek(layout[name])
+            f.write(arr.tobytes())
+        f.truncate(layout["end"])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_version(path: str) -> int:
+    """Version in the file header, or 0 if there is no valid snapshot yet."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+    except FileNotFoundError:
+        return 0
+    if len(header) < _HEADER.size:
+        return 0
+    magic, version, *_ = _HEADER.unpack(header)
+    return version if magic == _MAGIC else 0
+
+
+def load_snapshot(path: str) -> tuple[dict, int, datetime] | None:
+    """
+    Map the snapshot file and rebuild its data dict. Metric arrays are views
+    into the mapping, which stays alive as long as they are referenced.
+    """
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None  # Missing or empty file
+    magic, version, meta_len, n_rows, n_metrics, built_ts = _HEADER.unpack_from(mm, 0)
+    if magic != _MAGIC or n_metrics != len(METRIC_FIELDS):
+        mm.close()
+        return None
+    data = json.loads(mm[_HEADER.size:_HEADER.size + meta_len])
+    program_meta = data.pop("__programs__")
+    layout = _array_layout(meta_len, n_rows, n_metrics)
+
+    values = np.frombuffer(mm, dtype="<i8", count=n_rows * n_metrics, offset=layout["values"])
+    data["programs"] = ProgramTable(
+        programa=np.array(program_meta["programa"], dtype=object),
+        nivel_codes=np.frombuffer(mm, dtype="<i2", count=n_rows, offset=layout["nivel_codes"]),
+        nivel_categories=program_meta["nivel_categories"],
+        area_codes=np.frombuffer(mm, dtype="<i2", count=n_rows, offset=layout["area_codes"]),
+        area_categories=program_meta["area_categories"],
+        values=values.reshape(n_metrics, n_rows).T,  # Column-major view, no copy
+        toques_prom=np.frombuffer(mm, dtype="<f8", count=n_rows, offset=layout["toques_prom"]),
+    )
+    return data, version, datetime.fromtimestamp(built_ts, timezone.utc)
+
+
+class SharedSnapshotStore:
+    """Leader election plus publish/load of the shared snapshot file."""
+
+    def __init__(self, path: str, poll_interval: float = 2.0, wait_timeout: float = 15.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        # How long a follower waits for the leader's next snapshot (refresh requests, empty cache)
+        self.wait_timeout = wait_timeout
+        self.lock_path = f"{path}.lock"
+        self.refresh_request_path = f"{path}.refresh"
+        # Leads typeahead index, built by the leader (see suggest_index)
+        self.suggest_index_path = f"{path}.suggest"
+        self._lock_fd: int | None = None
+        self._handled_request: float = 0.0
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_fd is not None
+
+    def try_acquire_leadership(self) -> bool:
+        """Non-blocking flock; the lock is released by the OS if the leader dies."""
+        if self.is_leader:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        # Requests made before we took over were meant for the previous leader's last refresh
+        try:
+            self._handled_request = os.stat(self.refresh_request_path).st_mtime
+        except FileNotFoundError:
+            pass
+        return True
+
+    def release_leadership(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def publish(self, data: Mapping, version: int, built_at: datetime):
+        write_snapshot(self.path, data, version, built_at)
+
+    def current_version(self) -> int:
+        return read_version(self.path)
+
+    def load(self):
+        return load_snapshot(self.path)
+
+    def request_refresh(self):
+        """Followers ask the leader for a forced refresh by touching a marker file."""
+        with open(self.refresh_request_path, "a"):
+            pass
+        os.utime(self.refresh_request_path)
+
+    def take_refresh_request(self) -> bool:
+        """Leader side: True once per new refresh request."""
+        try:
+            mtime = os.stat(self.refresh_request_path).st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime <= self._handled_request:
+            return False
+        self._handled_request = mtime
+        return True
+
+
+def create_shared_store() -> SharedSnapshotStore | None:
+    path = os.getenv("SHARED_SNAPSHOT_PATH")
+    if not path:
+        return None
+    if fcntl is None:
+        print("[Shared] SHARED_SNAPSHOT_PATH ignored: file locking is not available on this platform")
+        return None
+    return SharedSnapshotStore(
+        path,
+        poll_interval=float(os.getenv("SHARED_SNAPSHOT_POLL", "2")),
+        wait_timeout=float(os.getenv("SHARED_SNAPSHOT_WAIT", "15")),
+    )
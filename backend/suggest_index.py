@@ -0,0 +1,433 @@
+"""
+In-memory prefix index behind the leads search typeahead (/leads/suggest).
+
+Normalized lead names (the full name and each word), emails and phone digits
+are kept as one sorted run of UTF-8 keys, each tagged with its kind in the
+first byte. A lookup is a bisect to the first key carrying the prefix plus a
+short forward scan, so typing never reaches PostgreSQL. Program names get a
+small separate index, rebuilt from every snapshot's program table.
+
+The lead index is flat arrays only: the keys are one byte blob plus int64
+offsets, each key points at a lead row (int32), and the display fields of a
+lead are one JSON record in a second blob, decoded only for the results
+returned. It is rebuilt after a refresh only if dim_contactos changed (its
+pg_stat_user_tables watermark, see cache.probe_watermarks): the table is
+streamed through a server-side cursor, tokenized batch by batch off the event
+loop, and the finished index replaces the previous one in a single swap.
+
+With a shared snapshot only the leader builds: it writes the index next to
+the snapshot file (SharedSnapshotStore.suggest_index_path) and followers
+memory-map it when its version changes, so every worker reads the same pages.
+
+File layout (little endian):
+    header   magic, version, meta length, key count, lead count, key blob
+             size, lead blob size, built_at (epoch)
+    meta     JSON: dim_contactos watermark
+    arrays   8-byte aligned: key offsets int64, lead offsets int64, key refs
+             int32, key blob, lead blob
+"""
+import asyncio
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+import time
+import unicodedata
+from datetime import datetime, timezone
+import numpy as np
+from database import REFRESH, stream
+
+# Key kinds (first character of every key)
+NAME, EMAIL, PHONE, PROGRAM = "n", "e", "t", "p"
+FIELDS = {NAME: "nombre", EMAIL: "email", PHONE: "telefono"}
+
+MIN_QUERY_LENGTH = 2
+MIN_PHONE_DIGITS = 3
+# Phone numbers are also indexed by their last digits, so "11 2345" finds "+54 11 2345 ..."
+NATIONAL_DIGITS = 10
+# Matching keys examined per lookup
+SCAN_LIMIT = 500
+
+LEAD_COLUMNS = ("idinterno", "txtnombreapellido", "emlmail", "teltelefono", "txtprogramainteres")
+LEADS_QUERY = f"SELECT {', '.join(LEAD_COLUMNS)} FROM dim_contactos"
+
+_MAGIC = b"UNABSUG2"
+_HEADER = struct.Struct("<8sQQQQQQd")
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+_NON_DIGIT = re.compile(r"\D")
+_PHONE_LIKE = re.compile(r"^[\d\s+\-().]+$")
+
+
+def normalize_text(value) -> str:
+    """Lowercase, accents stripped, anything but letters/digits collapsed to single spaces."""
+    if not value:
+        return ""
+    text = unicodedata.normalize("NFKD", str(value))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def _word_keys(kind: str, text: str) -> set[str]:
+    """Keys for the full normalized text and for each of its words."""
+    normalized = normalize_text(text)
+    if not normalized:
+        return set()
+    return {kind + normalized} | {kind + word for word in normalized.split() if len(word) >= MIN_QUERY_LENGTH}
+
+
+def _lead_keys(name, email, phone) -> set[str]:
+    keys = _word_keys(NAME, name)
+    if email:
+        keys.add(EMAIL + str(email).strip().lower())
+    digits = _NON_DIGIT.sub("", str(phone or ""))
+    if len(digits) >= MIN_PHONE_DIGITS:
+        keys.add(PHONE + digits)
+        if len(digits) > NATIONAL_DIGITS:
+            keys.add(PHONE + digits[-NATIONAL_DIGITS:])
+    return keys
+
+
+def _query_lookups(query: str) -> list[tuple[str, str]]:
+    """(kind, prefix) pairs to scan for a search box input."""
+    term = (query or "").strip()
+    digits = _NON_DIGIT.sub("", term)
+    if _PHONE_LIKE.match(term) and len(digits) >= MIN_PHONE_DIGITS:
+        return [(PHONE, digits)]
+    if "@" in term:
+        return [(EMAIL, term.lower())]
+    text = normalize_text(term)
+    return [(NAME, text), (EMAIL, term.lower()), (PROGRAM, text)] if len(text) >= MIN_QUERY_LENGTH else []
+
+
+def _scan(keys, refs, needle: bytes):
+    """(key, ref) pairs whose key starts with `needle`, in key order."""
+    start = bisect.bisect_left(keys, needle)
+    for i in range(start, min(start + SCAN_LIMIT, len(keys))):
+        key = keys[i]
+        if not key.startswith(needle):
+            break
+        yield key, int(refs[i])
+
+
+class _BlobView:
+    """Sequence of the byte strings packed in `blob` between consecutive `offsets`."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+
+class SuggestIndex:
+    """Immutable lead index: sorted keys with their lead rows, plus each lead's display record."""
+
+    def __init__(self, key_blob: np.ndarray, key_offsets: np.ndarray, refs: np.ndarray,
+                 lead_blob: np.ndarray, lead_offsets: np.ndarray,
+                 version: int, watermark, built_at: datetime):
+        self.keys = _BlobView(key_blob, key_offsets)
+        # Lead row of each key
+        self.refs = refs
+        self.leads = _BlobView(lead_blob, lead_offsets)
+        self.version = version
+        # dim_contactos watermark the index was built at; None if unknown
+        self.watermark = watermark
+        self.built_at = built_at
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def lead_count(self) -> int:
+        return len(self.leads)
+
+    def lookup(self, query: str, limit: int = 10) -> list[dict]:
+        """Top `limit` matching leads, exact matches first."""
+        leads = {}
+        for kind, prefix in _query_lookups(query):
+            if kind not in FIELDS:
+                continue
+            needle = (kind + prefix).encode("utf-8")
+            for key, ref in _scan(self.keys, self.refs, needle):
+                if ref not in leads:
+                    # Rank: exact key match first, then key order
+                    leads[ref] = (key != needle, len(leads), FIELDS[kind])
+        rows = sorted(leads.items(), key=lambda item: item[1][:2])[:limit]
+        return [
+            {**dict(zip(LEAD_COLUMNS, json.loads(self.leads[ref]))), "match": field}
+            for ref, (_, _, field) in rows
+        ]
+
+
+class ProgramSuggest:
+    """Program name keys of one snapshot; small, so each worker builds its own."""
+
+    def __init__(self, counts: list[tuple[str, int]], version: int = 0):
+        pairs = sorted(
+            (key.encode("utf-8"), i) for i, (name, _) in enumerate(counts) for key in _word_keys(PROGRAM, name)
+        )
+        self.keys = [key for key, _ in pairs]
+        self.refs = [i for _, i in pairs]
+        self.counts = counts
+        self.version = version
+
+    def lookup(self, query: str, limit: int = 10) -> list[dict]:
+        """Top `limit` matching programs by lead count."""
+        found = set()
+        for kind, prefix in _query_lookups(query):
+            if kind == PROGRAM:
+                found.update(ref for _, ref in _scan(self.keys, self.refs, (kind + prefix).encode("utf-8")))
+        rows = sorted((self.counts[i] for i in found), key=lambda p: (-p[1], p[0]))[:limit]
+        return [{"programa": name, "leads": count} for name, count in rows]
+
+
+class _IndexBuilder:
+    """Accumulates cursor batches; the Python lists only live while a build runs."""
+
+    def __init__(self):
+        self.keys: list[bytes] = []
+        self.refs: list[int] = []
+        self.records = bytearray()
+        self.record_ends: list[int] = []
+
+    def add_batch(self, batch: dict):
+        """Tokenize one column batch from the cursor."""
+        offset = len(self.record_ends)
+        for i, row in enumerate(zip(*(batch[name] for name in LEAD_COLUMNS))):
+            self.records += json.dumps(row, separators=(",", ":"), default=str).encode("utf-8")
+            self.record_ends.append(len(self.records))
+            for key in _lead_keys(row[1], row[2], row[3]):
+                self.keys.append(key.encode("utf-8"))
+                self.refs.append(offset + i)
+
+    def finish(self, version: int, watermark) -> SuggestIndex:
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        sorted_keys = [self.keys[i] for i in order]
+        key_offsets = np.zeros(len(sorted_keys) + 1, dtype=np.int64)
+        np.cumsum([len(key) for key in sorted_keys], out=key_offsets[1:])
+        lead_offsets = np.zeros(len(self.record_ends) + 1, dtype=np.int64)
+        lead_offsets[1:] = self.record_ends
+        return SuggestIndex(
+            np.frombuffer(b"".join(sorted_keys), dtype=np.uint8), key_offsets,
+            np.array(self.refs, dtype=np.int32)[order],
+            np.frombuffer(bytes(self.records), dtype=np.uint8), lead_offsets,
+            version, watermark, datetime.now(timezone.utc),
+        )
+
+
+async def build_suggest_index(version: int, watermark=None, batch_size: int = 20000) -> SuggestIndex:
+    builder = _IndexBuilder()
+    async for batch in stream(LEADS_QUERY, batch_size=batch_size, columns=True, workload=REFRESH):
+        await asyncio.to_thread(builder.add_batch, batch)
+    return await asyncio.to_thread(builder.finish, version, watermark)
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _layout(meta_len: int, n_keys: int, n_leads: int, key_bytes: int, lead_bytes: int) -> dict:
+    """Byte offsets of each array section, shared by writer and reader."""
+    layout = {"key_offsets": _align(_HEADER.size + meta_len)}
+    layout["lead_offsets"] = _align(layout["key_offsets"] + (n_keys + 1) * 8)
+    layout["refs"] = _align(layout["lead_offsets"] + (n_leads + 1) * 8)
+    layout["key_blob"] = _align(layout["refs"] + n_keys * 4)
+    layout["lead_blob"] = _align(layout["key_blob"] + key_bytes)
+    layout["end"] = _align(layout["lead_blob"] + lead_bytes)
+    return layout
+
+
+def write_index(path: str, index: SuggestIndex):
+    """Serialize an index to `path` atomically (write temp file, then rename)."""
+    meta_bytes = json.dumps({"watermark": index.watermark}, separators=(",", ":"), default=str).encode("utf-8")
+    keys, leads = index.keys, index.leads
+    sizes = (len(keys), len(leads), len(keys.blob), len(leads.blob))
+    layout = _layout(len(meta_bytes), *sizes)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, index.version, len(meta_bytes), *sizes, index.built_at.timestamp()))
+        f.write(meta_bytes)
+        for name, arr in (
+            ("key_offsets", keys.offsets.astype("<i8")),
+            ("lead_offsets", leads.offsets.astype("<i8")),
+            ("refs", index.refs.astype("<i4")),
+            ("key_blob", keys.blob),
+            ("lead_blob", leads.blob),
+        ):
+            f.seek(layout[name])
+            f.write(arr.tobytes())
+        f.truncate(layout["end"])
+    os.replace(tmp_path, path)
+
+
+def read_index_version(path: str) -> int:
+    """Version in the file header, or 0 if there is no valid index file."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+    except FileNotFoundError:
+        return 0
+    if len(header) < _HEADER.size:
+        return 0
+    magic, version, *_ = _HEADER.unpack(header)
+    return version if magic == _MAGIC else 0
+
+
+def load_index(path: str) -> SuggestIndex | None:
+    """Map an index file; its arrays are views into the mapping, shared with the other workers."""
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None  # Missing or empty file
+    if len(mm) < _HEADER.size:
+        mm.close()
+        return None
+    magic, version, meta_len, n_keys, n_leads, key_bytes, lead_bytes, built_ts = _HEADER.unpack_from(mm, 0)
+    if magic != _MAGIC:
+        mm.close()
+        return None
+    meta = json.loads(mm[_HEADER.size:_HEADER.size + meta_len])
+    layout = _layout(meta_len, n_keys, n_leads, key_bytes, lead_bytes)
+    return SuggestIndex(
+        np.frombuffer(mm, dtype=np.uint8, count=key_bytes, offset=layout["key_blob"]),
+        np.frombuffer(mm, dtype="<i8", count=n_keys + 1, offset=layout["key_offsets"]),
+        np.frombuffer(mm, dtype="<i4", count=n_keys, offset=layout["refs"]),
+        np.frombuffer(mm, dtype=np.uint8, count=lead_bytes, offset=layout["lead_blob"]),
+        np.frombuffer(mm, dtype="<i8", count=n_leads + 1, offset=layout["lead_offsets"]),
+        version, meta["watermark"], datetime.fromtimestamp(built_ts, timezone.utc),
+    )
+
+
+class LeadSuggester:
+    """Holds the current indexes and rebuilds the lead index in the background, one build at a time."""
+
+    def __init__(self, enabled: bool = True, batch_size: int = 20000):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.index: SuggestIndex | None = None
+        self.programs = ProgramSuggest([])
+        self._task: asyncio.Task | None = None
+        # Newest (version, watermark, publish path) waiting for a build
+        self._pending: tuple | None = None
+        self.skipped = 0
+        self.last_error: str | None = None
+        self.last_build_seconds: float | None = None
+
+    @property
+    def is_building(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def set_programs(self, programs, version: int):
+        """Program keys for this snapshot's program table."""
+        if not self.enabled or self.programs.version == version:
+            return
+        self.programs = ProgramSuggest(list(zip(programs.names(), programs.column("leads").tolist())), version)
+
+    def _is_current(self, watermark) -> bool:
+        return watermark is not None and self.index is not None and self.index.watermark == watermark
+
+    def rebuild(self, version: int, programs, watermark=None, publish_path: str | None = None):
+        """
+        Refresh the indexes for this snapshot. The lead index is rebuilt only
+        if dim_contactos changed since it was built (`watermark`, None when
+        unknown); a build already running picks the newest request up when
+        done. With `publish_path` the finished index is also written there for
+        followers.
+        """
+        if not self.enabled:
+            return
+        self.set_programs(programs, version)
+        if self._is_current(watermark):
+            self.skipped += 1
+            return
+        self._pending = (version, watermark, publish_path)
+        if not self.is_building:
+            self._task = asyncio.create_task(self._run())
+
+    def load_shared(self, path: str):
+        """Follower side: map the leader's index if its version changed."""
+        if not self.enabled or self.is_building:
+            return
+        version = read_index_version(path)
+        if version == 0 or (self.index is not None and self.index.version == version):
+            return
+        self._load(path)
+
+    def _load(self, path: str):
+        try:
+            index = load_index(path)
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"[Suggest] Could not load shared index: {e}")
+            return
+        if index is not None:
+            self.index = index
+            self.last_error = None
+            print(f"[Suggest] Loaded shared index v{index.version}")
+
+    async def _run(self):
+        while self._pending is not None:
+            version, watermark, publish_path = self._pending
+            self._pending = None
+            if publish_path and self.index is None and watermark is not None:
+                # Restarted leader: the published index may still match dim_contactos
+                self._load(publish_path)
+            if self._is_current(watermark):
+                self.skipped += 1
+                continue
+            started = time.perf_counter()
+            try:
+                index = await build_suggest_index(version, watermark, self.batch_size)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[Suggest] Index build failed: {e}")
+                continue
+            self.index = index
+            self.last_error = None
+            self.last_build_seconds = time.perf_counter() - started
+            print(f"[Suggest] Indexed {index.lead_count} leads, {len(index)} keys "
+                  f"in {self.last_build_seconds:.1f}s (v{version})")
+            if publish_path:
+                try:
+                    await asyncio.to_thread(write_index, publish_path, index)
+                except Exception as e:
+                    print(f"[Suggest] Could not publish index: {e}")
+
+    def lookup(self, query: str, limit: int = 10) -> dict:
+        """Matching programs (by lead count) and leads (exact matches first), top `limit` of each."""
+        index = self.index
+        return {
+            "programas": self.programs.lookup(query, limit),
+            "leads": index.lookup(query, limit) if index is not None else [],
+        }
+
+    def status(self) -> dict:
+        index = self.index
+        return {
+            "enabled": self.enabled,
+            "ready": index is not None,
+            "building": self.is_building,
+            "version": index.version if index else None,
+            "built_at": index.built_at.isoformat() if index else None,
+            "leads": index.lead_count if index else 0,
+            "keys": len(index) if index else 0,
+            "programs": len(self.programs.counts),
+            "skipped_unchanged": self.skipped,
+            "last_build_seconds": self.last_build_seconds,
+            "last_error": self.last_error,
+        }
+
+
+# Global singleton
+lead_suggest = LeadSuggester(
+    enabled=os.getenv("SUGGEST_INDEX", "1") != "0",
+    batch_size=int(os.getenv("SUGGEST_BATCH_SIZE", "20000")),
+)
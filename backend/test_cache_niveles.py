@@ -1,10 +1,10 @@
 import asyncio
-from cache import cache
+from cache import cache, get_programs
 
 async def main():
     await cache.refresh()
     data = await cache.get_all()
-    ps = data.get("merged_programs", [])
+    ps = get_programs(data)
     levels = set(p.get("nivel") for p in ps)
     print("Levels found:", levels)
     print("Leads by level:")
@@ -0,0 +1,42 @@
+"""Offline tests for the export responses' cleanup: python -m pytest test_export_stream.py"""
+import asyncio
+from routes.dashboard import _ClosingStreamingResponse
+
+
+def test_source_is_closed_when_client_leaves_before_the_body():
+    state = {"pulled": 0, "closed": False}
+
+    async def source():
+        try:
+            while True:
+                state["pulled"] += 1
+                yield b"x"
+        finally:
+            state["closed"] = True
+
+    async def main():
+        batches = source()
+        # The route pulls the first batch before returning the response
+        first = await batches.__anext__()
+
+        async def generate():
+            yield first
+            async for chunk in batches:
+                yield chunk
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            # Client already gone
+            raise OSError("connection reset")
+
+        response = _ClosingStreamingResponse(generate(), batches)
+        try:
+            await response({"type": "http"}, receive, send)
+        except Exception:
+            pass
+        # Checked inside the loop: asyncio.run() would close leftover generators on exit
+        assert state == {"pulled": 1, "closed": True}
+
+    asyncio.run(main())
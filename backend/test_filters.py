@@ -0,0 +1,62 @@
+"""Offline tests for the lead filter compiler (no database needed): python -m pytest test_filters.py"""
+from filters import NO_UTIL_SQL, LeadFilters, compile_filters
+from indexes import classify_search
+
+
+def test_no_filters():
+    assert compile_filters(LeadFilters()) == ("1=1", [])
+
+
+def test_clause_order_and_placeholders():
+    where, args = compile_filters(LeadFilters(
+        search="ana", base="B1", programa="med", estado="E", fecha_inicio="2025-01-01", fecha_fin="2025-02-01",
+    ))
+    assert where == (
+        "(txtnombreapellido ILIKE $1 OR emlmail ILIKE $1 OR teltelefono ILIKE $1)"
+        " AND base = $2 AND txtprogramainteres ILIKE $3 AND ultima_mejor_subcat_string = $4"
+        " AND fecha_a_utilizar >= $5 AND fecha_a_utilizar <= $6"
+    )
+    assert args == ["%ana%", "B1", "%med%", "E", "2025-01-01", "2025-02-01"]
+
+
+def test_first_param_offset():
+    where, args = compile_filters(LeadFilters(base="B1", estado="E"), first_param=4)
+    assert where == "base = $4 AND ultima_mejor_subcat_string = $5"
+    assert args == ["B1", "E"]
+
+
+def test_shape_does_not_depend_on_values():
+    assert compile_filters(LeadFilters(base="A"))[0] == compile_filters(LeadFilters(base="Z"))[0]
+
+
+def test_nivel_area_use_the_dimension_table():
+    where, args = compile_filters(LeadFilters(nivel="GRADO", area="SALUD", no_util=True))
+    assert where.startswith(NO_UTIL_SQL + " AND ")
+    assert "dim_programa_nivel WHERE nivel = $1 AND area = $2" in where
+    assert args == ["GRADO", "SALUD"]
+    where, args = compile_filters(LeadFilters(area="SALUD"))
+    assert "dim_programa_nivel WHERE area = $1" in where and args == ["SALUD"]
+
+
+def test_program_list_fallback_is_one_array_parameter():
+    where, args = compile_filters(LeadFilters(base="B", programs=("P1", "P2", "P3")))
+    assert where == "base = $1 AND UPPER(TRIM(txtprogramainteres)) = ANY($2::text[])"
+    assert args == ["B", ["P1", "P2", "P3"]]
+    # A nivel without programs matches nothing
+    assert compile_filters(LeadFilters(programs=()))== ("1=0", [])
+
+
+def test_search_kinds():
+    assert classify_search(" Ana_B ") == ("text", ["%Ana\\_B%"])
+    assert classify_search("juan@mail.com") == ("email", ["%juan@mail.com%"])
+    # Digit terms keep the name/email match and also match phone digits
+    assert classify_search("+54 (11) 1234") == ("phone", ["%+54 (11) 1234%", "%54111234%"])
+    assert classify_search("2024")[0] == "phone"
+    assert classify_search("123")[0] == "text"
+
+
+def test_phone_search_takes_two_placeholders():
+    where, args = compile_filters(LeadFilters(search="2024", base="B"))
+    assert "teltelefono ILIKE $1" in where
+    assert "LIKE $2) AND base = $3" in where
+    assert args == ["%2024%", "%2024%", "B"]
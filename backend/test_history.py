@@ -0,0 +1,31 @@
+"""Offline tests for the on-disk snapshot history: python -m pytest test_history.py"""
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from history import SnapshotHistory
+
+
+def _data(total: int) -> dict:
+    return {"total_leads": total, "totals": {}, "no_util": []}
+
+
+def test_downsampled_day_is_read_once(tmp_path):
+    store = SnapshotHistory(str(tmp_path), downsample_after_days=1, downsample_seconds=3600)
+    day = datetime(2025, 1, 10, tzinfo=timezone.utc)
+    for minutes in (0, 20, 70):
+        store.append(day + timedelta(minutes=minutes), _data(minutes))
+    raw = os.path.join(str(tmp_path), "2025-01-10.seg")
+    backup = str(tmp_path / "raw.bak")
+    shutil.copy(raw, backup)
+    store.maintain(day + timedelta(days=3))
+    assert sorted(os.listdir(tmp_path)) == ["2025-01-10.ds.seg", "raw.bak"]
+
+    # A crash between writing the compacted file and removing the raw one leaves both
+    shutil.copy(backup, raw)
+    points = store.kpi_series(day, day + timedelta(days=1))
+    assert [p["total_leads"] for p in points] == [20, 70]
+
+    # The next maintenance removes the leftover instead of compacting it again
+    store.maintain(day + timedelta(days=3))
+    assert not os.path.exists(raw)
+    assert [p["total_leads"] for p in store.kpi_series(day, day + timedelta(days=1))] == [20, 70]
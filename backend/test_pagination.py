@@ -0,0 +1,87 @@
+"""Offline tests for keyset cursors (no database needed): python -m pytest test_pagination.py"""
+import asyncio
+import base64
+import json
+from datetime import date, datetime, timezone
+import pytest
+from pagination import InvalidCursor, decode_cursor, encode_cursor, filter_signature, keyset_branches
+
+
+def test_cursor_round_trip_keeps_types():
+    signature = filter_signature({"search": "ana", "base": None})
+    for fecha in (datetime(2025, 3, 1, 12, 30, tzinfo=timezone.utc), date(2025, 3, 1), None):
+        cursor = encode_cursor({"fecha_a_utilizar": fecha, "idinterno": 42}, signature)
+        assert decode_cursor(cursor, signature) == (fecha, 42)
+
+
+def test_filter_signature_ignores_empty_values_and_order():
+    assert filter_signature({"a": "1", "b": None, "c": ""}) == filter_signature({"a": "1"})
+    assert filter_signature({"a": "1", "b": "2"}) == filter_signature({"b": "2", "a": "1"})
+    assert filter_signature({"a": "1"}) != filter_signature({"a": "2"})
+
+
+def test_cursor_from_other_filters_is_rejected():
+    cursor = encode_cursor({"fecha_a_utilizar": None, "idinterno": 1}, filter_signature({"base": "A"}))
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, filter_signature({"base": "B"}))
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!!", base64.urlsafe_b64encode(b"{}").decode(), "e30"])
+def test_garbage_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, "sig")
+
+
+def test_tampered_cursor_is_rejected():
+    signature = filter_signature({"base": "A"})
+    cursor = encode_cursor({"fecha_a_utilizar": date(2025, 1, 1), "idinterno": 5}, signature)
+    payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    payload["s"] = "forged"
+    forged = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+    with pytest.raises(InvalidCursor):
+        decode_cursor(forged, signature)
+    payload["s"], payload["f"] = signature, ["d", "not-a-date"]
+    broken = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+    with pytest.raises(InvalidCursor):
+        decode_cursor(broken, signature)
+
+
+def test_keyset_branches_seek_dated_rows_then_the_null_tail():
+    branches = keyset_branches(date(2025, 1, 1), 9, 3)
+    assert branches == [
+        ("(fecha_a_utilizar, idinterno) < ($3, $4)", [date(2025, 1, 1), 9]),
+        ("fecha_a_utilizar IS NULL", []),
+    ]
+    # No OR: each branch is one index range
+    assert all(" OR " not in sql for sql, _ in branches)
+    assert keyset_branches(None, 9, 2) == [("fecha_a_utilizar IS NULL AND idinterno < $2", [9])]
+
+
+class _PlanConnection:
+    def __init__(self, plan):
+        self.plan = plan
+
+    async def fetchrow(self, query, *args):
+        return {"fecha_a_utilizar": date(2020, 1, 1), "idinterno": 5}
+
+    async def fetchval(self, query, *args):
+        assert "(fecha_a_utilizar, idinterno) < ($1, $2)" in query and args == (date(2020, 1, 1), 5)
+        return json.dumps([{"Plan": self.plan}])
+
+
+def test_keyset_plan_check_tells_seek_from_filter():
+    from indexes import check_keyset_plan
+
+    seek = {"Node Type": "Limit", "Plans": [{
+        "Node Type": "Index Scan", "Index Name": "ix_dim_contactos_fecha_id",
+        "Index Cond": "(ROW(fecha_a_utilizar, idinterno) < ROW($1, $2))",
+    }]}
+    report = asyncio.run(check_keyset_plan(_PlanConnection(seek)))
+    assert report["ok"] and report["index"] == "ix_dim_contactos_fecha_id"
+
+    scan = {"Node Type": "Limit", "Plans": [{
+        "Node Type": "Index Scan", "Index Name": "ix_dim_contactos_fecha_id",
+        "Filter": "((ROW(fecha_a_utilizar, idinterno) < ROW($1, $2)) OR (fecha_a_utilizar IS NULL))",
+    }]}
+    report = asyncio.run(check_keyset_plan(_PlanConnection(scan)))
+    assert report["ok"] is False and "IS NULL" in report["filter"]
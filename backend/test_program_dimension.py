@@ -0,0 +1,72 @@
+"""Offline tests for the dim_programa_nivel availability check: python -m pytest test_program_dimension.py"""
+import asyncio
+from contextlib import asynccontextmanager
+import pytest
+import program_dimension
+from program_dimension import dimension_available, invalidate_dimension
+
+
+class FakeConnection:
+    def __init__(self, exists):
+        self.exists = exists
+        self.checks = 0
+
+    async def fetchval(self, query, *args):
+        self.checks += 1
+        if isinstance(self.exists, Exception):
+            raise self.exists
+        return self.exists
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = FakeConnection(False)
+
+    @asynccontextmanager
+    async def acquire(workload):
+        yield conn
+
+    monkeypatch.setattr(program_dimension, "acquire", acquire)
+    monkeypatch.setattr(program_dimension, "_state", {"ready": None, "rows": 0, "synced_at": None, "last_error": None})
+    monkeypatch.setattr(program_dimension, "_synced", {"schema": False, "records": None, "checked_at": None})
+    clock = [1000.0]
+    monkeypatch.setattr(program_dimension.time, "monotonic", lambda: clock[0])
+    conn.clock = clock
+    return conn
+
+
+def test_missing_table_is_rechecked_after_ttl(conn, monkeypatch):
+    monkeypatch.setattr(program_dimension, "CHECK_SECONDS", 60)
+    assert asyncio.run(dimension_available()) is False
+    # The leader creates the table; cached False holds until the TTL passes
+    conn.exists = True
+    conn.clock[0] += 30
+    assert asyncio.run(dimension_available()) is False
+    conn.clock[0] += 31
+    assert asyncio.run(dimension_available()) is True
+    assert conn.checks == 2
+
+
+def test_available_table_is_rechecked_after_ttl(conn, monkeypatch):
+    monkeypatch.setattr(program_dimension, "CHECK_SECONDS", 60)
+    conn.exists = True
+    assert asyncio.run(dimension_available()) is True
+    conn.exists = False
+    conn.clock[0] += 61
+    assert asyncio.run(dimension_available()) is False
+
+
+def test_invalidate_forces_a_new_check(conn):
+    conn.exists = True
+    assert asyncio.run(dimension_available()) is True
+    conn.exists = False
+    invalidate_dimension(RuntimeError('relation "dim_programa_nivel" does not exist'))
+    assert program_dimension._state["last_error"].startswith("relation")
+    assert asyncio.run(dimension_available()) is False
+    assert conn.checks == 2
+
+
+def test_failed_check_reports_unavailable(conn):
+    conn.exists = OSError("connection refused")
+    assert asyncio.run(dimension_available()) is False
+    assert program_dimension._state["last_error"] == "connection refused"
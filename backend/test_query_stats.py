@@ -0,0 +1,120 @@
+"""Offline tests for the per-query-shape stats: python -m pytest test_query_stats.py"""
+import asyncio
+import database
+import query_stats as qs
+from query_stats import QueryStats, normalize_query
+
+
+def test_normalize_query():
+    assert normalize_query("SELECT *  FROM t\n WHERE a = 'x''y' AND b = 42") == "SELECT * FROM t WHERE a = ? AND b = ?"
+    assert normalize_query("SELECT * FROM t WHERE p IN ($1, $2,$3) AND q = $4") == \
+        "SELECT * FROM t WHERE p IN ($n...) AND q = $4"
+    # Digits in identifiers are part of the shape
+    assert normalize_query("SELECT col1 FROM t2 LIMIT 10") == "SELECT col1 FROM t2 LIMIT ?"
+
+
+def test_record_aggregates_per_shape():
+    stats = QueryStats(slow_ms=1000)
+    assert stats.record("SELECT 1 FROM t WHERE a = 5", wait=0.01, execute=0.1, rows=3, convert=0.002) is None
+    stats.record("SELECT 1 FROM t WHERE a = 7", wait=0.03, execute=0.3, rows=1, error=RuntimeError("x"))
+    [shape] = stats.snapshot()["shapes"]
+    assert shape["shape"] == "SELECT ? FROM t WHERE a = ?"
+    assert shape["calls"] == 2 and shape["errors"] == 1 and shape["slow"] == 0
+    assert shape["rows_total"] == 4
+    assert shape["wait_ms_max"] == 30.0
+    assert shape["exec_ms_avg"] == 200.0 and shape["exec_ms_max"] == 300.0
+    assert shape["convert_ms_avg"] == 1.0
+
+
+def test_disabled_records_nothing():
+    stats = QueryStats(enabled=False)
+    assert stats.record("SELECT 1", wait=0, execute=10) is None
+    assert stats.snapshot()["shapes"] == []
+
+
+def test_slow_log_is_bounded_newest_first():
+    stats = QueryStats(slow_ms=100, slow_log_size=2)
+    for i in range(3):
+        entry = stats.record(f"SELECT * FROM t{i}", wait=0, execute=0.5, rows=i)
+        assert entry["exec_ms"] == 500.0 and entry["plan"] is None
+    log = stats.snapshot()["slow_log"]
+    assert [e["shape"] for e in log] == ["SELECT * FROM t2", "SELECT * FROM t1"]
+
+
+def test_snapshot_orders_by_total_time_and_limits():
+    stats = QueryStats()
+    stats.record("SELECT a FROM fast", wait=0, execute=0.01)
+    stats.record("SELECT a FROM slow", wait=0, execute=0.2)
+    shapes = stats.snapshot(limit=1)["shapes"]
+    assert [s["shape"] for s in shapes] == ["SELECT a FROM slow"]
+
+
+def test_shape_overflow_bucket(monkeypatch):
+    monkeypatch.setattr(qs, "MAX_SHAPES", 2)
+    stats = QueryStats()
+    for table in ("a", "b", "c", "d"):
+        stats.record(f"SELECT x FROM {table}", wait=0, execute=0.01)
+    shapes = {s["shape"]: s["calls"] for s in stats.snapshot()["shapes"]}
+    assert shapes == {"SELECT x FROM a": 1, "SELECT x FROM b": 1, "<other>": 2}
+
+
+def test_should_explain_sampling_and_interval(monkeypatch):
+    assert not QueryStats(explain_sample_rate=0).should_explain("SELECT 1", "s")
+    stats = QueryStats(explain_sample_rate=0.5, explain_interval=60)
+    monkeypatch.setattr(qs.random, "random", lambda: 0.9)
+    assert not stats.should_explain("SELECT 1", "s")  # Not sampled
+    monkeypatch.setattr(qs.random, "random", lambda: 0.1)
+    # Writes are never EXPLAIN ANALYZEd
+    assert not stats.should_explain("DELETE FROM t", "d")
+    now = [1000.0]
+    monkeypatch.setattr(qs.time, "monotonic", lambda: now[0])
+    assert stats.should_explain("WITH x AS (SELECT 1) SELECT * FROM x", "s")
+    now[0] += 30
+    assert not stats.should_explain("SELECT 1", "s")  # Same shape within the interval
+    assert stats.should_explain("SELECT 1", "other")
+    now[0] += 31
+    assert stats.should_explain("SELECT 1", "s")
+
+
+def test_attach_plan_updates_entry_and_shape():
+    stats = QueryStats(slow_ms=0)
+    entry = stats.record("SELECT * FROM t", wait=0, execute=0.1)
+    stats.attach_plan(entry, "Seq Scan on t")
+    assert entry["plan"]["plan"] == "Seq Scan on t"
+    assert stats.snapshot()["shapes"][0]["last_plan"]["plan"] == "Seq Scan on t"
+    assert stats.snapshot()["slow_log"][0]["plan"]["plan"] == "Seq Scan on t"
+
+
+def test_reset_clears_everything(monkeypatch):
+    stats = QueryStats(slow_ms=0, explain_sample_rate=1)
+    entry = stats.record("SELECT 1", wait=0, execute=0.1)
+    assert stats.should_explain("SELECT 1", entry["shape"])
+    since = stats.since
+    stats.reset()
+    snapshot = stats.snapshot()
+    assert snapshot["shapes"] == [] and snapshot["slow_log"] == []
+    assert stats.since >= since
+    # The EXPLAIN interval starts over too
+    assert stats.should_explain("SELECT 1", entry["shape"])
+
+
+def test_fetch_all_conversion_time_excludes_pool_release(monkeypatch):
+    class SlowReleasePool:
+        async def acquire(self, timeout=None):
+            return self
+
+        async def fetch(self, query, *args):
+            return [{"a": 1}]
+
+        async def release(self, conn):
+            await asyncio.sleep(0.05)
+
+    workload = database.Workload("test", 0, 1, 1000, queue_limit=0, acquire_timeout=1, retry_after=1)
+    workload.pool = SlowReleasePool()
+    monkeypatch.setitem(database.workloads, database.INTERACTIVE, workload)
+    stats = QueryStats()
+    monkeypatch.setattr(database, "query_stats", stats)
+
+    assert asyncio.run(database.fetch_all("SELECT a FROM t")) == [{"a": 1}]
+    [shape] = stats.snapshot()["shapes"]
+    assert shape["convert_ms_avg"] < 20
@@ -0,0 +1,89 @@
+"""Offline tests for VersionedLRU: python -m pytest test_result_cache.py"""
+import asyncio
+import pytest
+from result_cache import VersionedLRU
+
+
+def test_eviction_keeps_most_recently_used():
+    lru = VersionedLRU(maxsize=2)
+    lru.set(1, "a", 1)
+    lru.set(1, "b", 2)
+    assert lru.get(1, "a") == 1  # "a" becomes most recent
+    lru.set(1, "c", 3)
+    assert lru.get(1, "b") is None
+    assert lru.get(1, "a") == 1 and lru.get(1, "c") == 3
+    assert len(lru) == 2
+
+
+def test_new_version_drops_entries():
+    lru = VersionedLRU()
+    lru.set(1, "a", 1)
+    assert lru.get(2, "a") is None
+    assert lru.get(1, "a") is None  # Old version was cleared too
+
+
+def test_ttl_expiry():
+    lru = VersionedLRU(ttl_seconds=0)
+    lru.set(1, "a", 1)
+    assert lru.get(1, "a", "missing") == "missing"
+
+
+def test_concurrent_misses_share_one_load():
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def main():
+        lru = VersionedLRU()
+        results = await asyncio.gather(*(lru.get_or_load(1, "k", load) for _ in range(5)))
+        assert results == ["value"] * 5
+        assert await lru.get_or_load(1, "k", load) == "value"
+        return lru
+
+    lru = asyncio.run(main())
+    assert calls == 1
+    assert lru.coalesced == 4 and lru.hits == 1
+    assert lru.status()["inflight"] == 0
+
+
+def test_errors_are_not_cached():
+    attempts = 0
+
+    async def load():
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise RuntimeError("boom")
+        return "ok"
+
+    async def main():
+        lru = VersionedLRU()
+        with pytest.raises(RuntimeError):
+            await lru.get_or_load(1, "k", load)
+        return await lru.get_or_load(1, "k", load)
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_load_for_outdated_version_is_discarded():
+    async def main():
+        lru = VersionedLRU()
+        release = asyncio.Event()
+
+        async def load():
+            await release.wait()
+            return "old"
+
+        pending = asyncio.create_task(lru.get_or_load(1, "k", load))
+        await asyncio.sleep(0)
+        lru.set(2, "other", "new")  # A refresh published version 2 meanwhile
+        release.set()
+        assert await pending == "old"
+        return lru
+
+    lru = asyncio.run(main())
+    assert not lru.has(1, "k") and not lru.has(2, "k")
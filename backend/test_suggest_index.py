@@ -0,0 +1,127 @@
+"""Offline tests for the typeahead index and its shared file: python -m pytest test_suggest_index.py"""
+import asyncio
+import numpy as np
+import suggest_index
+from suggest_index import LeadSuggester, ProgramSuggest, _IndexBuilder, load_index, read_index_version, write_index
+
+WATERMARK = [16384, 2, 0, 0]
+
+
+def _index(version=7, watermark=WATERMARK):
+    builder = _IndexBuilder()
+    builder.add_batch({
+        "idinterno": [1, 2],
+        "txtnombreapellido": ["José Pérez", "Ana Gómez"],
+        "emlmail": ["jose@mail.com", None],
+        "teltelefono": ["+54 11 2345 6789", None],
+        "txtprogramainteres": ["MEDICINA", "DERECHO"],
+    })
+    return builder.finish(version, watermark)
+
+
+class FakePrograms:
+    def names(self):
+        return ["MEDICINA", "DERECHO"]
+
+    def column(self, field):
+        return np.array([5, 3])
+
+
+def test_lookup_by_kind():
+    index = _index()
+    assert [l["idinterno"] for l in index.lookup("jose")] == [1]
+    assert index.lookup("gomez")[0] == {
+        "idinterno": 2, "txtnombreapellido": "Ana Gómez", "emlmail": None, "teltelefono": None,
+        "txtprogramainteres": "DERECHO", "match": "nombre",
+    }
+    assert index.lookup("1123 4")[0]["match"] == "telefono"
+    assert index.lookup("jose@")[0]["match"] == "email"
+    assert index.lookup("j") == []
+    programs = ProgramSuggest([("MEDICINA", 5), ("DERECHO", 3)])
+    assert programs.lookup("med") == [{"programa": "MEDICINA", "leads": 5}]
+    assert programs.lookup("jose") == []
+
+
+def test_shared_file_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot.bin.suggest")
+    assert read_index_version(path) == 0
+    index = _index()
+    write_index(path, index)
+    assert read_index_version(path) == 7
+    loaded = load_index(path)
+    assert loaded.version == 7
+    assert loaded.watermark == WATERMARK
+    # Mapped arrays, not copies
+    assert not loaded.refs.flags.owndata
+    for query in ("jose", "gomez", "1123", "jose@mail", "der"):
+        assert loaded.lookup(query) == index.lookup(query)
+
+
+def test_empty_index_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot.bin.suggest")
+    write_index(path, _IndexBuilder().finish(1, None))
+    loaded = load_index(path)
+    assert len(loaded) == 0 and loaded.lead_count == 0
+    assert loaded.lookup("jose") == []
+
+
+def test_follower_loads_each_version_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "snapshot.bin.suggest")
+    write_index(path, _index(version=3))
+    loads = []
+    monkeypatch.setattr(suggest_index, "load_index", lambda p: loads.append(p) or load_index(p))
+    suggester = LeadSuggester()
+    suggester.load_shared(path)
+    assert suggester.index.version == 3
+    suggester.load_shared(path)
+    assert len(loads) == 1
+
+
+def test_rebuild_skipped_while_dim_contactos_is_unchanged(monkeypatch):
+    builds = []
+
+    async def build(version, watermark=None, batch_size=20000):
+        builds.append(version)
+        return _index(version, watermark)
+
+    monkeypatch.setattr(suggest_index, "build_suggest_index", build)
+
+    async def main():
+        suggester = LeadSuggester()
+        suggester.rebuild(1, FakePrograms(), watermark=WATERMARK)
+        await suggester._task
+        # Only agg tables changed: programs follow the snapshot, leads stay
+        suggester.rebuild(2, FakePrograms(), watermark=list(WATERMARK))
+        assert not suggester.is_building
+        assert suggester.programs.version == 2 and suggester.index.version == 1
+        suggester.rebuild(3, FakePrograms(), watermark=[16384, 3, 0, 0])
+        await suggester._task
+        # Unknown watermark: can't tell, rebuild
+        suggester.rebuild(4, FakePrograms(), watermark=None)
+        await suggester._task
+        return suggester
+
+    suggester = asyncio.run(main())
+    assert builds == [1, 3, 4]
+    assert suggester.skipped == 1
+    assert suggester.lookup("med")["programas"] == [{"programa": "MEDICINA", "leads": 5}]
+
+
+def test_restarted_leader_reuses_a_matching_published_index(tmp_path, monkeypatch):
+    path = str(tmp_path / "snapshot.bin.suggest")
+    write_index(path, _index(version=5))
+
+    async def build(version, watermark=None, batch_size=20000):
+        raise AssertionError("should not rebuild")
+
+    monkeypatch.setattr(suggest_index, "build_suggest_index", build)
+
+    async def main():
+        suggester = LeadSuggester()
+        suggester.rebuild(1, FakePrograms(), watermark=WATERMARK, publish_path=path)
+        await suggester._task
+        return suggester
+
+    suggester = asyncio.run(main())
+    assert suggester.index.version == 5
+    assert suggester.last_error is None
@@ -0,0 +1,68 @@
+"""Offline tests for the streaming XLSX writer: python -m pytest test_xlsx_stream.py"""
+import io
+from datetime import date, datetime
+from decimal import Decimal
+import openpyxl
+from xlsx_stream import XlsxStreamWriter, column_letter
+
+
+def _write(columns, batches, sheet_name="Leads") -> bytes:
+    writer = XlsxStreamWriter(columns, sheet_name=sheet_name)
+    chunks = [writer.header()]
+    for batch in batches:
+        chunks.append(writer.write_rows(batch))
+    chunks.append(writer.close())
+    return b"".join(chunks)
+
+
+def test_column_letter():
+    assert [column_letter(i) for i in (1, 26, 27, 52, 703)] == ["A", "Z", "AA", "AZ", "AAA"]
+
+
+def test_openpyxl_reads_back_values_and_types():
+    content = _write(
+        [("ID", 10), ("NOMBRE", 30), ("FECHA", 18), ("DIA", 12), ("MONTO", 10), ("OK", 6)],
+        [
+            [(1, "Ana <&> \"x\"", datetime(2025, 1, 2, 3, 4, 5), date(2024, 5, 6), Decimal("1.5"), True)],
+            [(2, " José\x01 ", None, None, 2.25, False), (3, "", None, None, None, None)],
+        ],
+    )
+    wb = openpyxl.load_workbook(io.BytesIO(content))
+    ws = wb["Leads"]
+    rows = list(ws.iter_rows(values_only=True))
+    assert rows[0] == ("ID", "NOMBRE", "FECHA", "DIA", "MONTO", "OK")
+    assert rows[1] == (1, 'Ana <&> "x"', datetime(2025, 1, 2, 3, 4, 5), datetime(2024, 5, 6), 1.5, True)
+    # Illegal XML control characters are dropped, surrounding spaces kept
+    assert rows[2] == (2, " José ", None, None, 2.25, False)
+    assert rows[3][0] == 3
+    assert ws.column_dimensions["B"].width == 30
+    assert ws.freeze_panes == "A2"
+    assert ws["A1"].font.bold
+
+
+def test_header_only_workbook_is_valid():
+    ws = openpyxl.load_workbook(io.BytesIO(_write([("A", 5)], []))).active
+    assert ws.max_row == 1 and ws["A1"].value == "A"
+
+
+def test_sheet_name_is_sanitized():
+    wb = openpyxl.load_workbook(io.BytesIO(_write([("A", 5)], [[(1,)]], sheet_name="a/b:c" * 10)))
+    assert wb.sheetnames == [("a_b_c" * 10)[:31]]
+
+
+def test_output_is_emitted_incrementally():
+    writer = XlsxStreamWriter([("N", 8)])
+    assert writer.header().startswith(b"PK")
+    sizes = [len(writer.write_rows([(i, ) for i in range(j * 5000, (j + 1) * 5000)])) for j in range(5)]
+    assert any(sizes)  # Compressed rows leave before close()
+    assert writer.rows_written == 25000
+    writer.close()
+
+
+def test_non_finite_numbers_are_written_as_empty_cells():
+    content = _write(
+        [("A", 5), ("B", 5), ("C", 5), ("D", 5)],
+        [[(float("nan"), float("inf"), Decimal("-Infinity"), 1.0)]],
+    )
+    ws = openpyxl.load_workbook(io.BytesIO(content)).active
+    assert list(ws.iter_rows(min_row=2, values_only=True)) == [(None, None, None, 1)]
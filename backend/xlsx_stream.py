@@ -0,0 +1,205 @@
+"""
+Write-only XLSX writer that streams the workbook while rows are produced.
+
+An .xlsx file is a zip of XML parts. The zip is written to a non-seekable
+sink (entries use data descriptors instead of sizes patched in afterwards), so
+every compressed byte can be handed to the client as soon as it exists. The
+single worksheet is emitted row by row with inline strings (no shared-string
+table to keep in memory); column widths are fixed up front and alternate-row
+shading is a single conditional formatting rule, so memory stays flat no
+matter how many rows are exported.
+
+    writer = XlsxStreamWriter([("ID", 12), ("NOMBRE", 30)], sheet_name="Leads")
+    yield writer.header()
+    for batch in batches:
+        yield writer.write_rows(batch)   # sequences of cell values
+    yield writer.close()
+"""
+import math
+import re
+import zipfile
+from datetime import date, datetime, time
+from decimal import Decimal
+from xml.sax.saxutils import escape, quoteattr
+
+# Palette shared with the openpyxl-based reports
+HEADER_FILL = "1E3A8A"
+HEADER_FONT = "FFFFFF"
+BORDER_COLOR = "E2E8F0"
+STRIPE_FILL = "F8FAFC"
+
+# cellXfs indexes in the stylesheet below
+_STYLE_HEADER = 1
+_STYLE_CELL = 2
+_STYLE_DATETIME = 3
+_STYLE_DATE = 4
+
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+_ILLEGAL_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_SHEET_NAME_INVALID = re.compile(r"[\[\]:*?/\\]")
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>"""
+
+_ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name={name} sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+_STYLES = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="2"><numFmt numFmtId="164" formatCode="dd/mm/yyyy hh:mm"/><numFmt numFmtId="165" formatCode="dd/mm/yyyy"/></numFmts>
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><color rgb="FF{HEADER_FONT}"/><name val="Calibri"/></font></fonts>
+<fills count="3"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill><fill><patternFill patternType="solid"><fgColor rgb="FF{HEADER_FILL}"/><bgColor rgb="FF{HEADER_FILL}"/></patternFill></fill></fills>
+<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border><border><left style="thin"><color rgb="FF{BORDER_COLOR}"/></left><right style="thin"><color rgb="FF{BORDER_COLOR}"/></right><top style="thin"><color rgb="FF{BORDER_COLOR}"/></top><bottom style="thin"><color rgb="FF{BORDER_COLOR}"/></bottom><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="5">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="0" fontId="1" fillId="2" borderId="1" xfId="0" applyFont="1" applyFill="1" applyBorder="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+<xf numFmtId="0" fontId="0" fillId="0" borderId="1" xfId="0" applyBorder="1"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="1" xfId="0" applyNumberFormat="1" applyBorder="1"/>
+<xf numFmtId="165" fontId="0" fillId="0" borderId="1" xfId="0" applyNumberFormat="1" applyBorder="1"/>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+<dxfs count="1"><dxf><fill><patternFill patternType="solid"><bgColor rgb="FF{STRIPE_FILL}"/></patternFill></fill></dxf></dxfs>
+</styleSheet>"""
+
+
+def column_letter(index: int) -> str:
+    """1 -> A, 27 -> AA."""
+    letters = ""
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+class _Sink:
+    """Non-seekable zip target that hands out whatever has been written so far."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _text_cell(ref: str, text: str) -> str:
+    text = escape(_ILLEGAL_XML.sub("", text))
+    space = ' xml:space="preserve"' if text[:1].isspace() or text[-1:].isspace() else ""
+    return f'<c r="{ref}" t="inlineStr" s="{_STYLE_CELL}"><is><t{space}>{text}</t></is></c>'
+
+
+def _cell(ref: str, value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b" s="{_STYLE_CELL}"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        if not (value.is_finite() if isinstance(value, Decimal) else math.isfinite(value)):
+            # NaN/inf have no SpreadsheetML number form: leave the cell empty
+            return ""
+        return f'<c r="{ref}" s="{_STYLE_CELL}"><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        serial = (value.replace(tzinfo=None) - _EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c r="{ref}" s="{_STYLE_DATETIME}"><v>{serial!r}</v></c>'
+    if isinstance(value, date):
+        return f'<c r="{ref}" s="{_STYLE_DATE}"><v>{(value - _EXCEL_EPOCH.date()).days}</v></c>'
+    if isinstance(value, time):
+        return _text_cell(ref, value.isoformat())
+    return _text_cell(ref, str(value))
+
+
+class XlsxStreamWriter:
+    def __init__(self, columns: list[tuple[str, float]], sheet_name: str = "Sheet1", compresslevel: int = 6):
+        """`columns`: (header, width) pairs, in row order."""
+        self.columns = columns
+        self.letters = [column_letter(i + 1) for i in range(len(columns))]
+        self.sheet_name = _SHEET_NAME_INVALID.sub("_", sheet_name)[:31] or "Sheet1"
+        self.rows_written = 0
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        self._sheet = None
+
+    def header(self) -> bytes:
+        """Static workbook parts plus the sheet preamble and header row."""
+        self._zip.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        self._zip.writestr("_rels/.rels", _ROOT_RELS)
+        self._zip.writestr("xl/workbook.xml", _WORKBOOK.format(name=quoteattr(self.sheet_name)))
+        self._zip.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        self._zip.writestr("xl/styles.xml", _STYLES)
+        # Size unknown up front: zip64 so exports past 4 GiB uncompressed stay valid
+        self._sheet = self._zip.open("xl/worksheets/sheet1.xml", "w", force_zip64=True)
+        cols = "".join(
+            f'<col min="{i}" max="{i}" width="{width}" customWidth="1"/>'
+            for i, (_, width) in enumerate(self.columns, start=1)
+        )
+        head = "".join(
+            f'<c r="{letter}1" t="inlineStr" s="{_STYLE_HEADER}"><is><t>{escape(str(name))}</t></is></c>'
+            for letter, (name, _) in zip(self.letters, self.columns)
+        )
+        self._write(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+            '</sheetView></sheetViews>'
+            f"<cols>{cols}</cols><sheetData><row r=\"1\">{head}</row>"
+        )
+        return self._sink.drain()
+
+    def write_rows(self, rows) -> bytes:
+        """Append rows (sequences of cell values); returns the compressed bytes ready to send."""
+        parts = []
+        letters = self.letters
+        row_number = self.rows_written + 1
+        for row in rows:
+            row_number += 1
+            cells = "".join(_cell(f"{letter}{row_number}", value) for letter, value in zip(letters, row))
+            parts.append(f'<row r="{row_number}">{cells}</row>')
+        self.rows_written = row_number - 1
+        self._write("".join(parts))
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        """Finish the sheet and the zip central directory; returns the remaining bytes."""
+        stripes = ""
+        if self.rows_written and self.columns:
+            # One rule for the whole range instead of a fill on every other row
+            last = f"{self.letters[-1]}{self.rows_written + 1}"
+            stripes = (
+                f'<conditionalFormatting sqref="A2:{last}"><cfRule type="expression" dxfId="0" priority="1">'
+                "<formula>MOD(ROW(),2)=0</formula></cfRule></conditionalFormatting>"
+            )
+        self._write(f"</sheetData>{stripes}</worksheet>")
+        self._sheet.close()
+        self._zip.close()
+        return self._sink.drain()
+
+    def _write(self, xml: str):
+        self._sheet.write(xml.encode("utf-8"))
@@ -45,7 +45,6 @@ export const api = {
     kpis: async (nivel) => {
         const q = new URLSearchParams();
         if (nivel) q.set('nivel', nivel);
-        q.set('t', Date.now());
         const res = await request(`/api/dashboard/kpis?${q.toString()}`);
 
         // Hotfix: If backend hasn't been re-deployed to include global op_venta sum
@@ -66,7 +65,6 @@ export const api = {
     funnel: async (nivel) => {
         const q = new URLSearchParams();
         if (nivel) q.set('nivel', nivel);
-        q.set('t', Date.now());
         const res = await request(`/api/dashboard/funnel?${q.toString()}`);
 
         // Hotfix for funnel op_venta
@@ -91,7 +89,6 @@ export const api = {
     admisiones: async (nivel) => {
         const q = new URLSearchParams();
         if (nivel) q.set('nivel', nivel);
-        q.set('t', Date.now());
         const res = await request(`/api/dashboard/admisiones?${q.toString()}`);
         dashboardContext.admisiones = res;
         return res;
@@ -99,7 +96,6 @@ export const api = {
     estados: async (nivel) => {
         const q = new URLSearchParams();
         if (nivel) q.set('nivel', nivel);
-        q.set('t', Date.now());
         const res = await request(`/api/dashboard/estados?${q.toString()}`);
         dashboardContext.estados = res;
         return res;
@@ -115,7 +111,7 @@ export const api = {
     noUtilCsv: async () => {
         // Fetch the CSV as blob and trigger browser download
         const token = localStorage.getItem('unab_token');
-        const res = await fetch(`${API_URL}/api/dashboard/no-util-csv`, {
+        const res = await fetch(`${API_URL}/api/dashboard/no-util-csv?gzip=true`, {
             headers: { Authorization: `Bearer ${token}` },
         });
         if (!res.ok) throw new Error('Error descargando CSV');
@@ -139,7 +135,12 @@ export const api = {
         Object.entries(params).forEach(([k, v]) => { if (v) q.set(k, v); });
         return request(`/api/dashboard/leads?${q.toString()}`);
     },
+    suggestLeads: (query, limit = 10) => {
+        const q = new URLSearchParams({ q: query, limit });
+        return request(`/api/dashboard/leads/suggest?${q.toString()}`);
+    },
     bases: () => request('/api/dashboard/bases'),
+    catalog: () => request('/api/dashboard/catalog'),
     estadosGestion: () => request('/api/dashboard/estados-gestion'),
     meta: () => request('/api/dashboard/meta'),
     refresh: () => request('/api/dashboard/refresh', { method: 'POST' }),
@@ -173,6 +174,24 @@ export const api = {
         document.body.removeChild(a);
     },
 
+    exportLeadsCsv: async (params = {}) => {
+        const q = new URLSearchParams({ gzip: 'true' });
+        Object.entries(params).forEach(([k, v]) => { if (v) q.set(k, v); });
+        const res = await fetch(`${API_URL}/api/dashboard/export-csv?${q.toString()}`, {
+            headers: authHeaders(),
+        });
+        if (!res.ok) throw new Error('Error al exportar CSV');
+        const blob = await res.blob();
+        const url = window.URL.createObjectURL(blob);
+        const a = document.createElement('a');
+        a.href = url;
+        a.download = `Reporte_Leads_${new Date().toISOString().split('T')[0]}.csv`;
+        document.body.appendChild(a);
+        a.click();
+        window.URL.revokeObjectURL(url);
+        document.body.removeChild(a);
+    },
+
     exportAdmisiones: async (nivel) => {
         const q = new URLSearchParams();
         if (nivel) q.set('nivel', nivel);